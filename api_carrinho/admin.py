@@ -0,0 +1,46 @@
+"""
+Este módulo implementa a autenticação das rotas administrativas da API, chamadas pelas
+rotinas de retaguarda e não pelo _frontend_ (ex: a reprecificação em lote).
+
+As rotas administrativas exigem o token da variável de ambiente `ADMIN_TOKEN` no
+cabeçalho `Authorization: Bearer <token>`. Sem a variável, elas ficam desativadas e
+recusam todas as requisições.
+"""
+
+import hmac
+from os import environ
+from typing import Optional
+
+
+class AcessoNegadoError(Exception):
+    """
+    Requisição a uma rota administrativa sem um token de administração válido.
+    """
+
+
+# Token das rotas administrativas (None: rotas desativadas).
+_TOKEN: Optional[str] = environ.get("ADMIN_TOKEN") or None
+
+
+def define_token(token: Optional[str]) -> None:
+    """
+    Substitui o token das rotas administrativas (ex: para ativá-las em testes). None ou
+    vazio desativa as rotas.
+    """
+    global _TOKEN
+    _TOKEN = token or None
+
+
+def confere(autorizacao: Optional[str]) -> None:
+    """
+    Confere o cabeçalho Authorization de uma requisição a uma rota administrativa.
+    Levanta AcessoNegadoError caso as rotas estejam desativadas ou o token esteja ausente
+    ou seja inválido.
+    """
+    if _TOKEN is None:
+        raise AcessoNegadoError("rotas administrativas desativadas (defina ADMIN_TOKEN)")
+    esquema, _, token = (autorizacao or "").partition(" ")
+    if esquema.lower() != "bearer" or not hmac.compare_digest(
+        token.strip().encode("utf-8"), _TOKEN.encode("utf-8")
+    ):
+        raise AcessoNegadoError("token de administração ausente ou inválido")
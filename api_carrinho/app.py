@@ -1,19 +1,83 @@
+from contextlib import ExitStack, contextmanager
+from copy import deepcopy
 from functools import wraps
 from os import environ
-from typing import Dict
+from time import perf_counter, time
+from typing import Any, Dict, Iterator, Optional, Tuple
 
-from flask import Flask, request
+from flask import Flask, Response, g, request
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import BadRequest
 
-from api_carrinho import __VERSION__
+from api_carrinho import (
+    __VERSION__,
+    admin,
+    exportacao,
+    metricas,
+    operacoes,
+    perfil,
+    precos,
+    serializacao,
+)
+from api_carrinho.cache import CacheRespostas
 from api_carrinho.log import log
 from api_carrinho.models.carrinho import Carrinho
-from api_carrinho.models.produto import Produto
-from api_carrinho.persist.carrinhos import db_carrinho_fetch, db_carrinho_save
+from api_carrinho.operacoes import (
+    ERROS_CONFLITO,
+    ERROS_REQUISICAO_INVALIDA,
+    carrinho_dados,
+    confere_versao,
+    descricoes_faltantes,
+    etag_carrinho,
+    versao_etag,
+    versao_parametro,
+)
+from api_carrinho.persist.carrinhos import (
+    CarrinhoVersaoConflitoError,
+    db_carrinho_com_produtos,
+    db_carrinho_delete,
+    db_carrinho_do_cliente,
+    db_carrinho_fetch,
+    db_carrinho_restaura,
+    db_carrinho_save,
+)
 from api_carrinho.persist.cupons import db_cupom_fetch
-from api_carrinho.persist.produtos import ProdutoSemEstoqueError, db_produto_fetch
+from api_carrinho.persist.estoque import TransacaoReservas, db_estoque_transacao
+from api_carrinho.persist.produtos import (
+    db_produto_atualiza_precos,
+    db_produto_fetch,
+    db_produto_fetch_many,
+)
+from api_carrinho.travas import TabelaTravas
 
 app = Flask(__name__)
 
+# Respostas de GET /carrinho/<codigo> já serializadas, validadas pela versão do carrinho.
+_CACHE_CARRINHOS = CacheRespostas(
+    maximo=int(environ.get("CACHE_CARRINHOS_MAXIMO", 10000))
+)
+
+# Travas por carrinho, serializando as alterações em um mesmo carrinho entre threads.
+_TRAVAS_CARRINHOS = TabelaTravas(int(environ.get("TRAVAS_CARRINHOS", 1024)))
+
+# Erros esperados nas requisições (inclusive parâmetros ausentes), registrados sem o
+# traceback.
+_ERROS_ESPERADOS = operacoes.ERROS_ESPERADOS + (
+    admin.AcessoNegadoError,
+    BadRequest,
+    exportacao.FiltroInvalidoError,
+    precos.PrecosInvalidosError,
+)
+
+
+@app.before_first_request
+def _restaura_carrinhos() -> None:
+    """
+    Recupera os carrinhos persistidos pela execução anterior (ex: pelo diário), antes de
+    atender a primeira requisição.
+    """
+    db_carrinho_restaura()
+
 
 def return_wrapper(f):
     """
@@ -22,6 +86,7 @@ def return_wrapper(f):
 
     * As funções da API sempre devem retornar um dicionário com dados compatíveis com JSON
       (bool, str, int, float).
+    * O retorno é serializado com `api_carrinho.serializacao` (orjson, caso instalado).
     * Caso a função da API não levante uma exceção, este decorator preparará o retorno da
       seguinte forma:
       { "sucesso": true, "dados": { ... dados da função da API ... } }
@@ -30,165 +95,503 @@ def return_wrapper(f):
       { "sucesso": false, "erro": {
             "tipo": "NomeDaExcecao", "descricao": "valor da exceção"
         }}
+    * Caso a função da API retorne um objeto Response, ele é retornado sem alterações. A
+      função fica responsável por já ter preparado o retorno no formato acima.
+    * Exceções de erros de negócio esperados (ex: carrinho inexistente) são registradas
+      no log sem o traceback.
+    * Os erros de requisições malformadas (`operacoes.ERROS_REQUISICAO_INVALIDA`, ex:
+      versão esperada inválida) são retornados com o status HTTP 400, o acesso negado a
+      uma rota administrativa com o status HTTP 401 e os conflitos entre alterações
+      concorrentes (`operacoes.ERROS_CONFLITO`) com o status HTTP 409.
+    * Caso as métricas estejam ativadas, registra a duração e a exceção da requisição.
     """
 
     @wraps(f)
     def wrapper(*args, **kwargs):
+        inicio = perf_counter()
+        erro = None
         try:
             # Chama a função da API e retorna seu dicionário de retorno ...
-            return {"sucesso": True, "dados": f(*args, **kwargs)}
+            dados = f(*args, **kwargs)
+            if isinstance(dados, Response):
+                return dados
+            return _resposta_json({"sucesso": True, "dados": dados})
         except Exception as ex:
             # ... ou retorna a exceção caso ocorra.
-            log.exception("exceção encontrada: %s", ex)
-            return {
-                "sucesso": False,
-                "erro": {"tipo": str(ex.__class__.__name__), "descricao": str(ex)},
-            }
+            erro = ex
+            if isinstance(ex, _ERROS_ESPERADOS):
+                log.info("erro na requisição: %s: %s", ex.__class__.__name__, ex)
+            else:
+                log.exception("exceção encontrada: %s", ex)
+            resposta = _resposta_json(
+                {
+                    "sucesso": False,
+                    "erro": {"tipo": str(ex.__class__.__name__), "descricao": str(ex)},
+                }
+            )
+            if isinstance(ex, ERROS_REQUISICAO_INVALIDA):
+                resposta.status_code = 400
+            elif isinstance(ex, admin.AcessoNegadoError):
+                resposta.status_code = 401
+                resposta.headers["WWW-Authenticate"] = "Bearer"
+            elif isinstance(ex, ERROS_CONFLITO):
+                resposta.status_code = 409
+            return resposta
+        finally:
+            if metricas.ativas():
+                metricas.registra_requisicao(request.url_rule.rule, inicio, erro)
+
+    return wrapper
+
+
+def admin_wrapper(f):
+    """
+    Este decorator restringe uma rota às rotinas de retaguarda, exigindo o token de
+    administração (ver `api_carrinho.admin`). Deve ser envolvido pelo `return_wrapper`,
+    que retorna o acesso negado no formato da API.
+    """
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        admin.confere(request.headers.get("Authorization"))
+        return f(*args, **kwargs)
+
+    return wrapper
+
+
+def perfil_wrapper(f):
+    """
+    Este decorator executa uma fração das requisições com o perfilador (ver
+    `api_carrinho.perfil`), identificando o perfil pela rota e pelo código do carrinho.
+    Deve envolver o `return_wrapper`, para incluir o tratamento do retorno no perfil.
+    """
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if not perfil.sorteia():
+            return f(*args, **kwargs)
+        carrinho = kwargs.get("codigo")
+        if carrinho is None:
+            try:
+                carrinho = _parametros().get("carrinho")
+            except BadRequest:
+                pass
+        return perfil.executa(request.url_rule.rule, carrinho, f, *args, **kwargs)
 
     return wrapper
 
 
+def _resposta_json(dados: Dict) -> Response:
+    """
+    Cria uma resposta JSON, serializada com `api_carrinho.serializacao`.
+    """
+    return app.response_class(
+        serializacao.codifica(dados), mimetype=app.config["JSONIFY_MIMETYPE"]
+    )
+
+
+def _corpo_json() -> Any:
+    """
+    Retorna o corpo da requisição decodificado como JSON, independente do Content-Type.
+    Levanta BadRequest caso seja inválido.
+    """
+    try:
+        return serializacao.decodifica(request.get_data())
+    except ValueError:
+        raise BadRequest("corpo da requisição não é um JSON válido")
+
+
+def _parametros() -> MultiDict:
+    """
+    Retorna os parâmetros enviados no corpo da requisição: um objeto JSON, com o
+    Content-Type application/json, ou um formulário. Nos dois casos, um parâmetro
+    obrigatório ausente levanta BadRequestKeyError.
+    """
+    if "parametros" not in g:
+        if request.is_json:
+            corpo = _corpo_json()
+            g.parametros = MultiDict(corpo if isinstance(corpo, dict) else {})
+        else:
+            g.parametros = request.form
+    return g.parametros
+
+
+def _versao_esperada() -> Optional[int]:
+    """
+    Retorna a versão do carrinho esperada pela requisição, informada no parâmetro
+    `versao` (query string ou corpo) ou no cabeçalho If-Match (no formato do ETag de
+    /carrinho, ex: "v3"). Retorna None caso não seja informada, e levanta
+    VersaoInvalidaError caso seja inválida.
+    """
+    versao = request.args.get("versao", _parametros().get("versao"))
+    if versao is not None:
+        return versao_parametro(versao)
+    return versao_etag(request.if_match.as_set())
+
+
+@contextmanager
+def _altera_carrinho(
+    codigo: str, copia: bool = False
+) -> Iterator[Tuple[Carrinho, TransacaoReservas]]:
+    """
+    Obtém um carrinho da persistência para alteração, gravando-o ao final caso não ocorra
+    uma exceção. Toda a operação é feita com a trava do carrinho, de forma que alterações
+    concorrentes no mesmo carrinho são serializadas.
+
+    Junto com o carrinho, retorna uma transação de reservas de estoque, desfeita caso
+    ocorra uma exceção (inclusive na gravação).
+
+    A gravação é condicional à versão lida, detectando alterações feitas por outros
+    processos. Caso a requisição informe a versão esperada do carrinho (`versao` ou
+    If-Match) e ela seja diferente da atual, levanta CarrinhoVersaoConflitoError sem
+    alterar o carrinho.
+
+    Com copia=True, as alterações são feitas em uma cópia do carrinho, que só substitui o
+    carrinho persistido caso não ocorra uma exceção.
+    """
+    versao_esperada = _versao_esperada()
+    with _TRAVAS_CARRINHOS.trava(codigo):
+        carrinho = db_carrinho_fetch(codigo)
+        confere_versao(carrinho, versao_esperada)
+        versao_anterior = carrinho.versao
+        if copia:
+            carrinho = deepcopy(carrinho)
+        reservas = db_estoque_transacao()
+        try:
+            yield carrinho, reservas
+            db_carrinho_save(
+                carrinho, versao_anterior=versao_anterior, estoques=reservas.estoques
+            )
+        except BaseException:
+            reservas.desfaz()
+            raise
+
+
+@contextmanager
+def _trava_carrinhos(*codigos: str) -> Iterator[None]:
+    """
+    Adquire as travas de vários carrinhos, sempre na mesma ordem, evitando deadlocks
+    entre requisições que travam os mesmos carrinhos.
+    """
+    with ExitStack() as pilha:
+        for trava in _TRAVAS_CARRINHOS.travas(*codigos):
+            pilha.enter_context(trava)
+        yield
+
+
+def _carrinho_dados(carrinho: Carrinho, agora: Optional[float] = None) -> Dict:
+    """
+    Retorna a representação em dicionário de todo o carrinho de compras, obtendo as
+    descrições dos produtos do cadastro em uma única consulta.
+    """
+    cadastro = db_produto_fetch_many(descricoes_faltantes(carrinho))
+    return carrinho_dados(carrinho, cadastro, agora)
+
+
 @app.post("/novo")
+@perfil_wrapper
 @return_wrapper
 def novo() -> Dict:
     """
     Cria um novo cupom de desconto, persistindo. Gera e retorna um código (UUID4).
     """
-    cliente = request.form.get("cliente")
+    cliente = _parametros().get("cliente")
     carrinho = Carrinho(cliente=cliente)
     db_carrinho_save(carrinho)
     return {"carrinho_codigo": carrinho.codigo}
 
 
 @app.post("/cliente-define")
+@perfil_wrapper
 @return_wrapper
 def define_cliente() -> Dict:
     """
     Altera o cliente associado ao carrinho.
     """
-    cliente = int(request.form["cliente"])
-    carrinho_codigo = request.form["carrinho"]
-    carrinho = db_carrinho_fetch(carrinho_codigo)
-    carrinho.define_cliente(cliente)
+    parametros = _parametros()
+    cliente = int(parametros["cliente"])
+    carrinho_codigo = parametros["carrinho"]
+    with _altera_carrinho(carrinho_codigo) as (carrinho, reservas):
+        operacoes.cliente_define(carrinho, reservas, cliente)
     return {}
 
 
 @app.post("/produto-adiciona")
+@perfil_wrapper
 @return_wrapper
 def produto_adiciona() -> Dict:
     """
     Adiciona um produto em um carrinho de compras.
     """
-    carrinho_codigo = request.form["carrinho"]
-    produto_codigo = request.form["produto"]
-    carrinho = db_carrinho_fetch(carrinho_codigo)
-    produto_persisted = db_produto_fetch(produto_codigo)
-    produto = Produto(
-        codigo=produto_persisted.codigo,
-        descricao=produto_persisted.descricao,
-        preco_de=produto_persisted.preco_de,
-        preco_por=produto_persisted.preco_por,
-        quantidade=1,
-    )
-    carrinho.adiciona_produto(produto)
+    parametros = _parametros()
+    carrinho_codigo = parametros["carrinho"]
+    produto_codigo = parametros["produto"]
+    with _altera_carrinho(carrinho_codigo) as (carrinho, reservas):
+        operacoes.produto_adiciona(carrinho, reservas, db_produto_fetch(produto_codigo))
     return {}
 
 
 @app.post("/produto-remove")
+@perfil_wrapper
 @return_wrapper
 def produto_remove() -> Dict:
     """
     Remove um produto de um carrinho de compras.
     """
-    carrinho_codigo = request.form["carrinho"]
-    produto_codigo = request.form["produto"]
-    carrinho = db_carrinho_fetch(carrinho_codigo)
-    carrinho.remove_produto(produto_codigo)
+    parametros = _parametros()
+    carrinho_codigo = parametros["carrinho"]
+    produto_codigo = parametros["produto"]
+    with _altera_carrinho(carrinho_codigo) as (carrinho, reservas):
+        operacoes.produto_remove(carrinho, reservas, produto_codigo)
     return {}
 
 
 @app.post("/produto-define-quantidade")
+@perfil_wrapper
 @return_wrapper
 def produto_define_quantidade() -> Dict:
     """
     Altera a quantidade de um produto em um carrinho de compras.
     """
-    carrinho_codigo = request.form["carrinho"]
-    produto_codigo = request.form["produto"]
-    quantidade = int(request.form["quantidade"])
-    carrinho = db_carrinho_fetch(carrinho_codigo)
-    produto_persisted = db_produto_fetch(produto_codigo)
-    if produto_persisted.estoque < quantidade:
-        raise ProdutoSemEstoqueError(
-            "produto %s sem estoque suficiente (estoque: %d, carrinho: %d)"
-            % (
-                produto_codigo,
-                produto_persisted.estoque,
-                quantidade,
-            )
-        )
-
-    carrinho.define_produto_quantidade(produto_codigo, quantidade)
+    parametros = _parametros()
+    carrinho_codigo = parametros["carrinho"]
+    produto = db_produto_fetch(parametros["produto"])
+    quantidade = int(parametros["quantidade"])
+    with _altera_carrinho(carrinho_codigo) as (carrinho, reservas):
+        operacoes.produto_define_quantidade(carrinho, reservas, produto, quantidade)
     return {}
 
 
 @app.post("/limpa")
+@perfil_wrapper
 @return_wrapper
 def limpa() -> Dict:
     """
     Remove todos os produtos de um carrinho de compras.
     """
-    carrinho_codigo = request.form["carrinho"]
-    carrinho = db_carrinho_fetch(carrinho_codigo)
-    carrinho.remove_todos_produtos()
+    parametros = _parametros()
+    carrinho_codigo = parametros["carrinho"]
+    with _altera_carrinho(carrinho_codigo) as (carrinho, reservas):
+        operacoes.limpa(carrinho, reservas)
     return {}
 
 
 @app.post("/cupom-define")
+@perfil_wrapper
 @return_wrapper
 def cupom_define() -> Dict:
     """
     Associa um cupom de desconto em um carrinho de compras.
     """
-    carrinho_codigo = request.form["carrinho"]
-    cupom_codigo = request.form["cupom"]
-    carrinho = db_carrinho_fetch(carrinho_codigo)
-    cupom = db_cupom_fetch(cupom_codigo)
-    carrinho.define_cupom_desconto(cupom)
+    parametros = _parametros()
+    carrinho_codigo = parametros["carrinho"]
+    cupom_codigo = parametros["cupom"]
+    with _altera_carrinho(carrinho_codigo) as (carrinho, reservas):
+        operacoes.cupom_define(carrinho, reservas, db_cupom_fetch(cupom_codigo))
     return {}
 
 
+@app.post("/carrinho/<codigo>/operacoes")
+@perfil_wrapper
+@return_wrapper
+def carrinho_operacoes(codigo: str) -> Dict:
+    """
+    Aplica uma lista de operações (JSON) em um carrinho de compras, de forma atômica:
+    caso alguma operação falhe, nenhuma é gravada. Retorna o carrinho resultante.
+    """
+    lote = operacoes.prepara_operacoes(_corpo_json())
+    produtos, cupons = operacoes.codigos_cadastro(lote)
+    lote = operacoes.resolve_cadastro(
+        lote,
+        db_produto_fetch_many(produtos),
+        {cupom: db_cupom_fetch(cupom) for cupom in cupons},
+    )
+    # As operações são aplicadas em uma cópia, que só substitui o carrinho persistido
+    # caso todas sejam aplicadas com sucesso.
+    with _altera_carrinho(codigo, copia=True) as (carrinho, reservas):
+        operacoes.aplica_operacoes(carrinho, reservas, lote)
+        return _carrinho_dados(carrinho)
+
+
 @app.get("/carrinho/<codigo>")
+@perfil_wrapper
 @return_wrapper
-def carrinho(codigo: str) -> Dict:
+def carrinho(codigo: str) -> Response:
     """
     Retorna uma representação em JSON de todo o carrinho de compras.
+
+    A resposta serializada fica em cache até a próxima alteração do carrinho ou a
+    expiração do seu cupom, e usa a versão do carrinho como ETag (ver `etag_carrinho()`):
+    caso o cliente envie If-None-Match com o ETag atual, é retornado o status HTTP 304,
+    sem corpo.
+    """
+    # A trava garante que o carrinho não está no meio de uma alteração enquanto a
+    # representação é gerada, o que deixaria em cache dados de uma versão incompleta.
+    with _TRAVAS_CARRINHOS.trava(codigo):
+        carrinho = db_carrinho_fetch(codigo)
+        agora = time()
+        etag = etag_carrinho(carrinho, agora)
+        if request.if_none_match.contains(etag):
+            resposta = app.response_class(status=304)
+        else:
+            corpo = _CACHE_CARRINHOS.obtem(codigo, etag)
+            if corpo is None:
+                corpo = serializacao.codifica(
+                    {"sucesso": True, "dados": _carrinho_dados(carrinho, agora)}
+                )
+                _CACHE_CARRINHOS.grava(codigo, etag, corpo)
+            resposta = app.response_class(corpo, mimetype=app.config["JSONIFY_MIMETYPE"])
+    resposta.set_etag(etag)
+    resposta.headers["Cache-Control"] = "no-cache"
+    return resposta
+
+
+def _exporta(filtro: exportacao.FiltroExportacao) -> Iterator[bytes]:
+    """
+    Gera a exportação dos carrinhos selecionados, uma parte por lote. Cada carrinho é
+    representado uma única vez com sua trava, como em /carrinho/<codigo>, e as descrições
+    dos produtos do lote são obtidas do cadastro em uma única consulta, já sem as travas.
+
+    Como a resposta já foi iniciada, um erro durante a geração é registrado no log e
+    interrompe a exportação.
+    """
+    try:
+        for carrinhos in exportacao.lotes(filtro):
+            representacoes = []
+            for carrinho in carrinhos:
+                with _TRAVAS_CARRINHOS.trava(carrinho.codigo):
+                    representacoes.append(exportacao.representa(carrinho))
+            cadastro = db_produto_fetch_many(
+                {codigo for _, faltantes in representacoes for codigo in faltantes}
+            )
+            yield exportacao.codifica(representacoes, cadastro)
+    except Exception as ex:
+        log.exception("exceção na exportação de carrinhos: %s", ex)
+
+
+@app.post("/carrinho/<codigo>/mescla")
+@perfil_wrapper
+@return_wrapper
+def carrinho_mescla(codigo: str) -> Dict:
+    """
+    Mescla um carrinho de compras (`origem`) no carrinho da URL, somando seus produtos,
+    e remove a origem. Os dois carrinhos devem ser anônimos ou do `cliente` informado.
+    Retorna o carrinho resultante.
+    """
+    parametros = _parametros()
+    origem_codigo = parametros["origem"]
+    cliente = str(parametros["cliente"])
+    versao_esperada = _versao_esperada()
+    with _trava_carrinhos(codigo, origem_codigo):
+        destino = db_carrinho_fetch(codigo)
+        confere_versao(destino, versao_esperada)
+        versao_anterior = destino.versao
+        origem = db_carrinho_fetch(origem_codigo)
+        operacoes.confere_mescla(destino, origem, cliente)
+        # Remove a origem somente na versão obtida, antes de alterar o destino, liberando
+        # suas reservas, transferidas para o destino pela mescla.
+        try:
+            db_carrinho_delete(origem_codigo, versao=origem.versao)
+        except CarrinhoVersaoConflitoError as ex:
+            raise operacoes.MesclaConflitoError(str(ex))
+        # Como em _altera_carrinho(copia=True): o destino persistido só é substituído
+        # caso a cópia mesclada seja gravada.
+        destino = deepcopy(destino)
+        reservas = db_estoque_transacao()
+        try:
+            operacoes.mescla(destino, reservas, origem)
+            db_carrinho_save(
+                destino, versao_anterior=versao_anterior, estoques=reservas.estoques
+            )
+        except BaseException:
+            reservas.desfaz()
+            # Recria a origem, com as reservas liberadas ao removê-la.
+            operacoes.restaura_reservas(origem)
+            db_carrinho_save(origem)
+            raise
+        return _carrinho_dados(destino)
+
+
+@app.get("/carrinho/<codigo>/cupons")
+@perfil_wrapper
+@return_wrapper
+def carrinho_cupons(codigo: str) -> Dict:
+    """
+    Retorna os cupons de desconto do cadastro aplicáveis ao carrinho de compras, do
+    maior para o menor desconto.
+    """
+    with _TRAVAS_CARRINHOS.trava(codigo):
+        carrinho = db_carrinho_fetch(codigo)
+        return {"cupons": operacoes.cupons_aplicaveis(carrinho)}
+
+
+@app.get("/cliente/<cliente>/carrinhos")
+@perfil_wrapper
+@return_wrapper
+@admin_wrapper
+def cliente_carrinhos(cliente: str) -> Dict:
+    """
+    Retorna todos os dados dos carrinhos de compras de um cliente, do alterado há menos
+    tempo para o mais antigo. Rota administrativa, chamada pelo serviço que autentica o
+    cliente.
+    """
+    dados = []
+    for carrinho in sorted(
+        db_carrinho_do_cliente(cliente),
+        key=lambda carrinho: carrinho.timestamp_alteracao,
+        reverse=True,
+    ):
+        with _TRAVAS_CARRINHOS.trava(carrinho.codigo):
+            dados.append(_carrinho_dados(carrinho))
+    return {"carrinhos": dados}
+
+
+@app.post("/carrinhos/exporta")
+@perfil_wrapper
+@return_wrapper
+@admin_wrapper
+def carrinhos_exporta() -> Response:
+    """
+    Exporta os carrinhos de compras selecionados pelo corpo da requisição (JSON, ver
+    `api_carrinho.exportacao.filtro`) em JSON delimitado por linhas, gerado à medida que
+    a resposta é enviada. Rota administrativa.
+    """
+    filtro = exportacao.filtro(_corpo_json())
+    return app.response_class(_exporta(filtro), mimetype=exportacao.TIPO_CONTEUDO)
+
+
+@app.post("/produtos/precos")
+@perfil_wrapper
+@return_wrapper
+@admin_wrapper
+def produtos_precos() -> Dict:
+    """
+    Reprecifica os carrinhos de compras com os produtos do lote de novos preços do corpo
+    da requisição (JSON, ver `api_carrinho.precos.atualizacoes`), retornando quantos
+    carrinhos foram consultados e alterados. Altera também os preços no cadastro,
+    descartando os produtos do cache deste processo. Rota administrativa.
+    """
+    novos = precos.atualizacoes(_corpo_json())
+    db_produto_atualiza_precos(novos)
+    codigos = db_carrinho_com_produtos(novos)
+    alterados = 0
+    for codigo in codigos:
+        with _TRAVAS_CARRINHOS.trava(codigo):
+            alterados += precos.reprecifica(codigo, novos)
+    return {"carrinhos_consultados": len(codigos), "carrinhos_alterados": alterados}
+
+
+@app.get("/metrics")
+def metrics() -> Response:
+    """
+    Retorna as métricas do processo no formato texto do Prometheus. Retorna o status
+    HTTP 404 caso as métricas estejam desativadas.
     """
-    carrinho = db_carrinho_fetch(codigo)
-    retorno_dados = {
-        "codigo": carrinho.codigo,
-        "cliente": carrinho.cliente,
-        "totais": {"subtotal": carrinho.totais.subtotal, "total": carrinho.totais.total},
-        "produtos": [],
-        "cupom": {},
-    }
-    if carrinho.cupom:
-        retorno_dados["cupom"] = {
-            "codigo": carrinho.cupom.codigo,
-            "valor": carrinho.cupom.valor,
-        }
-    for codigo_produto in carrinho.produtos:
-        produto = carrinho.produtos[codigo_produto]
-        retorno_dados["produtos"].append(
-            {
-                "codigo": produto.codigo,
-                "descricao": produto.descricao,
-                "quantidade": produto.quantidade,
-                "preco_de": produto.preco_de,
-                "preco_por": produto.preco_por,
-            }
+    if not metricas.ativas():
+        return app.response_class(
+            "métricas desativadas\n", status=404, mimetype="text/plain"
         )
-    return retorno_dados
+    return app.response_class(metricas.exporta(), content_type=metricas.TIPO_CONTEUDO)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,56 @@
+"""
+Este módulo expõe a API de `api_carrinho.app` como uma aplicação ASGI, para ser servida
+por um servidor assíncrono:
+
+    gunicorn --config python:api_carrinho.gunicorn_conf \\
+        -k uvicorn.workers.UvicornWorker api_carrinho.asgi:app
+
+O _event loop_ do Uvicorn mantém as conexões (inclusive as ociosas, em keep-alive, e as
+de clientes lentos) sem ocupar uma thread por conexão, e as requisições são atendidas
+pelos próprios endpoints da aplicação Flask, executados em um pool de `THREADS` threads.
+Assim, os endpoints, o formato de retorno e as travas dos carrinhos são os mesmos nas
+duas variantes.
+"""
+
+from typing import Awaitable, Callable, Dict
+
+from uvicorn.middleware.wsgi import WSGIMiddleware
+
+from api_carrinho import __VERSION__
+from api_carrinho.app import app as app_wsgi
+from api_carrinho.gunicorn_conf import threads
+from api_carrinho.log import log
+
+_WSGI = WSGIMiddleware(app_wsgi, workers=threads)
+
+
+async def _ciclo_de_vida(
+    receive: Callable[[], Awaitable[Dict]], send: Callable[[Dict], Awaitable[None]]
+) -> None:
+    """
+    Trata os eventos de início e fim do servidor (protocolo "lifespan" do ASGI). Os
+    carrinhos persistidos são recuperados pela aplicação Flask, antes da primeira
+    requisição.
+    """
+    while True:
+        mensagem = await receive()
+        if mensagem["type"] == "lifespan.startup":
+            log.info("iniciando api-carrinho (asgi) versão %s", __VERSION__)
+            await send({"type": "lifespan.startup.complete"})
+        elif mensagem["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(
+    escopo: Dict,
+    receive: Callable[[], Awaitable[Dict]],
+    send: Callable[[Dict], Awaitable[None]],
+) -> None:
+    """
+    Aplicação ASGI da API.
+    """
+    if escopo["type"] == "lifespan":
+        await _ciclo_de_vida(receive, send)
+    elif escopo["type"] == "http":
+        await _WSGI(escopo, receive, send)
@@ -0,0 +1,55 @@
+"""
+Este módulo implementa o cache das respostas já serializadas da API.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+
+class CacheRespostas:
+    """
+    Cache LRU de respostas serializadas (bytes), indexado por chave (ex: código do
+    carrinho) e validado por versão (ex: o ETag da resposta): uma entrada só é usada se a
+    versão for a mesma de quando foi gravada, não sendo necessário invalidar
+    explicitamente a cada alteração.
+    """
+
+    maximo: int  # número máximo de entradas no cache
+
+    def __init__(self, maximo: int) -> None:
+        self.maximo = maximo
+        self._lock = threading.Lock()
+        self._entradas: "OrderedDict[str, Tuple[Hashable, bytes]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entradas)
+
+    def obtem(self, chave: str, versao: Hashable) -> Optional[bytes]:
+        """
+        Retorna a resposta armazenada para a chave, caso exista na versão informada.
+        """
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None or entrada[0] != versao:
+                return None
+            self._entradas.move_to_end(chave)
+            return entrada[1]
+
+    def grava(self, chave: str, versao: Hashable, resposta: bytes) -> None:
+        """
+        Armazena a resposta de uma chave em uma versão, descartando as entradas usadas
+        há mais tempo caso o número máximo seja ultrapassado.
+        """
+        with self._lock:
+            self._entradas[chave] = (versao, resposta)
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.maximo:
+                self._entradas.popitem(last=False)
+
+    def invalida(self, chave: str) -> None:
+        """
+        Remove a resposta armazenada de uma chave.
+        """
+        with self._lock:
+            self._entradas.pop(chave, None)
@@ -0,0 +1,156 @@
+"""
+Este módulo implementa a exportação em lote dos carrinhos de compras, para rotinas de
+retaguarda como os e-mails de carrinho abandonado e a sincronização com o CRM.
+
+Os carrinhos são exportados em JSON delimitado por linhas (NDJSON): um carrinho por linha,
+na mesma representação de `/carrinho/<codigo>`. Eles são selecionados por uma lista de
+códigos ou por filtros, e percorridos em lotes por geradores: a memória usada não depende
+do número de carrinhos exportados, e a persistência só é travada enquanto cada lote é
+obtido.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from api_carrinho import serializacao
+from api_carrinho.models.carrinho import Carrinho
+from api_carrinho.operacoes import carrinho_dados, descricoes_faltantes
+from api_carrinho.persist.carrinhos import (
+    CarrinhoNaoExisteError,
+    db_carrinho_fetch,
+    db_carrinho_percorre,
+)
+from api_carrinho.persist.produtos import ProdutoPersisted
+
+# Content-Type da exportação.
+TIPO_CONTEUDO = "application/x-ndjson"
+
+# Carrinhos serializados por vez (uma parte da resposta).
+LOTE = 200
+
+
+class FiltroInvalidoError(Exception):
+    """
+    Filtro da exportação de carrinhos inválido.
+    """
+
+    ...
+
+
+@dataclass
+class FiltroExportacao:
+    """
+    Seleção dos carrinhos exportados. Os critérios informados são combinados.
+    """
+
+    codigos: Optional[List[str]] = None  # somente estes carrinhos (None: todos)
+    alterado_antes: Optional[float] = None  # timestamp: somente os alterados antes
+    com_cliente: Optional[bool] = None  # somente com (True) ou sem (False) cliente
+
+    def seleciona(self, carrinho: Carrinho) -> bool:
+        """
+        Retorna se o carrinho atende aos filtros de data de alteração e de cliente.
+        """
+        if (
+            self.alterado_antes is not None
+            and carrinho.timestamp_alteracao >= self.alterado_antes
+        ):
+            return False
+        if self.com_cliente is not None and self.com_cliente != (
+            carrinho.cliente is not None
+        ):
+            return False
+        return True
+
+
+def filtro(parametros: Any) -> FiltroExportacao:
+    """
+    Cria o filtro da exportação a partir de um objeto JSON, com os campos opcionais:
+
+    * `carrinhos`: lista de códigos de carrinhos (os inexistentes são ignorados);
+    * `alterado_antes`: data e hora no formato ISO 8601 (ex: "2022-01-31T12:00:00");
+    * `com_cliente`: true para somente os carrinhos com cliente, false para sem.
+
+    Levanta FiltroInvalidoError caso algum campo seja inválido.
+    """
+    if not isinstance(parametros, dict):
+        raise FiltroInvalidoError("esperado um objeto com os filtros")
+    resultado = FiltroExportacao()
+    codigos = parametros.get("carrinhos")
+    if codigos is not None:
+        if not isinstance(codigos, list) or not all(
+            isinstance(codigo, str) for codigo in codigos
+        ):
+            raise FiltroInvalidoError("carrinhos deve ser uma lista de códigos")
+        resultado.codigos = codigos
+    alterado_antes = parametros.get("alterado_antes")
+    if alterado_antes is not None:
+        try:
+            resultado.alterado_antes = datetime.fromisoformat(alterado_antes).timestamp()
+        except (TypeError, ValueError):
+            raise FiltroInvalidoError("alterado_antes deve ser uma data ISO 8601")
+    com_cliente = parametros.get("com_cliente")
+    if com_cliente is not None:
+        if not isinstance(com_cliente, bool):
+            raise FiltroInvalidoError("com_cliente deve ser true ou false")
+        resultado.com_cliente = com_cliente
+    return resultado
+
+
+def _por_codigo(codigos: List[str]) -> Iterator[Carrinho]:
+    for codigo in codigos:
+        try:
+            yield db_carrinho_fetch(codigo)
+        except CarrinhoNaoExisteError:
+            continue
+
+
+def lotes(filtro: FiltroExportacao, tamanho: int = LOTE) -> Iterator[List[Carrinho]]:
+    """
+    Gera os carrinhos selecionados pelo filtro, em listas de até `tamanho` carrinhos.
+    """
+    if filtro.codigos is not None:
+        carrinhos = _por_codigo(filtro.codigos)
+    else:
+        carrinhos = db_carrinho_percorre(filtro.alterado_antes)
+    lote: List[Carrinho] = []
+    for carrinho in carrinhos:
+        if filtro.seleciona(carrinho):
+            lote.append(carrinho)
+            if len(lote) == tamanho:
+                yield lote
+                lote = []
+    if lote:
+        yield lote
+
+
+def representa(carrinho: Carrinho) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Retorna a representação do carrinho, como em `/carrinho/<codigo>` mas sem as
+    descrições obtidas do cadastro, e os códigos dos produtos cuja descrição deve ser
+    preenchida por `codifica()`. Deve ser chamada com a trava do carrinho.
+    """
+    return carrinho_dados(carrinho, {}), descricoes_faltantes(carrinho)
+
+
+def codifica(
+    representacoes: Iterable[Tuple[Dict[str, Any], List[str]]],
+    cadastro: Dict[str, ProdutoPersisted],
+) -> bytes:
+    """
+    Serializa as representações de `representa()` em JSON delimitado por linhas,
+    preenchendo as descrições faltantes a partir de `cadastro` (vazia para um produto
+    que não está mais no cadastro).
+    """
+    partes = []
+    for dados, faltantes in representacoes:
+        if faltantes:
+            for produto in dados["produtos"]:
+                if produto["codigo"] in faltantes:
+                    cadastrado = cadastro.get(produto["codigo"])
+                    produto["descricao"] = (
+                        cadastrado.descricao if cadastrado is not None else ""
+                    )
+        partes.append(serializacao.codifica(dados))
+    return b"".join(partes)
@@ -0,0 +1,57 @@
+"""
+Configuração do Gunicorn para executar a API em produção:
+
+    gunicorn --config python:api_carrinho.gunicorn_conf api_carrinho.app:app
+
+Todos os parâmetros são lidos de variáveis de ambiente, como `HOST` e `PORT`.
+
+Por padrão, é usado um único worker com `2 * CPUs` threads. Mais de um worker só é
+aceito com `CARRINHOS_BACKEND=sqlite`, que compartilha os carrinhos e as reservas de
+estoque entre os processos: com os carrinhos em memória (`memoria` ou `diario`), cada
+worker teria seus próprios carrinhos e reservas, e o Gunicorn não é iniciado.
+"""
+
+from os import cpu_count, environ
+
+from api_carrinho import __VERSION__
+
+bind = "{}:{}".format(environ.get("HOST", "127.0.0.1"), environ.get("PORT", 5000))
+
+# Número de processos e de threads por processo. As threads atendem requisições
+# concorrentes enquanto outras aguardam I/O (SQLite, fsync do diário, rede).
+workers = int(environ.get("WORKERS", 1))
+threads = int(environ.get("THREADS", 2 * (cpu_count() or 1)))
+worker_class = "gthread" if threads > 1 else "sync"
+
+# Segundos que uma conexão ociosa é mantida aberta (keep-alive).
+keepalive = int(environ.get("KEEPALIVE", 5))
+
+# Segundos para um worker travado ser reiniciado, e para os workers terminarem as
+# requisições em andamento ao receber SIGTERM (graceful shutdown).
+timeout = int(environ.get("TIMEOUT", 30))
+graceful_timeout = int(environ.get("GRACEFUL_TIMEOUT", 30))
+
+# Reinicia os workers após um número de requisições (0: nunca), para conter vazamentos.
+max_requests = int(environ.get("MAX_REQUESTS", 0))
+max_requests_jitter = int(environ.get("MAX_REQUESTS_JITTER", 0))
+
+accesslog = environ.get("ACCESSLOG") or None
+errorlog = "-"
+
+
+# Backends de carrinhos compartilhados entre processos, que aceitam mais de um worker.
+BACKENDS_COMPARTILHADOS = ("sqlite",)
+
+
+def on_starting(server) -> None:
+    server.log.info("iniciando api-carrinho versão %s", __VERSION__)
+    backend = environ.get("CARRINHOS_BACKEND", "memoria")
+    if workers > 1 and backend not in BACKENDS_COMPARTILHADOS:
+        server.log.error(
+            "%d workers com CARRINHOS_BACKEND=%s: os carrinhos e as reservas de estoque "
+            "não são compartilhados entre os workers (use WORKERS=1 e aumente THREADS, "
+            "ou CARRINHOS_BACKEND=sqlite)",
+            workers,
+            backend,
+        )
+        raise SystemExit(1)
@@ -1,12 +1,110 @@
 """
 Este módulo exporta o objeto "log", usado para logging nos outros módulos da aplicação.
+
+Os registros são colocados em uma fila e escritos na saída de erro por uma thread
+própria, fora da thread da requisição (inclusive a formatação das mensagens e dos
+tracebacks). Configuração pelas variáveis de ambiente:
+
+* `LOG_NIVEL`: nível mínimo dos registros (`DEBUG`, `INFO`, `WARNING`, ...).
+* `LOG_FORMATO`: `texto` ou `json` (um objeto por linha, para coletores de log).
 """
 
+import atexit
+import json
 import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from os import environ
+from time import gmtime, strftime
+from typing import IO, Tuple
+
+FORMATO_TEXTO = "%(asctime)s.%(msecs).03d %(levelname).3s [%(process)d] | %(message)s"
+FORMATO_DATA = "%Y/%m/%d %H:%M:%S"
+
+# Atributos de todo LogRecord; os demais vêm do parâmetro `extra` e vão para o JSON.
+_ATRIBUTOS_PADRAO = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message",
+    "asctime",
+}
+
+
+class FormatadorJSON(logging.Formatter):
+    """
+    Formata cada registro como um objeto JSON em uma linha, com os campos instante (UTC),
+    nivel, processo, logger, mensagem, excecao (caso exista) e os do parâmetro `extra`.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        dados = {
+            "instante": "{}.{:03d}Z".format(
+                strftime("%Y-%m-%dT%H:%M:%S", gmtime(record.created)),
+                int(record.msecs),
+            ),
+            "nivel": record.levelname,
+            "processo": record.process,
+            "logger": record.name,
+            "mensagem": record.getMessage(),
+        }
+        if record.exc_info:
+            dados["excecao"] = self.formatException(record.exc_info)
+        for nome, valor in vars(record).items():
+            if nome not in _ATRIBUTOS_PADRAO:
+                dados[nome] = valor
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+class _FilaHandler(QueueHandler):
+    """
+    Coloca os registros na fila sem formatá-los: a mensagem e o traceback são formatados
+    pela thread que os escreve. Os argumentos das mensagens não devem ser alterados após o
+    registro.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def cria_fila(formato: str, saida: IO[str]) -> Tuple[QueueHandler, QueueListener]:
+    """
+    Cria o handler que coloca os registros em uma fila e o ouvinte que os escreve em
+    `saida`, no formato `texto` ou `json`. O ouvinte deve ser iniciado com `start()`.
+    """
+    escritor = logging.StreamHandler(saida)
+    if formato == "json":
+        escritor.setFormatter(FormatadorJSON())
+    else:
+        escritor.setFormatter(logging.Formatter(FORMATO_TEXTO, FORMATO_DATA))
+    fila: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    return _FilaHandler(fila), QueueListener(fila, escritor)
+
+
+_HANDLER, _OUVINTE = cria_fila(environ.get("LOG_FORMATO", "texto"), sys.stderr)
+
+
+def _reinicia_ouvinte() -> None:
+    """
+    Recria a fila e o ouvinte em um processo filho (ex: worker do Gunicorn com
+    `preload_app`), já que a thread do ouvinte não sobrevive ao fork.
+    """
+    global _OUVINTE
+    _HANDLER.queue = queue.SimpleQueue()
+    _OUVINTE = QueueListener(_HANDLER.queue, *_OUVINTE.handlers)
+    _OUVINTE.start()
+
+
+def _para_ouvinte() -> None:
+    """
+    Escreve os registros que ainda estão na fila e para o ouvinte do processo.
+    """
+    _OUVINTE.stop()
+
+
+logging.basicConfig(level=environ.get("LOG_NIVEL", "INFO").upper(), handlers=[_HANDLER])
+_OUVINTE.start()
+# Ao terminar, escreve os registros que ainda estão na fila.
+atexit.register(_para_ouvinte)
+os.register_at_fork(after_in_child=_reinicia_ouvinte)
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s.%(msecs).03d %(levelname).3s [%(process)d] | %(message)s",
-    datefmt="%Y/%m/%d %H:%M:%S",
-)
 log = logging.getLogger("__main__")
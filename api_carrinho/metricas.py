@@ -0,0 +1,222 @@
+"""
+Este módulo implementa as métricas da API: latência por rota (histograma), erros por
+rota e tipo de exceção, tempo de atualização dos totalizadores dos carrinhos e os
+contadores da persistência, exportados no formato texto do Prometheus em /metrics.
+
+As métricas são ativadas pela variável de ambiente `METRICAS=1`. Desativadas, o custo
+por requisição é somente a verificação de `ativas()`.
+
+Cada processo mantém suas próprias métricas: com vários workers, cada coleta do
+Prometheus obtém as de um worker (use o rótulo da instância para distingui-los).
+"""
+
+import threading
+from bisect import bisect_left
+from os import environ
+from time import perf_counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from api_carrinho.models.carrinho import Carrinho
+from api_carrinho.persist.carrinhos import db_carrinho_estatisticas
+from api_carrinho.persist.produtos import db_produto_estatisticas
+
+# Limites (em segundos) dos intervalos dos histogramas.
+LIMITES_REQUISICAO = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+LIMITES_TOTAIS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01)
+
+# Tipo de conteúdo do formato texto do Prometheus.
+TIPO_CONTEUDO = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histograma:
+    """
+    Histograma de durações com intervalos fixos, no modelo do Prometheus. Não é
+    protegido por trava: deve ser alterado com a trava de `Metricas`.
+    """
+
+    limites: Sequence[float]  # limite superior de cada intervalo, em ordem crescente
+    contagens: List[int]  # observações em cada intervalo (não cumulativas) e acima
+    soma: float  # soma de todas as observações
+
+    def __init__(self, limites: Sequence[float]) -> None:
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1)
+        self.soma = 0.0
+
+    def observa(self, valor: float) -> None:
+        """
+        Registra uma observação.
+        """
+        self.contagens[bisect_left(self.limites, valor)] += 1
+        self.soma += valor
+
+    def exporta(self, nome: str, rotulos: str) -> List[str]:
+        """
+        Retorna as linhas do histograma no formato do Prometheus, com os intervalos
+        cumulativos.
+        """
+        separador = "," if rotulos else ""
+        linhas = []
+        acumulado = 0
+        for limite, contagem in zip(self.limites, self.contagens):
+            acumulado += contagem
+            linhas.append(
+                '{}_bucket{{{}{}le="{}"}} {}'.format(
+                    nome, rotulos, separador, limite, acumulado
+                )
+            )
+        acumulado += self.contagens[-1]
+        linhas.append(
+            '{}_bucket{{{}{}le="+Inf"}} {}'.format(nome, rotulos, separador, acumulado)
+        )
+        chaves = "{{{}}}".format(rotulos) if rotulos else ""
+        linhas.append("{}_sum{} {}".format(nome, chaves, self.soma))
+        linhas.append("{}_count{} {}".format(nome, chaves, acumulado))
+        return linhas
+
+
+def _rotulo(valor: str) -> str:
+    """
+    Escapa o valor de um rótulo do Prometheus.
+    """
+    return valor.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metricas:
+    """
+    Registro das métricas do processo.
+    """
+
+    ativas: bool  # caso falso, nada é registrado
+
+    def __init__(self, ativas: bool) -> None:
+        self.ativas = ativas
+        self._lock = threading.Lock()
+        self._requisicoes: Dict[str, Histograma] = {}
+        self._erros: Dict[Tuple[str, str], int] = {}
+        self._totais: Dict[str, Histograma] = {}
+
+    def registra_requisicao(
+        self, rota: str, segundos: float, erro: Optional[str]
+    ) -> None:
+        """
+        Registra a duração de uma requisição a uma rota e o tipo da exceção levantada,
+        caso tenha ocorrido uma.
+        """
+        with self._lock:
+            histograma = self._requisicoes.get(rota)
+            if histograma is None:
+                histograma = self._requisicoes[rota] = Histograma(LIMITES_REQUISICAO)
+            histograma.observa(segundos)
+            if erro is not None:
+                self._erros[rota, erro] = self._erros.get((rota, erro), 0) + 1
+
+    def registra_totais(self, tipo: str, segundos: float) -> None:
+        """
+        Registra a duração de uma atualização dos totalizadores de um carrinho, pelo tipo:
+        "incremental" (a cada alteração) ou "completo" (recálculo do subtotal).
+        """
+        with self._lock:
+            histograma = self._totais.get(tipo)
+            if histograma is None:
+                histograma = self._totais[tipo] = Histograma(LIMITES_TOTAIS)
+            histograma.observa(segundos)
+
+    def exporta(self) -> str:
+        """
+        Retorna todas as métricas no formato texto do Prometheus.
+        """
+        linhas = [
+            "# HELP api_carrinho_requisicao_segundos Duração das requisições por rota.",
+            "# TYPE api_carrinho_requisicao_segundos histogram",
+        ]
+        with self._lock:
+            for rota, histograma in sorted(self._requisicoes.items()):
+                linhas += histograma.exporta(
+                    "api_carrinho_requisicao_segundos", 'rota="{}"'.format(_rotulo(rota))
+                )
+            linhas += [
+                "# HELP api_carrinho_erros_total Erros por rota e tipo de exceção.",
+                "# TYPE api_carrinho_erros_total counter",
+            ]
+            for (rota, tipo), quantidade in sorted(self._erros.items()):
+                linhas.append(
+                    'api_carrinho_erros_total{{rota="{}",tipo="{}"}} {}'.format(
+                        _rotulo(rota), _rotulo(tipo), quantidade
+                    )
+                )
+            linhas += [
+                "# HELP api_carrinho_totais_segundos Duração das atualizações dos "
+                "totalizadores, incrementais ou recálculos completos.",
+                "# TYPE api_carrinho_totais_segundos histogram",
+            ]
+            for tipo, histograma in sorted(self._totais.items()):
+                linhas += histograma.exporta(
+                    "api_carrinho_totais_segundos", 'tipo="{}"'.format(_rotulo(tipo))
+                )
+        carrinhos = db_carrinho_estatisticas()
+        linhas += [
+            "# HELP api_carrinho_carrinhos Carrinhos vivos na persistência.",
+            "# TYPE api_carrinho_carrinhos gauge",
+            "api_carrinho_carrinhos {}".format(carrinhos["carrinhos"]),
+            "# HELP api_carrinho_carrinhos_removidos_total Carrinhos removidos.",
+            "# TYPE api_carrinho_carrinhos_removidos_total counter",
+            'api_carrinho_carrinhos_removidos_total{{motivo="expirado"}} {}'.format(
+                carrinhos["expirados"]
+            ),
+            'api_carrinho_carrinhos_removidos_total{{motivo="descartado"}} {}'.format(
+                carrinhos["descartados"]
+            ),
+        ]
+        for nome, valor in sorted(db_produto_estatisticas().items()):
+            # Contadores do cache de produtos (quando existir): produtos armazenados,
+            # acertos, falhas e descartados.
+            if nome == "produtos":
+                metrica, tipo = "api_carrinho_cache_produtos", "gauge"
+            else:
+                metrica = "api_carrinho_cache_produtos_{}_total".format(nome)
+                tipo = "counter"
+            linhas += [
+                "# TYPE {} {}".format(metrica, tipo),
+                "{} {}".format(metrica, valor),
+            ]
+        return "\n".join(linhas) + "\n"
+
+
+_METRICAS = Metricas(ativas=environ.get("METRICAS", "0") == "1")
+
+
+def ativas() -> bool:
+    """
+    Retorna se as métricas estão ativadas.
+    """
+    return _METRICAS.ativas
+
+
+def define_metricas(metricas: Metricas) -> None:
+    """
+    Substitui o registro das métricas do processo (ex: para ativá-las em testes).
+    """
+    global _METRICAS
+    _METRICAS = metricas
+    Carrinho.ao_atualizar_totais = metricas.registra_totais if metricas.ativas else None
+
+
+def registra_requisicao(rota: str, inicio: float, erro: Optional[BaseException]) -> None:
+    """
+    Registra uma requisição a uma rota, iniciada no instante `inicio` (perf_counter),
+    com a exceção levantada por ela, caso tenha ocorrido uma.
+    """
+    _METRICAS.registra_requisicao(
+        rota, perf_counter() - inicio, None if erro is None else erro.__class__.__name__
+    )
+
+
+def exporta() -> str:
+    """
+    Retorna as métricas do processo no formato texto do Prometheus.
+    """
+    return _METRICAS.exporta()
+
+
+define_metricas(_METRICAS)
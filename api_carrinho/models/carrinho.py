@@ -1,76 +1,296 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from datetime import datetime
 from functools import wraps
-from typing import Any, Dict, Optional
-from uuid import uuid4
+from os import environ
+from time import perf_counter, time
+from typing import Any, Callable, Dict, Optional, Tuple
+from uuid import UUID, uuid4
 
+from api_carrinho import serializacao
 from api_carrinho.models.cupom import Cupom
+from api_carrinho.models.dinheiro import centavos_persistidos
 from api_carrinho.models.produto import Produto
 
 
+class TotaisDivergentesError(Exception):
+    """
+    Totalizadores incrementais do carrinho divergem do recálculo completo.
+    """
+
+    ...
+
+
+def _subtotal_produto(produto: Optional[Produto]) -> int:
+    """
+    Retorna o subtotal em centavos de um produto no carrinho (0 caso não exista).
+    """
+    if produto is None:
+        return 0
+    return produto.quantidade * produto.preco_por
+
+
 @dataclass
 class CarrinhoTotais:
-    subtotal: float = 0.0
-    total: float = 0.0
+    subtotal: int = 0  # em centavos
+    total: int = 0  # em centavos
 
 
 class Carrinho:
     """
     Representa um carrinho de compras.
+
+    Os valores monetários são inteiros em centavos, e os totalizadores são mantidos de
+    forma incremental: cada alteração soma somente a diferença dos produtos envolvidos,
+    sem percorrer o carrinho inteiro.
+
+    Para ocupar pouca memória com muitos carrinhos vivos, a classe usa __slots__, o
+    código é armazenado como UUID binário (16 bytes), a data de alteração como timestamp
+    e os totalizadores são calculados somente quando acessados.
     """
 
-    codigo: str  # uuid versão 4 representando um carrinho único
-    data_alteracao: datetime  # data e hora de última alteração no carrinho (para expirar)
+    __slots__ = (
+        "_uuid",
+        "_data_alteracao",
+        "versao",
+        "cliente",
+        "produtos",
+        "cupom",
+        "_subtotal_centavos",
+    )
+
+    # Caso verdadeiro, confere os totalizadores incrementais com um recálculo completo a
+    # cada alteração, levantando TotaisDivergentesError em caso de diferença. Somente
+    # para depuração, pois o custo volta a ser proporcional ao número de produtos.
+    verifica_totais: bool = environ.get("VERIFICA_TOTAIS", "0") == "1"
+
+    # Chamada com o tipo ("incremental" ou "completo") e a duração (em segundos) de cada
+    # atualização dos totalizadores, para métricas: as incrementais, a cada alteração do
+    # carrinho, e os recálculos completos do subtotal. None desativa a medição.
+    ao_atualizar_totais: Optional[Callable[[str, float], None]] = None
+
+    _uuid: bytes  # uuid versão 4 representando um carrinho único, em binário
+    _data_alteracao: float  # timestamp da última alteração no carrinho (para expirar)
+    versao: int  # incrementada a cada alteração no carrinho
     cliente: Optional[int]  # código do cliente - None caso cliente sem logar
     produtos: Dict[str, Produto]  # produtos no carrinho - código => Produto
     cupom: Optional[Cupom]  # cupom de desconto - aceitamos somente um
-    totais: CarrinhoTotais
+    _subtotal_centavos: int  # soma de quantidade * preco_por, em centavos
 
     def _atualiza_mtime(f: Any):
         """
-        Decorator para atualizar a data de última modificação do carrinho.
+        Decorator para atualizar a data de última modificação e a versão do carrinho,
+        somente quando a alteração é concluída sem exceção.
         """
 
         @wraps(f)
         def wrapper(*args, **kwargs):
             self = args[0]
-            self.data_alteracao = datetime.now()
-            return f(*args, **kwargs)
+            resultado = f(*args, **kwargs)
+            self._data_alteracao = time()
+            self.versao += 1
+            return resultado
 
         return wrapper
 
     def _atualiza_totais(f: Any):
         """
-        Decorator para recalcular os totalizadores do carrinho.
+        Decorator das alterações que atualizam os totalizadores incrementais do carrinho:
+        mede a duração da alteração, caso `ao_atualizar_totais` esteja definido, e confere
+        os totalizadores, caso `verifica_totais` esteja ativado.
         """
 
         @wraps(f)
         def wrapper(*args, **kwargs):
-            ret = f(*args, **kwargs)
             self = args[0]
-            self.totais.subtotal = 0.0
-            self.totais.total = 0.0
-            for codigo in self.produtos:
-                self.totais.subtotal += (
-                    self.produtos[codigo].quantidade * self.produtos[codigo].preco_por
-                )
-            self.totais.total = self.totais.subtotal
-            if self.cupom:
-                self.totais.total -= self.cupom.valor
+            if self.ao_atualizar_totais is None:
+                ret = f(*args, **kwargs)
+            else:
+                inicio = perf_counter()
+                ret = f(*args, **kwargs)
+                self.ao_atualizar_totais("incremental", perf_counter() - inicio)
+            if self.verifica_totais:
+                self.verifica_totais_completo()
             return ret
 
         return wrapper
 
-    @_atualiza_mtime
     def __init__(self, cliente: Optional[int]) -> None:
         """
         Inicializa um carrinho de compras, definindo um código aleatório e sem produtos.
         """
-        self.codigo = str(uuid4())
+        self._uuid = uuid4().bytes
+        self._data_alteracao = time()
+        self.versao = 1
         self.cliente = cliente
         self.produtos = {}
         self.cupom = None
-        self.totais = CarrinhoTotais()
+        self._subtotal_centavos = 0
+
+    @staticmethod
+    def chave_de(codigo: str) -> bytes:
+        """
+        Converte o código textual de um carrinho para sua forma binária (16 bytes).
+        Levanta ValueError caso o código não seja um UUID válido.
+        """
+        return UUID(codigo).bytes
+
+    @property
+    def chave(self) -> bytes:
+        """
+        Código do carrinho em binário (16 bytes), usado como chave na persistência.
+        """
+        return self._uuid
+
+    @property
+    def codigo(self) -> str:
+        """
+        Código do carrinho (UUID versão 4 em texto).
+        """
+        return str(UUID(bytes=self._uuid))
+
+    @property
+    def data_alteracao(self) -> datetime:
+        """
+        Data e hora da última alteração no carrinho.
+        """
+        return datetime.fromtimestamp(self._data_alteracao)
+
+    @data_alteracao.setter
+    def data_alteracao(self, data_alteracao: datetime) -> None:
+        self._data_alteracao = data_alteracao.timestamp()
+
+    @property
+    def timestamp_alteracao(self) -> float:
+        """
+        Timestamp (segundos desde a época) da última alteração no carrinho.
+        """
+        return self._data_alteracao
+
+    @property
+    def totais(self) -> CarrinhoTotais:
+        """
+        Totalizadores do carrinho, em centavos.
+        """
+        return CarrinhoTotais(
+            subtotal=self._subtotal_centavos, total=self._total_centavos()
+        )
+
+    @property
+    def subtotal_centavos(self) -> int:
+        """
+        Subtotal do carrinho em centavos.
+        """
+        return self._subtotal_centavos
+
+    def _total_centavos(self) -> int:
+        """
+        Retorna o total em centavos, aplicando o cupom de desconto sobre o subtotal.
+        """
+        return self._subtotal_centavos - self.desconto_centavos()
+
+    def desconto_centavos(self, agora: Optional[float] = None) -> int:
+        """
+        Retorna o desconto do cupom em centavos (0 caso não tenha cupom). Para um cupom
+        restrito a produtos, a base do desconto é a soma somente dos produtos elegíveis,
+        percorrendo o menor entre os produtos do carrinho e os do cupom. O desconto é
+        limitado ao subtotal, para que o total nunca fique negativo.
+        """
+        cupom = self.cupom
+        if cupom is None:
+            return 0
+        elegiveis = cupom.produtos
+        if elegiveis is None:
+            base = self._subtotal_centavos
+        elif len(elegiveis) < len(self.produtos):
+            base = sum(_subtotal_produto(self.produtos.get(c)) for c in elegiveis)
+        else:
+            base = sum(
+                _subtotal_produto(produto)
+                for codigo, produto in self.produtos.items()
+                if codigo in elegiveis
+            )
+        desconto = cupom.desconto_centavos(
+            self._subtotal_centavos, base, time() if agora is None else agora
+        )
+        return min(desconto, self._subtotal_centavos)
+
+    def recalcula_subtotal(self) -> int:
+        """
+        Recalcula o subtotal em centavos percorrendo todos os produtos do carrinho. Com
+        os preços em centavos, a soma é feita somente com inteiros, sem conversões.
+        """
+        if self.ao_atualizar_totais is None:
+            return sum(p.quantidade * p.preco_por for p in self.produtos.values())
+        inicio = perf_counter()
+        subtotal = sum(p.quantidade * p.preco_por for p in self.produtos.values())
+        self.ao_atualizar_totais("completo", perf_counter() - inicio)
+        return subtotal
+
+    def verifica_totais_completo(self) -> None:
+        """
+        Confere o subtotal incremental com um recálculo completo. Levanta exceção
+        TotaisDivergentesError caso sejam diferentes.
+        """
+        subtotal = self.recalcula_subtotal()
+        if subtotal != self._subtotal_centavos:
+            raise TotaisDivergentesError(
+                "carrinho {}: subtotal incremental {} difere do recalculado {}".format(
+                    self.codigo, self._subtotal_centavos, subtotal
+                )
+            )
+
+    def serializa(self) -> bytes:
+        """
+        Serializa o carrinho em um formato compacto (JSON com listas posicionais), para
+        ser gravado em uma persistência compartilhada.
+        """
+        cupom = self.cupom.serializa() if self.cupom else None
+        produtos = [
+            [p.codigo, p.descricao, p.preco_de, p.preco_por, p.quantidade]
+            for p in self.produtos.values()
+        ]
+        return serializacao.codifica_compacto(
+            [
+                self.codigo,
+                self.versao,
+                self._data_alteracao,
+                self.cliente,
+                cupom,
+                produtos,
+            ]
+        )
+
+    @classmethod
+    def desserializa(cls, dados: bytes, chave: Optional[bytes] = None) -> "Carrinho":
+        """
+        Reconstrói um carrinho serializado por `serializa()`, recalculando os totais.
+        Levanta ValueError caso o código do carrinho seja inválido. Os preços gravados
+        antes dos valores em centavos (float, em reais) são convertidos.
+
+        A chave binária do carrinho pode ser informada caso já seja conhecida (ex: lida
+        do diário), evitando converter o código.
+        """
+        codigo, versao, data_alteracao, cliente, cupom, produtos = (
+            serializacao.decodifica(dados)
+        )
+        carrinho = cls.__new__(cls)
+        carrinho._uuid = chave if chave is not None else cls.chave_de(codigo)
+        carrinho.versao = versao
+        carrinho._data_alteracao = data_alteracao
+        carrinho.cliente = cliente
+        carrinho.cupom = Cupom.desserializa(cupom) if cupom else None
+        carrinho.produtos = {
+            p[0]: Produto(
+                codigo=p[0],
+                descricao=p[1],
+                preco_de=centavos_persistidos(p[2]),
+                preco_por=centavos_persistidos(p[3]),
+                quantidade=p[4],
+            )
+            for p in produtos
+        }
+        carrinho._subtotal_centavos = carrinho.recalcula_subtotal()
+        return carrinho
 
     @_atualiza_mtime
     def define_cliente(self, cliente: Optional[int]) -> None:
@@ -86,11 +306,37 @@ class Carrinho:
         Adiciona um produto ao carrinho. Caso o produto já exista, apenas a quantidade é
         acrescida de 1.
         """
-        if produto.codigo in self.produtos:
-            self.produtos[produto.codigo].define_quantidade(
-                self.produtos[produto.codigo].quantidade + 1
-            )
-        self.produtos[produto.codigo] = produto
+        existente = self.produtos.get(produto.codigo)
+        if existente is not None:
+            antes = _subtotal_produto(existente)
+            existente.define_quantidade(existente.quantidade + 1)
+            self._subtotal_centavos += _subtotal_produto(existente) - antes
+        else:
+            self.produtos[produto.codigo] = produto
+            self._subtotal_centavos += _subtotal_produto(produto)
+
+    @_atualiza_mtime
+    @_atualiza_totais
+    def mescla(self, outro: "Carrinho") -> None:
+        """
+        Soma os produtos de outro carrinho a este, em uma única passagem pelos produtos
+        do outro: os já existentes têm as quantidades somadas (mantendo os preços deste
+        carrinho) e os demais são copiados. O cupom e o cliente do outro carrinho são
+        usados caso este não tenha. O outro carrinho não é alterado.
+        """
+        for codigo, produto in outro.produtos.items():
+            existente = self.produtos.get(codigo)
+            if existente is not None:
+                antes = _subtotal_produto(existente)
+                existente.define_quantidade(existente.quantidade + produto.quantidade)
+                self._subtotal_centavos += _subtotal_produto(existente) - antes
+            else:
+                self.produtos[codigo] = replace(produto)
+                self._subtotal_centavos += _subtotal_produto(produto)
+        if self.cupom is None:
+            self.cupom = outro.cupom
+        if self.cliente is None:
+            self.cliente = outro.cliente
 
     @_atualiza_mtime
     @_atualiza_totais
@@ -98,8 +344,8 @@ class Carrinho:
         """
         Remove um produto do carrinho, dado seu código.
         """
-        if codigo in self.produtos:
-            del self.produtos[codigo]
+        produto = self.produtos.pop(codigo, None)
+        self._subtotal_centavos -= _subtotal_produto(produto)
 
     @_atualiza_mtime
     @_atualiza_totais
@@ -108,6 +354,7 @@ class Carrinho:
         Remove todos os produtos do carrinho.
         """
         self.produtos = {}
+        self._subtotal_centavos = 0
 
     @_atualiza_mtime
     @_atualiza_totais
@@ -118,10 +365,45 @@ class Carrinho:
         """
         self.cupom = cupom
 
+    @_atualiza_totais
+    def reprecifica(self, precos: Dict[str, Tuple[int, int]]) -> bool:
+        """
+        Atualiza os preços dos produtos do carrinho presentes em `precos` (código =>
+        (preco_de, preco_por), em centavos), percorrendo o menor entre os produtos do
+        carrinho e os preços. O subtotal é ajustado somente pela diferença dos produtos
+        alterados.
+
+        Retorna se algum preço mudou. Neste caso, a versão é incrementada, mas não a data
+        de alteração: a mudança de preço não é uma atividade do cliente, e não deve adiar
+        a expiração do carrinho nem tirá-lo dos abandonados.
+        """
+        if len(precos) < len(self.produtos):
+            alvos = ((self.produtos.get(c), preco) for c, preco in precos.items())
+        else:
+            alvos = ((p, precos.get(c)) for c, p in self.produtos.items())
+        alterado = False
+        for produto, preco in alvos:
+            if produto is None or preco is None:
+                continue
+            preco_de, preco_por = preco
+            if produto.preco_de == preco_de and produto.preco_por == preco_por:
+                continue
+            antes = _subtotal_produto(produto)
+            produto.preco_de = preco_de
+            produto.preco_por = preco_por
+            self._subtotal_centavos += _subtotal_produto(produto) - antes
+            alterado = True
+        if alterado:
+            self.versao += 1
+        return alterado
+
     @_atualiza_mtime
     @_atualiza_totais
     def define_produto_quantidade(self, produto_codigo: str, quantidade: int) -> None:
         """
         Define a quantidade de um produto no carrinho.
         """
-        self.produtos[produto_codigo].define_quantidade(quantidade)
+        produto = self.produtos[produto_codigo]
+        antes = _subtotal_produto(produto)
+        produto.define_quantidade(quantidade)
+        self._subtotal_centavos += _subtotal_produto(produto) - antes
@@ -1,18 +1,86 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from time import time
+from typing import FrozenSet, Iterable, Optional
+
+from api_carrinho.models.dinheiro import centavos_persistidos
 
 
 @dataclass
 class Cupom:
     """
-    Representa um Cupom de Desconto. No momento, apenas consideramos descontos em valor.
+    Representa um Cupom de Desconto, já compilado a partir da regra do cadastro: o
+    desconto é em valor fixo ou percentual, e pode exigir um subtotal mínimo, valer
+    somente para alguns produtos e ter data de validade.
+
+    Os valores são inteiros em centavos, e o percentual é convertido para centésimos de
+    ponto percentual uma única vez, na criação, para que o desconto seja calculado junto
+    com os totalizadores do carrinho somente com inteiros.
     """
 
     codigo: str
-    valor: float
+    valor: int = 0  # desconto fixo, em centavos
+    percentual: float = 0.0  # desconto percentual sobre os produtos elegíveis
+    subtotal_minimo: int = 0  # subtotal do carrinho necessário, em centavos
+    produtos: Optional[FrozenSet[str]] = None  # produtos elegíveis (None: todos)
+    validade: Optional[float] = None  # timestamp a partir do qual expira (None: nunca)
+
+    _percentual_centesimos: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        if self.produtos is not None and not isinstance(self.produtos, frozenset):
+            self.produtos = frozenset(self.produtos)
+        self._percentual_centesimos = int(round(self.percentual * 100))
+
+    def valida_cupom(self, agora: Optional[float] = None) -> bool:
+        """
+        Valida se o cupom de desconto ainda não expirou.
+        """
+        if self.validade is None:
+            return True
+        return (time() if agora is None else agora) < self.validade
+
+    def desconto_centavos(self, subtotal: int, base: int, agora: float) -> int:
+        """
+        Retorna o desconto em centavos, dados o subtotal do carrinho e a base do desconto
+        (subtotal somente dos produtos elegíveis, ambos em centavos). Sem desconto caso o
+        cupom tenha expirado, o subtotal mínimo não seja atingido ou, para um cupom
+        restrito a produtos, nenhum deles esteja no carrinho. O desconto de valor fixo de
+        um cupom restrito a produtos é limitado à base.
+        """
+        if self.validade is not None and agora >= self.validade:
+            return 0
+        if subtotal < self.subtotal_minimo:
+            return 0
+        if self.produtos is not None and base == 0:
+            return 0
+        if self._percentual_centesimos:
+            return (base * self._percentual_centesimos + 5000) // 10000
+        if self.produtos is not None:
+            return min(self.valor, base)
+        return self.valor
+
+    def serializa(self) -> list:
+        """
+        Retorna a regra do cupom em uma lista posicional, para ser persistida com o
+        carrinho (ver `desserializa()`).
+        """
+        produtos = sorted(self.produtos) if self.produtos is not None else None
+        return [
+            self.codigo,
+            self.valor,
+            self.percentual,
+            self.subtotal_minimo,
+            produtos,
+            self.validade,
+        ]
 
-    def valida_cupom(self) -> bool:
+    @classmethod
+    def desserializa(cls, dados: Iterable) -> "Cupom":
         """
-        Valida se o cupom de desconto é verdadeiro.
-        Neste exercício, apenas aceitamos qualquer cupom!
+        Reconstrói um cupom serializado por `serializa()`. Aceita também os formatos
+        anteriores: somente com o código e o valor, e com os valores em reais.
         """
-        return True
+        codigo, valor, *regra = dados
+        cupom = cls(codigo, centavos_persistidos(valor), *regra)
+        cupom.subtotal_minimo = centavos_persistidos(cupom.subtotal_minimo)
+        return cupom
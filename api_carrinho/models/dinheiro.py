@@ -0,0 +1,42 @@
+"""
+Conversões dos valores monetários.
+
+Internamente, todos os valores monetários são inteiros em centavos: as somas são exatas,
+sem os erros de arredondamento do float (ex: 0.1 + 0.2). Valores em reais ficam somente
+nas bordas: a entrada da API e dos cadastros e a representação em JSON.
+"""
+
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import Union
+
+_UM = Decimal(1)
+
+
+def centavos(valor: Union[int, float, str, Decimal]) -> int:
+    """
+    Converte um valor em reais para centavos, arredondando meio centavo para cima. O
+    valor é convertido pela sua representação decimal: 1.005 são 101 centavos, e não
+    100 como pela representação binária do float. Levanta ValueError caso o valor não
+    seja um número finito.
+    """
+    try:
+        return int((Decimal(str(valor)) * 100).quantize(_UM, rounding=ROUND_HALF_UP))
+    except InvalidOperation:
+        raise ValueError("valor monetário inválido: {!r}".format(valor))
+
+
+def centavos_persistidos(valor: Union[int, float]) -> int:
+    """
+    Converte um valor monetário lido de uma persistência para centavos. Os gravados
+    antes dos valores em centavos são float, em reais.
+    """
+    if isinstance(valor, int):
+        return valor
+    return centavos(valor)
+
+
+def reais(valor: int) -> float:
+    """
+    Converte um valor em centavos para reais, para a representação em JSON.
+    """
+    return valor / 100
@@ -1,16 +1,23 @@
 from dataclasses import dataclass
+from typing import Optional
 
 
 @dataclass
 class Produto:
     """
     Representa um produto com os dados necessários para uso no carrinho.
+
+    Guarda o código, a quantidade e os preços (em centavos) no momento em que o produto
+    foi adicionado. A descrição pode ser None, sendo então obtida do cadastro de produtos
+    ao exibir o carrinho, para não ser repetida em cada carrinho.
     """
 
+    __slots__ = ("codigo", "descricao", "preco_de", "preco_por", "quantidade")
+
     codigo: str
-    descricao: str
-    preco_de: float
-    preco_por: float
+    descricao: Optional[str]
+    preco_de: int  # em centavos
+    preco_por: int  # em centavos
     quantidade: int  # Quantidade de itens no carrinho
 
     def define_quantidade(self, quantidade: int) -> None:
@@ -0,0 +1,444 @@
+"""
+Este módulo implementa as operações sobre os carrinhos de compras e sua representação,
+usadas pelas rotas da API (`api_carrinho.app`).
+
+As operações não consultam os cadastros: produtos e cupons são obtidos antes pela rota
+que as chama.
+"""
+
+from time import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Type
+
+from api_carrinho.models.carrinho import Carrinho
+from api_carrinho.models.cupom import Cupom
+from api_carrinho.models.dinheiro import reais
+from api_carrinho.models.produto import Produto
+from api_carrinho.persist.carrinhos import (
+    CarrinhoNaoExisteError,
+    CarrinhoVersaoConflitoError,
+    db_carrinho_ao_remover,
+    db_carrinho_ao_restaurar,
+)
+from api_carrinho.persist.cupons import (
+    CupomExpiradoError,
+    CupomNaoExisteError,
+    db_cupom_aplicaveis,
+)
+from api_carrinho.persist.estoque import (
+    TransacaoReservas,
+    db_estoque_libera,
+    db_estoque_restaura,
+)
+from api_carrinho.persist.produtos import (
+    ProdutoNaoExisteError,
+    ProdutoPersisted,
+    ProdutoSemEstoqueError,
+)
+
+
+class OperacaoInvalidaError(Exception):
+    """
+    Operação em lote inválida (desconhecida ou com parâmetros faltando).
+    """
+
+    ...
+
+
+class MesclaConflitoError(Exception):
+    """
+    Carrinho de origem de uma mescla alterado por outra requisição (ex: em outro
+    processo) depois de obtido.
+    """
+
+    ...
+
+
+class VersaoInvalidaError(Exception):
+    """
+    Versão esperada do carrinho (parâmetro `versao` ou cabeçalho If-Match) inválida.
+    """
+
+    ...
+
+
+# Erros de negócio esperados nas requisições, registrados no log sem o traceback.
+ERROS_ESPERADOS: Tuple[Type[Exception], ...] = (
+    CarrinhoNaoExisteError,
+    CarrinhoVersaoConflitoError,
+    CupomExpiradoError,
+    CupomNaoExisteError,
+    MesclaConflitoError,
+    OperacaoInvalidaError,
+    ProdutoNaoExisteError,
+    ProdutoSemEstoqueError,
+    VersaoInvalidaError,
+)
+
+# Erros de requisições malformadas, retornados com o status HTTP 400 (os demais erros
+# são retornados com o status 200, exceto os de `ERROS_CONFLITO`).
+ERROS_REQUISICAO_INVALIDA: Tuple[Type[Exception], ...] = (VersaoInvalidaError,)
+
+# Erros de alterações concorrentes que só podem ser repetidas depois de obter os
+# carrinhos novamente, retornados com o status HTTP 409.
+ERROS_CONFLITO: Tuple[Type[Exception], ...] = (MesclaConflitoError,)
+
+
+class CodigoProduto(str):
+    """
+    Parâmetro de uma operação em lote que é o código de um produto do cadastro.
+    """
+
+
+class CodigoCupom(str):
+    """
+    Parâmetro de uma operação em lote que é o código de um cupom do cadastro.
+    """
+
+
+def cliente_define(carrinho: Carrinho, reservas: TransacaoReservas, cliente: int) -> None:
+    """
+    Altera o cliente associado ao carrinho.
+    """
+    carrinho.define_cliente(cliente)
+
+
+def produto_adiciona(
+    carrinho: Carrinho, reservas: TransacaoReservas, produto_persisted: ProdutoPersisted
+) -> None:
+    """
+    Adiciona um produto do cadastro ao carrinho, com quantidade 1, reservando seu estoque.
+    A descrição não é copiada para o carrinho: ela é obtida do cadastro ao exibi-lo.
+    """
+    reservas.reserva(produto_persisted.codigo, 1, produto_persisted.estoque)
+    produto = Produto(
+        codigo=produto_persisted.codigo,
+        descricao=None,
+        preco_de=produto_persisted.preco_de,
+        preco_por=produto_persisted.preco_por,
+        quantidade=1,
+    )
+    carrinho.adiciona_produto(produto)
+
+
+def produto_remove(
+    carrinho: Carrinho, reservas: TransacaoReservas, produto_codigo: str
+) -> None:
+    """
+    Remove um produto do carrinho, liberando seu estoque reservado.
+    """
+    if produto_codigo in carrinho.produtos:
+        reservas.libera(produto_codigo, carrinho.produtos[produto_codigo].quantidade)
+    carrinho.remove_produto(produto_codigo)
+
+
+def produto_define_quantidade(
+    carrinho: Carrinho,
+    reservas: TransacaoReservas,
+    produto_persisted: ProdutoPersisted,
+    quantidade: int,
+) -> None:
+    """
+    Altera a quantidade de um produto no carrinho, reservando ou liberando a diferença no
+    estoque do produto do cadastro.
+    """
+    produto = carrinho.produtos[produto_persisted.codigo]
+    if quantidade > 0:
+        reservas.reserva(
+            produto_persisted.codigo,
+            quantidade - produto.quantidade,
+            produto_persisted.estoque,
+        )
+    carrinho.define_produto_quantidade(produto_persisted.codigo, quantidade)
+
+
+def limpa(carrinho: Carrinho, reservas: TransacaoReservas) -> None:
+    """
+    Remove todos os produtos do carrinho, liberando seus estoques reservados.
+    """
+    for produto in carrinho.produtos.values():
+        reservas.libera(produto.codigo, produto.quantidade)
+    carrinho.remove_todos_produtos()
+
+
+def cupom_define(carrinho: Carrinho, reservas: TransacaoReservas, cupom: Cupom) -> None:
+    """
+    Associa um cupom de desconto do cadastro ao carrinho.
+    """
+    carrinho.define_cupom_desconto(cupom)
+
+
+def confere_mescla(destino: Carrinho, origem: Carrinho, cliente: str) -> None:
+    """
+    Confere que a origem pode ser mesclada no destino pelo cliente informado na
+    requisição: os dois carrinhos devem ser diferentes e, cada um, anônimo ou do
+    cliente. Levanta OperacaoInvalidaError caso contrário.
+    """
+    if destino.chave == origem.chave:
+        raise OperacaoInvalidaError("um carrinho não pode ser mesclado com ele mesmo")
+    for carrinho in (destino, origem):
+        if carrinho.cliente is not None and str(carrinho.cliente) != cliente:
+            raise OperacaoInvalidaError(
+                "carrinho com código {} não é do cliente {}".format(
+                    carrinho.codigo, cliente
+                )
+            )
+
+
+def mescla(destino: Carrinho, reservas: TransacaoReservas, origem: Carrinho) -> None:
+    """
+    Soma os produtos do carrinho `origem` ao `destino` (ex: o carrinho anônimo ao do
+    cliente, ao fazer login), conferidos antes por `confere_mescla()`. O estoque
+    reservado pela origem é transferido para o destino, sem conferir o disponível: a
+    origem já deve ter sido removida, liberando suas reservas.
+    """
+    for produto in origem.produtos.values():
+        reservas.reserva(produto.codigo, produto.quantidade, None)
+    destino.mescla(origem)
+
+
+def _libera_reservas(carrinho: Carrinho) -> None:
+    """
+    Libera o estoque reservado por um carrinho removido da persistência (ex: expirado).
+    """
+    for produto in carrinho.produtos.values():
+        db_estoque_libera(produto.codigo, produto.quantidade)
+
+
+def restaura_reservas(carrinho: Carrinho) -> None:
+    """
+    Recria o estoque reservado por um carrinho recuperado da persistência ao iniciar o
+    processo (ou recriado após desfazer sua remoção).
+    """
+    for produto in carrinho.produtos.values():
+        db_estoque_restaura(produto.codigo, produto.quantidade)
+
+
+db_carrinho_ao_remover(_libera_reservas)
+db_carrinho_ao_restaurar(restaura_reservas)
+
+
+def confere_versao(carrinho: Carrinho, versao_esperada: Optional[int]) -> None:
+    """
+    Levanta CarrinhoVersaoConflitoError caso a requisição informe a versão esperada do
+    carrinho e ela seja diferente da atual.
+    """
+    if versao_esperada is not None and versao_esperada != carrinho.versao:
+        raise CarrinhoVersaoConflitoError(
+            "carrinho com código {} está na versão {}, esperada {}".format(
+                carrinho.codigo, carrinho.versao, versao_esperada
+            )
+        )
+
+
+def versao_parametro(versao: Any) -> int:
+    """
+    Converte a versão esperada do carrinho informada no parâmetro `versao` (número
+    inteiro, no formulário ou em JSON). Levanta VersaoInvalidaError caso seja inválida.
+    """
+    if isinstance(versao, int) and not isinstance(versao, bool) and versao >= 0:
+        return versao
+    if isinstance(versao, str) and versao.isascii() and versao.isdigit():
+        return int(versao)
+    raise VersaoInvalidaError("versao deve ser um número inteiro não negativo")
+
+
+# Sufixo do ETag de /carrinho quando o cupom do carrinho já expirou.
+_ETAG_CUPOM_EXPIRADO = "-expirado"
+
+
+def etag_carrinho(carrinho: Carrinho, agora: float) -> str:
+    """
+    Retorna o ETag da representação do carrinho no instante `agora`: a versão (ex: "v3")
+    e, caso o cupom já tenha expirado, o sufixo "-expirado". A expiração do cupom muda o
+    desconto e os totais sem alterar a versão do carrinho.
+    """
+    if carrinho.cupom is not None and not carrinho.cupom.valida_cupom(agora):
+        return "v{}{}".format(carrinho.versao, _ETAG_CUPOM_EXPIRADO)
+    return "v{}".format(carrinho.versao)
+
+
+def versao_etag(etags: Iterable[str]) -> Optional[int]:
+    """
+    Retorna a versão do carrinho informada em um cabeçalho If-Match, no formato do ETag
+    de /carrinho (ex: "v3" ou "v3-expirado"). Retorna None caso não seja informada.
+    Levanta VersaoInvalidaError caso o cabeçalho tenha uma ETag em outro formato.
+    """
+    for etag in etags:
+        if etag.endswith(_ETAG_CUPOM_EXPIRADO):
+            etag = etag[: -len(_ETAG_CUPOM_EXPIRADO)]
+        if etag.startswith("v") and etag[1:].isascii() and etag[1:].isdigit():
+            return int(etag[1:])
+        raise VersaoInvalidaError("If-Match deve conter o ETag de /carrinho (ex: v3)")
+    return None
+
+
+# Operações aceitas em lote: nome => (função, parâmetros com suas conversões de tipo).
+# Os parâmetros CodigoProduto e CodigoCupom são substituídos pelos objetos do cadastro
+# em `resolve_cadastro()` antes de aplicar as operações.
+OPERACOES: Dict[str, Tuple[Callable[..., None], Dict[str, Callable[[Any], Any]]]] = {
+    "cliente-define": (cliente_define, {"cliente": int}),
+    "produto-adiciona": (produto_adiciona, {"produto": CodigoProduto}),
+    "produto-remove": (produto_remove, {"produto": str}),
+    "produto-define-quantidade": (
+        produto_define_quantidade,
+        {"produto": CodigoProduto, "quantidade": int},
+    ),
+    "limpa": (limpa, {}),
+    "cupom-define": (cupom_define, {"cupom": CodigoCupom}),
+}
+
+# Operação em lote validada: função e argumentos.
+Operacao = Tuple[Callable[..., None], List[Any]]
+
+
+def _prepara_operacao(indice: int, operacao: Dict) -> Operacao:
+    """
+    Valida uma operação em lote no formato:
+    { "operacao": "nome-da-operacao", ... parâmetros da operação ... }
+    """
+    try:
+        funcao, parametros = OPERACOES[operacao["operacao"]]
+    except (KeyError, TypeError):
+        raise OperacaoInvalidaError("operação {} desconhecida".format(indice))
+    try:
+        argumentos = [converte(operacao[nome]) for nome, converte in parametros.items()]
+    except (KeyError, TypeError, ValueError):
+        raise OperacaoInvalidaError(
+            "operação {} ({}) com parâmetros inválidos: esperado {}".format(
+                indice, operacao["operacao"], ", ".join(parametros)
+            )
+        )
+    return funcao, argumentos
+
+
+def prepara_operacoes(operacoes: Any) -> List[Operacao]:
+    """
+    Valida uma lista de operações em lote (JSON), levantando OperacaoInvalidaError caso
+    alguma seja desconhecida ou tenha parâmetros inválidos.
+    """
+    if not isinstance(operacoes, list):
+        raise OperacaoInvalidaError("esperada uma lista de operações")
+    return [
+        _prepara_operacao(indice, operacao) for indice, operacao in enumerate(operacoes)
+    ]
+
+
+def codigos_cadastro(operacoes: List[Operacao]) -> Tuple[Set[str], Set[str]]:
+    """
+    Retorna os códigos de produtos e de cupons usados pelas operações.
+    """
+    produtos = set()
+    cupons = set()
+    for _, argumentos in operacoes:
+        for argumento in argumentos:
+            if isinstance(argumento, CodigoProduto):
+                produtos.add(str(argumento))
+            elif isinstance(argumento, CodigoCupom):
+                cupons.add(str(argumento))
+    return produtos, cupons
+
+
+def resolve_cadastro(
+    operacoes: List[Operacao],
+    produtos: Dict[str, ProdutoPersisted],
+    cupons: Dict[str, Cupom],
+) -> List[Operacao]:
+    """
+    Substitui os códigos de produtos e cupons das operações pelos objetos do cadastro.
+    Levanta ProdutoNaoExisteError caso um produto não exista.
+    """
+    resolvidas = []
+    for funcao, argumentos in operacoes:
+        resolvidos = []
+        for argumento in argumentos:
+            if isinstance(argumento, CodigoProduto):
+                if argumento not in produtos:
+                    raise ProdutoNaoExisteError(
+                        "produto com código {} não existe".format(argumento)
+                    )
+                argumento = produtos[argumento]
+            elif isinstance(argumento, CodigoCupom):
+                argumento = cupons[argumento]
+            resolvidos.append(argumento)
+        resolvidas.append((funcao, resolvidos))
+    return resolvidas
+
+
+def aplica_operacoes(
+    carrinho: Carrinho, reservas: TransacaoReservas, operacoes: List[Operacao]
+) -> None:
+    """
+    Aplica no carrinho operações em lote já resolvidas por `resolve_cadastro()`.
+    """
+    for funcao, argumentos in operacoes:
+        funcao(carrinho, reservas, *argumentos)
+
+
+def descricoes_faltantes(carrinho: Carrinho) -> List[str]:
+    """
+    Retorna os códigos dos produtos do carrinho cuja descrição deve ser obtida do
+    cadastro para exibi-lo.
+    """
+    return [
+        produto.codigo
+        for produto in carrinho.produtos.values()
+        if produto.descricao is None
+    ]
+
+
+def cupons_aplicaveis(carrinho: Carrinho) -> List[Dict]:
+    """
+    Retorna os cupons do cadastro com desconto no carrinho e o desconto de cada um, do
+    maior para o menor desconto.
+    """
+    return [
+        {"codigo": cupom.codigo, "desconto": reais(desconto)}
+        for cupom, desconto in db_cupom_aplicaveis(carrinho)
+    ]
+
+
+def carrinho_dados(
+    carrinho: Carrinho,
+    cadastro: Dict[str, ProdutoPersisted],
+    agora: Optional[float] = None,
+) -> Dict:
+    """
+    Retorna a representação em dicionário de todo o carrinho de compras, com os valores
+    monetários em reais. As descrições que não estão no carrinho são obtidas de
+    `cadastro` (produtos de `descricoes_faltantes()`); um produto que não existe mais
+    fica com a descrição vazia.
+
+    O desconto do cupom é calculado no instante `agora` (padrão: o atual), o mesmo usado
+    por `etag_carrinho()` para a resposta em cache.
+    """
+    subtotal = carrinho.subtotal_centavos
+    desconto = carrinho.desconto_centavos(time() if agora is None else agora)
+    retorno_dados = {
+        "codigo": carrinho.codigo,
+        "versao": carrinho.versao,
+        "cliente": carrinho.cliente,
+        "totais": {"subtotal": reais(subtotal), "total": reais(subtotal - desconto)},
+        "produtos": [],
+        "cupom": {},
+    }
+    if carrinho.cupom:
+        retorno_dados["cupom"] = {
+            "codigo": carrinho.cupom.codigo,
+            "valor": reais(desconto),
+        }
+    for codigo_produto in carrinho.produtos:
+        produto = carrinho.produtos[codigo_produto]
+        descricao = produto.descricao
+        if descricao is None:
+            persisted = cadastro.get(codigo_produto)
+            descricao = persisted.descricao if persisted is not None else ""
+        retorno_dados["produtos"].append(
+            {
+                "codigo": produto.codigo,
+                "descricao": descricao,
+                "quantidade": produto.quantidade,
+                "preco_de": reais(produto.preco_de),
+                "preco_por": reais(produto.preco_por),
+            }
+        )
+    return retorno_dados
@@ -0,0 +1,143 @@
+"""
+Este módulo implementa o modo de perfilamento (profiling) por requisição, para
+investigar um endpoint lento em produção sem alterar o código.
+
+É ativado pelas variáveis de ambiente `PERFIL=1` (todas as requisições) ou
+`PERFIL_AMOSTRAGEM` (fração das requisições, ex: 0.01). As `PERFIL_TOP` funções com
+maior tempo cumulativo são escritas no log ou, caso `PERFIL_DIRETORIO` seja definido,
+o perfil completo é gravado em um arquivo `.prof` por requisição (para ser aberto com o
+`pstats` ou o `snakeviz`). Em ambos os casos, com a rota e o código do carrinho.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import re
+from itertools import count
+from os import environ, getpid
+from random import random
+from time import perf_counter, strftime
+from typing import Any, Callable, Optional
+
+from api_carrinho.log import log
+
+
+class Perfilador:
+    """
+    Perfila uma fração das requisições com o cProfile.
+    """
+
+    amostragem: float  # fração das requisições perfiladas (0: nenhuma, 1: todas)
+    top: int  # número de funções escritas no log
+    diretorio: Optional[str]  # diretório dos arquivos .prof (None: escreve no log)
+
+    def __init__(
+        self, amostragem: float = 0.0, top: int = 20, diretorio: Optional[str] = None
+    ) -> None:
+        self.amostragem = amostragem
+        self.top = top
+        self.diretorio = diretorio
+        self._sequencia = count(1)
+
+    def sorteia(self) -> bool:
+        """
+        Retorna se a requisição atual deve ser perfilada.
+        """
+        return self.amostragem > 0 and (
+            self.amostragem >= 1 or random() < self.amostragem
+        )
+
+    def executa(
+        self, rota: str, carrinho: Optional[str], f: Callable[..., Any], *args, **kwargs
+    ) -> Any:
+        """
+        Executa uma função com o perfilador, registrando o perfil com a rota e o código
+        do carrinho da requisição.
+        """
+        perfil = cProfile.Profile()
+        inicio = perf_counter()
+        try:
+            return perfil.runcall(f, *args, **kwargs)
+        finally:
+            self._registra(perfil, rota, carrinho, perf_counter() - inicio)
+
+    def _registra(
+        self,
+        perfil: cProfile.Profile,
+        rota: str,
+        carrinho: Optional[str],
+        segundos: float,
+    ) -> None:
+        """
+        Grava o perfil em um arquivo .prof ou escreve as funções mais custosas no log.
+        """
+        if self.diretorio is not None:
+            # A rota e o carrinho vêm da requisição: somente letras, números e "-".
+            nome = "{}-{}-{}-{}-{}.prof".format(
+                strftime("%Y%m%d%H%M%S"),
+                re.sub(r"[^\w-]+", "_", rota).strip("_"),
+                re.sub(r"[^\w-]+", "_", carrinho or "sem-carrinho"),
+                getpid(),
+                next(self._sequencia),
+            )
+            caminho = os.path.join(self.diretorio, nome)
+            perfil.dump_stats(caminho)
+            log.info(
+                "perfil de %s (carrinho %s, %.1f ms) gravado em %s",
+                rota,
+                carrinho,
+                segundos * 1000,
+                caminho,
+            )
+            return
+        saida = io.StringIO()
+        pstats.Stats(perfil, stream=saida).sort_stats("cumulative").print_stats(self.top)
+        log.info(
+            "perfil de %s (carrinho %s, %.1f ms):\n%s",
+            rota,
+            carrinho,
+            segundos * 1000,
+            saida.getvalue(),
+        )
+
+
+def _perfilador_padrao() -> Perfilador:
+    """
+    Cria o perfilador configurado pelas variáveis de ambiente.
+    """
+    amostragem = float(environ.get("PERFIL_AMOSTRAGEM", 0))
+    if environ.get("PERFIL", "0") == "1":
+        amostragem = 1.0
+    return Perfilador(
+        amostragem=amostragem,
+        top=int(environ.get("PERFIL_TOP", 20)),
+        diretorio=environ.get("PERFIL_DIRETORIO") or None,
+    )
+
+
+_PERFILADOR = _perfilador_padrao()
+
+
+def define_perfilador(perfilador: Perfilador) -> None:
+    """
+    Substitui o perfilador do processo.
+    """
+    global _PERFILADOR
+    _PERFILADOR = perfilador
+
+
+def sorteia() -> bool:
+    """
+    Retorna se a requisição atual deve ser perfilada.
+    """
+    return _PERFILADOR.sorteia()
+
+
+def executa(
+    rota: str, carrinho: Optional[str], f: Callable[..., Any], *args, **kwargs
+) -> Any:
+    """
+    Executa uma função com o perfilador do processo.
+    """
+    return _PERFILADOR.executa(rota, carrinho, f, *args, **kwargs)
@@ -1,11 +1,39 @@
 """
 Este módulo faz "mock" da persistência dos carrinhos de compras.
+
+A persistência é feita por um backend (`CarrinhosBackend`), escolhido pela variável de
+ambiente `CARRINHOS_BACKEND`:
+
+* `memoria` (padrão): os carrinhos ficam na memória do processo, expirando após um tempo
+  sem alterações (baseado em `Carrinho.data_alteracao`) ou quando o número máximo de
+  carrinhos é atingido, sendo removidos os alterados há mais tempo.
+* `sqlite`: os carrinhos ficam em um arquivo SQLite (`CARRINHOS_SQLITE`), compartilhado
+  entre vários processos (ex: workers do Gunicorn).
+* `diario`: os carrinhos ficam na memória, como em `memoria`, e cada alteração é
+  registrada em um diário em disco (`CARRINHOS_DIARIO`), recuperado ao reiniciar.
 """
-from typing import Dict
 
-from api_carrinho.models.carrinho import Carrinho
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from datetime import timedelta
+from itertools import islice, takewhile
+from os import environ
+from time import time
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
 
-_CARRINHOS: Dict[str, Carrinho] = {}
+from api_carrinho.models.carrinho import Carrinho
 
 
 class CarrinhoNaoExisteError(Exception):
@@ -16,28 +44,769 @@ class CarrinhoNaoExisteError(Exception):
     ...
 
 
+class CarrinhoVersaoConflitoError(Exception):
+    """
+    Carrinho foi alterado por outra requisição (versão diferente da esperada).
+    """
+
+    ...
+
+
+class CarrinhosBackend(ABC):
+    """
+    Interface dos backends de persistência dos carrinhos de compras.
+    """
+
+    # Chamada com cada carrinho removido (expirado, descartado ou apagado), para liberar
+    # recursos associados a ele, como as reservas de estoque.
+    ao_remover: Optional[Callable[[Carrinho], None]] = None
+
+    # Chamada com cada carrinho recuperado por `restaura()` ao iniciar o processo, para
+    # recriar os recursos associados a ele, como as reservas de estoque.
+    ao_restaurar: Optional[Callable[[Carrinho], None]] = None
+
+    # Caso verdadeiro, as operações fazem I/O bloqueante e são executadas em uma thread
+    # pelas funções assíncronas (`db_carrinho_*_async`), sem bloquear o event loop.
+    bloqueante: bool = False
+
+    # Caso verdadeiro, as reservas de estoque ficam no próprio armazenamento,
+    # compartilhado entre processos: a quantidade reservada de um produto é a soma das
+    # suas quantidades nos carrinhos gravados, e o estoque é conferido na gravação
+    # (`save()` com `estoques`). Caso falso, as reservas ficam no livro de reservas do
+    # processo (`api_carrinho.persist.estoque`), recriado por `ao_restaurar`.
+    reservas_compartilhadas: bool = False
+
+    def _removido(self, carrinho: Carrinho) -> None:
+        if self.ao_remover is not None:
+            self.ao_remover(carrinho)
+
+    def restaura(self) -> int:
+        """
+        Recupera os carrinhos persistidos por uma execução anterior do processo, antes de
+        atender as requisições, retornando quantos foram recuperados. Por padrão, não faz
+        nada: os carrinhos já estão disponíveis.
+        """
+        return 0
+
+    def reservado(self, produto: str) -> int:
+        """
+        Retorna a quantidade de um produto nos carrinhos gravados, somente em backends com
+        `reservas_compartilhadas`.
+        """
+        raise NotImplementedError("reservas de estoque ficam no livro do processo")
+
+    @abstractmethod
+    def fetch(self, codigo: str) -> Carrinho:
+        """
+        Obtém um carrinho. Levanta CarrinhoNaoExisteError caso não exista ou expirou.
+        """
+
+    @abstractmethod
+    def save(
+        self,
+        carrinho: Carrinho,
+        versao_anterior: Optional[int] = None,
+        estoques: Optional[Dict[str, int]] = None,
+    ) -> None:
+        """
+        Grava um carrinho, criando ou substituindo.
+
+        Caso versao_anterior seja informada, a gravação é condicional: só é feita caso o
+        carrinho persistido ainda esteja nesta versão (a versão lida antes das
+        alterações), levantando CarrinhoVersaoConflitoError caso contrário.
+
+        `estoques` (código do produto => estoque no cadastro) são os produtos reservados
+        pela alteração. Backends com `reservas_compartilhadas` conferem, na mesma
+        transação da gravação, que a quantidade de cada um nos carrinhos não ultrapassa
+        o estoque, levantando ProdutoSemEstoqueError caso contrário. Os demais ignoram:
+        o estoque já foi conferido pelo livro de reservas do processo.
+        """
+
+    @abstractmethod
+    def delete(self, codigo: str, versao: Optional[int] = None) -> None:
+        """
+        Remove um carrinho. Levanta CarrinhoNaoExisteError caso não exista.
+
+        Caso versao seja informada, a remoção é condicional: só é feita caso o carrinho
+        persistido esteja nesta versão, levantando CarrinhoVersaoConflitoError caso
+        contrário.
+        """
+
+    @abstractmethod
+    def expira(self) -> int:
+        """
+        Remove os carrinhos expirados, retornando quantos foram removidos.
+        """
+
+    @abstractmethod
+    def estatisticas(self) -> Dict[str, int]:
+        """
+        Retorna contadores do armazenamento: carrinhos vivos e removidos.
+        """
+
+    @abstractmethod
+    def do_cliente(self, cliente: str) -> List[Carrinho]:
+        """
+        Retorna os carrinhos vivos associados a um cliente (comparado como texto), pelo
+        índice de clientes, sem percorrer todos os carrinhos.
+        """
+
+    @abstractmethod
+    def com_produtos(self, produtos: Iterable[str]) -> List[str]:
+        """
+        Retorna os códigos dos carrinhos vivos com algum dos produtos, pelo índice de
+        produtos, sem percorrer todos os carrinhos.
+        """
+
+    @abstractmethod
+    def percorre(
+        self, alterado_antes: Optional[float] = None, lote: int = 1000
+    ) -> Iterator[Carrinho]:
+        """
+        Percorre os carrinhos vivos, opcionalmente somente os alterados antes de um
+        timestamp, obtendo-os da persistência em lotes de `lote` carrinhos, sem travar o
+        armazenamento entre um lote e outro. Carrinhos gravados ou removidos durante o
+        percurso podem ou não ser incluídos.
+        """
+
+
+class _Percurso:
+    """
+    Posição de um percurso de `CarrinhosMemoria.percorre()` na fila dos carrinhos.
+
+    Enquanto a fila não é alterada, o percurso avança pelo próprio iterador da fila, sem
+    copiar as chaves. Uma inclusão, remoção ou reordenação invalidaria o iterador: antes
+    dela, o armazenamento chama `materializa()`, que copia somente as chaves restantes.
+    """
+
+    def __init__(
+        self,
+        fila: "OrderedDict[bytes, Tuple[float, Carrinho]]",
+        alterado_antes: Optional[float],
+    ) -> None:
+        self._fila = fila
+        itens = iter(fila.items())
+        if alterado_antes is not None:
+            # A fila é ordenada pela data indexada: para no primeiro alterado depois.
+            itens = takewhile(lambda item: item[1][0] < alterado_antes, itens)
+        self._itens: Optional[Iterator[Tuple[bytes, Tuple[float, Carrinho]]]] = itens
+        self._restantes: Deque[bytes] = deque()
+
+    def materializa(self) -> None:
+        """
+        Copia as chaves restantes, antes de uma alteração estrutural da fila.
+        """
+        if self._itens is not None:
+            self._restantes.extend(chave for chave, _ in self._itens)
+            self._itens = None
+
+    def proximos(self, quantidade: int) -> List[Tuple[float, Carrinho]]:
+        """
+        Retorna os próximos `quantidade` itens da fila (lista vazia no fim), ignorando os
+        removidos desde a cópia das chaves. Deve ser chamada com a trava do armazenamento.
+        """
+        if self._itens is not None:
+            return [valor for _, valor in islice(self._itens, quantidade)]
+        encontrados = []
+        while self._restantes and len(encontrados) < quantidade:
+            encontrado = self._fila.get(self._restantes.popleft())
+            if encontrado is not None:
+                encontrados.append(encontrado)
+        return encontrados
+
+
+class CarrinhosMemoria(CarrinhosBackend):
+    """
+    Armazena carrinhos na memória com expiração por tempo (TTL) e por tamanho máximo.
+
+    Os carrinhos ficam em um OrderedDict ordenado pela data da última gravação, de forma
+    que os mais antigos ficam no início: a expiração só percorre os carrinhos expirados.
+    """
+
+    ttl: Optional[timedelta]  # tempo sem alterações para expirar (None: não expira)
+    maximo: Optional[int]  # número máximo de carrinhos (None: sem limite)
+    expirados: int  # contador de carrinhos removidos por TTL
+    descartados: int  # contador de carrinhos removidos por tamanho máximo
+
+    def __init__(
+        self, ttl: Optional[timedelta] = None, maximo: Optional[int] = None
+    ) -> None:
+        self.ttl = ttl
+        self.maximo = maximo
+        self.expirados = 0
+        self.descartados = 0
+        # Protege a fila entre threads. Reentrante, pois save() chama expira().
+        self._lock = threading.RLock()
+        # código binário => (timestamp de alteração quando indexado, carrinho)
+        self._carrinhos: "OrderedDict[bytes, Tuple[float, Carrinho]]" = OrderedDict()
+        # Índice de clientes: cliente (texto) => códigos binários dos seus carrinhos, e
+        # código binário => cliente quando indexado (somente carrinhos com cliente).
+        self._clientes: Dict[str, Set[bytes]] = {}
+        self._cliente_indexado: Dict[bytes, str] = {}
+        # Índice de produtos: código do produto => códigos binários dos carrinhos com
+        # ele, e código binário => produtos quando indexado (somente carrinhos com
+        # produtos).
+        self._produtos: Dict[str, Set[bytes]] = {}
+        self._produtos_indexados: Dict[bytes, Tuple[str, ...]] = {}
+        # Percursos em andamento (ver `percorre()`).
+        self._percursos: Set[_Percurso] = set()
+
+    def __len__(self) -> int:
+        return len(self._carrinhos)
+
+    def _limite(self) -> Optional[float]:
+        """
+        Retorna o timestamp de alteração abaixo do qual um carrinho está expirado.
+        """
+        if self.ttl is None:
+            return None
+        return time() - self.ttl.total_seconds()
+
+    def _altera_fila(self) -> None:
+        """
+        Deve ser chamada com a trava antes de incluir, remover ou reordenar carrinhos na
+        fila, que invalidaria os iteradores dos percursos em andamento.
+        """
+        for percurso in self._percursos:
+            percurso.materializa()
+
+    @staticmethod
+    def _chave(codigo: str) -> bytes:
+        """
+        Converte o código do carrinho para a chave binária. Um código inválido é tratado
+        como um carrinho inexistente.
+        """
+        try:
+            return Carrinho.chave_de(codigo)
+        except ValueError:
+            raise CarrinhoNaoExisteError(
+                "carrinho com código {} não existe".format(codigo)
+            )
+
+    def _indexa(self, chave: bytes, carrinho: Carrinho) -> None:
+        """
+        Atualiza os índices de clientes e de produtos com um carrinho gravado.
+        """
+        self._indexa_cliente(chave, carrinho)
+        self._indexa_produtos(chave, carrinho)
+
+    def _desindexa(self, chave: bytes) -> None:
+        """
+        Remove um carrinho dos índices de clientes e de produtos.
+        """
+        self._desindexa_cliente(chave)
+        self._indexa_produtos(chave, None)
+
+    def _indexa_cliente(self, chave: bytes, carrinho: Carrinho) -> None:
+        """
+        Atualiza o índice de clientes com o cliente atual de um carrinho gravado.
+        """
+        cliente = None if carrinho.cliente is None else str(carrinho.cliente)
+        if self._cliente_indexado.get(chave) == cliente:
+            return
+        self._desindexa_cliente(chave)
+        if cliente is not None:
+            self._clientes.setdefault(cliente, set()).add(chave)
+            self._cliente_indexado[chave] = cliente
+
+    def _desindexa_cliente(self, chave: bytes) -> None:
+        """
+        Remove um carrinho do índice de clientes.
+        """
+        cliente = self._cliente_indexado.pop(chave, None)
+        if cliente is not None:
+            chaves = self._clientes[cliente]
+            chaves.discard(chave)
+            if not chaves:
+                del self._clientes[cliente]
+
+    def _indexa_produtos(self, chave: bytes, carrinho: Optional[Carrinho]) -> None:
+        """
+        Atualiza o índice de produtos com os produtos atuais de um carrinho gravado (ou
+        remove o carrinho, com None), alterando somente os produtos adicionados e
+        removidos desde a última gravação.
+        """
+        anteriores = self._produtos_indexados.get(chave, ())
+        atuais = carrinho.produtos.keys() if carrinho is not None else {}.keys()
+        if len(anteriores) == len(atuais) and all(p in atuais for p in anteriores):
+            return
+        for produto in set(anteriores).difference(atuais):
+            chaves = self._produtos[produto]
+            chaves.discard(chave)
+            if not chaves:
+                del self._produtos[produto]
+        for produto in atuais - set(anteriores):
+            self._produtos.setdefault(produto, set()).add(chave)
+        if atuais:
+            # Uma tupla ocupa menos memória que um conjunto.
+            self._produtos_indexados[chave] = tuple(atuais)
+        else:
+            del self._produtos_indexados[chave]
+
+    def fetch(self, codigo: str) -> Carrinho:
+        return self._obtem(self._chave(codigo), codigo)
+
+    def _obtem(self, chave: bytes, codigo: str) -> Carrinho:
+        with self._lock:
+            try:
+                _, carrinho = self._carrinhos[chave]
+            except KeyError:
+                raise CarrinhoNaoExisteError(
+                    "carrinho com código {} não existe".format(codigo)
+                )
+            limite = self._limite()
+            if limite is not None and carrinho.timestamp_alteracao < limite:
+                self._altera_fila()
+                del self._carrinhos[chave]
+                self._desindexa(chave)
+                self.expirados += 1
+                self._removido(carrinho)
+                raise CarrinhoNaoExisteError(
+                    "carrinho com código {} não existe".format(codigo)
+                )
+            return carrinho
+
+    def save(
+        self,
+        carrinho: Carrinho,
+        versao_anterior: Optional[int] = None,
+        estoques: Optional[Dict[str, int]] = None,
+    ) -> None:
+        chave = carrinho.chave
+        with self._lock:
+            if versao_anterior is not None:
+                # O carrinho persistido pode ser o próprio objeto alterado: neste caso,
+                # as alterações foram serializadas pela trava do carrinho.
+                _, persistido = self._carrinhos.get(chave, (None, carrinho))
+                if persistido is not carrinho and persistido.versao != versao_anterior:
+                    raise CarrinhoVersaoConflitoError(
+                        "carrinho com código {} está na versão {}, esperada {}".format(
+                            carrinho.codigo, persistido.versao, versao_anterior
+                        )
+                    )
+            indexado = self._carrinhos.get(chave)
+            if indexado is None or indexado[0] != carrinho.timestamp_alteracao:
+                self._altera_fila()
+            self._carrinhos[chave] = (carrinho.timestamp_alteracao, carrinho)
+            # Um carrinho gravado sem alterar a data (ex: reprecificado) mantém sua
+            # posição na fila de expiração.
+            if indexado is not None and indexado[0] != carrinho.timestamp_alteracao:
+                self._carrinhos.move_to_end(chave)
+            self._indexa(chave, carrinho)
+            self.expira()
+            if self.maximo is not None:
+                while len(self._carrinhos) > self.maximo:
+                    self._altera_fila()
+                    descartada, (_, descartado) = self._carrinhos.popitem(last=False)
+                    self._desindexa(descartada)
+                    self.descartados += 1
+                    self._removido(descartado)
+
+    def delete(self, codigo: str, versao: Optional[int] = None) -> None:
+        self._remove(self._chave(codigo), codigo, versao)
+
+    def _remove(self, chave: bytes, codigo: str, versao: Optional[int] = None) -> None:
+        with self._lock:
+            try:
+                _, carrinho = self._carrinhos[chave]
+            except KeyError:
+                raise CarrinhoNaoExisteError(
+                    "carrinho com código {} não existe".format(codigo)
+                )
+            if versao is not None and carrinho.versao != versao:
+                raise CarrinhoVersaoConflitoError(
+                    "carrinho com código {} está na versão {}, esperada {}".format(
+                        codigo, carrinho.versao, versao
+                    )
+                )
+            self._altera_fila()
+            del self._carrinhos[chave]
+            self._desindexa(chave)
+            self._removido(carrinho)
+
+    def expira(self) -> int:
+        """
+        Remove os carrinhos expirados, retornando quantos foram removidos. Percorre
+        somente o início da fila, parando no primeiro carrinho não expirado.
+
+        Um carrinho alterado sem ser gravado novamente tem uma data de alteração mais
+        nova que a indexada: neste caso, ele é reindexado no final da fila.
+        """
+        limite = self._limite()
+        if limite is None:
+            return 0
+        removidos = 0
+        with self._lock:
+            while self._carrinhos:
+                chave, (indexado, carrinho) = next(iter(self._carrinhos.items()))
+                if indexado >= limite:
+                    break
+                self._altera_fila()
+                if carrinho.timestamp_alteracao >= limite:
+                    self._carrinhos[chave] = (carrinho.timestamp_alteracao, carrinho)
+                    self._carrinhos.move_to_end(chave)
+                    continue
+                del self._carrinhos[chave]
+                self._desindexa(chave)
+                removidos += 1
+                self._removido(carrinho)
+            self.expirados += removidos
+        return removidos
+
+    def estatisticas(self) -> Dict[str, int]:
+        """
+        Retorna contadores do armazenamento: carrinhos vivos e removidos.
+        """
+        with self._lock:
+            return {
+                "carrinhos": len(self._carrinhos),
+                "expirados": self.expirados,
+                "descartados": self.descartados,
+            }
+
+    def do_cliente(self, cliente: str) -> List[Carrinho]:
+        """
+        Retorna os carrinhos vivos do cliente pelo índice. Um carrinho com o cliente
+        alterado e ainda não gravado é retornado pelo cliente gravado.
+        """
+        with self._lock:
+            limite = self._limite()
+            return [
+                carrinho
+                for _, carrinho in (
+                    self._carrinhos[chave] for chave in self._clientes.get(cliente, ())
+                )
+                if limite is None or carrinho.timestamp_alteracao >= limite
+            ]
+
+    def com_produtos(self, produtos: Iterable[str]) -> List[str]:
+        """
+        Retorna os códigos dos carrinhos vivos com algum dos produtos pelo índice. Um
+        carrinho alterado e ainda não gravado é retornado pelos produtos gravados.
+        """
+        with self._lock:
+            chaves: Set[bytes] = set()
+            for produto in produtos:
+                chaves.update(self._produtos.get(produto, ()))
+            limite = self._limite()
+            return [
+                carrinho.codigo
+                for _, carrinho in (self._carrinhos[chave] for chave in chaves)
+                if limite is None or carrinho.timestamp_alteracao >= limite
+            ]
+
+    def percorre(
+        self, alterado_antes: Optional[float] = None, lote: int = 1000
+    ) -> Iterator[Carrinho]:
+        """
+        Percorre os carrinhos vivos em lotes, obtidos com a trava. O percurso avança pela
+        própria fila (ver `_Percurso`): as chaves restantes só são copiadas caso a fila
+        seja alterada durante o percurso, e os carrinhos removidos desde a cópia são
+        ignorados.
+
+        Com `alterado_antes`, percorre somente o início da fila, como em `expira()`.
+        """
+        with self._lock:
+            percurso = _Percurso(self._carrinhos, alterado_antes)
+            self._percursos.add(percurso)
+        try:
+            while True:
+                with self._lock:
+                    limite = self._limite()
+                    encontrados = percurso.proximos(lote)
+                if not encontrados:
+                    return
+                for _, carrinho in encontrados:
+                    alteracao = carrinho.timestamp_alteracao
+                    if limite is not None and alteracao < limite:
+                        continue
+                    if alterado_antes is not None and alteracao >= alterado_antes:
+                        continue
+                    yield carrinho
+        finally:
+            with self._lock:
+                self._percursos.discard(percurso)
+
+
+class CarrinhosFragmentados(CarrinhosBackend):
+    """
+    Armazena carrinhos na memória divididos em fragmentos (`CarrinhosMemoria`), escolhidos
+    pelo hash do código binário do carrinho. Cada fragmento tem sua trava e sua fila de
+    expiração, de forma que threads acessando carrinhos diferentes raramente disputam a
+    mesma trava.
+
+    O tamanho máximo é dividido entre os fragmentos: o descarte remove o carrinho mais
+    antigo do fragmento cheio, não necessariamente o mais antigo de todos.
+    """
+
+    _fragmentos: List[CarrinhosMemoria]  # fragmentos, indexados pelo hash do código
+
+    def __init__(
+        self,
+        fragmentos: int,
+        ttl: Optional[timedelta] = None,
+        maximo: Optional[int] = None,
+    ) -> None:
+        if fragmentos < 1:
+            raise ValueError("número de fragmentos deve ser positivo")
+        por_fragmento = None if maximo is None else -(-maximo // fragmentos)
+        self._fragmentos = [
+            CarrinhosMemoria(ttl=ttl, maximo=por_fragmento) for _ in range(fragmentos)
+        ]
+        for fragmento in self._fragmentos:
+            # Os carrinhos removidos pelos fragmentos são repassados ao gancho definido
+            # neste armazenamento, mesmo que seja definido depois.
+            fragmento.ao_remover = self._removido
+
+    def __len__(self) -> int:
+        return sum(len(fragmento) for fragmento in self._fragmentos)
+
+    def _fragmento(self, chave: bytes) -> CarrinhosMemoria:
+        return self._fragmentos[hash(chave) % len(self._fragmentos)]
+
+    def fetch(self, codigo: str) -> Carrinho:
+        chave = CarrinhosMemoria._chave(codigo)
+        return self._fragmento(chave)._obtem(chave, codigo)
+
+    def save(
+        self,
+        carrinho: Carrinho,
+        versao_anterior: Optional[int] = None,
+        estoques: Optional[Dict[str, int]] = None,
+    ) -> None:
+        self._fragmento(carrinho.chave).save(carrinho, versao_anterior)
+
+    def delete(self, codigo: str, versao: Optional[int] = None) -> None:
+        chave = CarrinhosMemoria._chave(codigo)
+        self._fragmento(chave)._remove(chave, codigo, versao)
+
+    def expira(self) -> int:
+        """
+        Remove os carrinhos expirados de cada fragmento, retornando quantos foram
+        removidos. Trava um fragmento por vez.
+        """
+        return sum(fragmento.expira() for fragmento in self._fragmentos)
+
+    def estatisticas(self) -> Dict[str, int]:
+        """
+        Retorna contadores do armazenamento: carrinhos vivos e removidos, somados entre
+        os fragmentos.
+        """
+        totais = {"carrinhos": 0, "expirados": 0, "descartados": 0}
+        for fragmento in self._fragmentos:
+            for nome, valor in fragmento.estatisticas().items():
+                totais[nome] += valor
+        return totais
+
+    def do_cliente(self, cliente: str) -> List[Carrinho]:
+        """
+        Retorna os carrinhos vivos do cliente, consultando o índice de cada fragmento.
+        """
+        return [
+            carrinho
+            for fragmento in self._fragmentos
+            for carrinho in fragmento.do_cliente(cliente)
+        ]
+
+    def com_produtos(self, produtos: Iterable[str]) -> List[str]:
+        """
+        Retorna os códigos dos carrinhos vivos com algum dos produtos, consultando o
+        índice de cada fragmento.
+        """
+        produtos = list(produtos)
+        return [
+            codigo
+            for fragmento in self._fragmentos
+            for codigo in fragmento.com_produtos(produtos)
+        ]
+
+    def percorre(
+        self, alterado_antes: Optional[float] = None, lote: int = 1000
+    ) -> Iterator[Carrinho]:
+        """
+        Percorre os carrinhos vivos de um fragmento por vez.
+        """
+        for fragmento in self._fragmentos:
+            yield from fragmento.percorre(alterado_antes, lote)
+
+
+def _backend_padrao() -> CarrinhosBackend:
+    """
+    Cria o backend de persistência configurado pelas variáveis de ambiente.
+    """
+    ttl = timedelta(seconds=int(environ.get("CARRINHOS_TTL", 7 * 24 * 60 * 60)))
+    backend = environ.get("CARRINHOS_BACKEND", "memoria")
+    if backend == "memoria":
+        maximo = environ.get("CARRINHOS_MAXIMO")
+        fragmentos = int(environ.get("CARRINHOS_FRAGMENTOS", 1))
+        if fragmentos > 1:
+            return CarrinhosFragmentados(
+                fragmentos, ttl=ttl, maximo=int(maximo) if maximo else None
+            )
+        return CarrinhosMemoria(ttl=ttl, maximo=int(maximo) if maximo else None)
+    if backend == "sqlite":
+        from api_carrinho.persist.carrinhos_sqlite import CarrinhosSQLite
+
+        return CarrinhosSQLite(environ.get("CARRINHOS_SQLITE", "carrinhos.db"), ttl=ttl)
+    if backend == "diario":
+        from api_carrinho.persist.carrinhos_diario import CarrinhosDiario
+
+        maximo = environ.get("CARRINHOS_MAXIMO")
+        return CarrinhosDiario(
+            environ.get("CARRINHOS_DIARIO", "diario"),
+            ttl=ttl,
+            maximo=int(maximo) if maximo else None,
+            duravel=environ.get("DIARIO_DURAVEL", "1") == "1",
+            tamanho_compactacao=int(environ.get("DIARIO_COMPACTACAO_MB", 64)) * 2**20,
+        )
+    raise ValueError("backend de carrinhos desconhecido: {}".format(backend))
+
+
+_CARRINHOS: CarrinhosBackend = _backend_padrao()
+
+
+def db_carrinho_define_backend(backend: CarrinhosBackend) -> None:
+    """
+    Substitui o backend de persistência dos carrinhos.
+    """
+    global _CARRINHOS
+    backend.ao_remover = _CARRINHOS.ao_remover
+    backend.ao_restaurar = _CARRINHOS.ao_restaurar
+    _CARRINHOS = backend
+
+
 def db_carrinho_fetch(codigo: str) -> Carrinho:
     """
     Obtém um carrinho da persistência.
     """
-    try:
-        return _CARRINHOS[codigo]
-    except KeyError:
-        raise CarrinhoNaoExisteError("carrinho com código {} não existe".format(codigo))
+    return _CARRINHOS.fetch(codigo)
+
+
+def db_carrinho_save(
+    carrinho: Carrinho,
+    versao_anterior: Optional[int] = None,
+    estoques: Optional[Dict[str, int]] = None,
+) -> None:
+    """
+    Salva um carrinho na persistência. Com versao_anterior, só grava caso o carrinho
+    persistido ainda esteja nesta versão (levanta CarrinhoVersaoConflitoError). Com
+    estoques, confere o estoque dos produtos reservados caso as reservas fiquem na
+    persistência (levanta ProdutoSemEstoqueError).
+    """
+    _CARRINHOS.save(carrinho, versao_anterior, estoques)
+
+
+def db_carrinho_delete(codigo: str, versao: Optional[int] = None) -> None:
+    """
+    Remove um carrinho da persistência. Com versao, a remoção é condicional (ver
+    `CarrinhosBackend.delete()`).
+    """
+    _CARRINHOS.delete(codigo, versao)
+
+
+def db_carrinho_ao_remover(funcao: Optional[Callable[[Carrinho], None]]) -> None:
+    """
+    Define a função chamada com cada carrinho removido da persistência (expirado,
+    descartado ou apagado).
+    """
+    _CARRINHOS.ao_remover = funcao
+
+
+def db_carrinho_ao_restaurar(funcao: Optional[Callable[[Carrinho], None]]) -> None:
+    """
+    Define a função chamada com cada carrinho recuperado ao iniciar o processo.
+    """
+    _CARRINHOS.ao_restaurar = funcao
+
+
+def db_carrinho_restaura() -> int:
+    """
+    Recupera os carrinhos persistidos por uma execução anterior do processo (caso o
+    backend precise), retornando quantos foram recuperados.
+    """
+    return _CARRINHOS.restaura()
+
+
+def db_carrinho_do_cliente(cliente: str) -> List[Carrinho]:
+    """
+    Retorna os carrinhos vivos associados a um cliente.
+    """
+    return _CARRINHOS.do_cliente(cliente)
+
+
+def db_carrinho_com_produtos(produtos: Iterable[str]) -> List[str]:
+    """
+    Retorna os códigos dos carrinhos vivos com algum dos produtos.
+    """
+    return _CARRINHOS.com_produtos(produtos)
+
+
+def db_carrinho_percorre(alterado_antes: Optional[float] = None) -> Iterator[Carrinho]:
+    """
+    Percorre os carrinhos vivos da persistência em lotes, opcionalmente somente os
+    alterados antes de um timestamp.
+    """
+    return _CARRINHOS.percorre(alterado_antes)
+
+
+def db_carrinho_reservas_compartilhadas() -> bool:
+    """
+    Retorna se as reservas de estoque ficam na persistência dos carrinhos, compartilhada
+    entre processos, em vez do livro de reservas do processo.
+    """
+    return _CARRINHOS.reservas_compartilhadas
+
+
+def db_carrinho_reservado(produto: str) -> int:
+    """
+    Retorna a quantidade de um produto nos carrinhos gravados, caso as reservas de
+    estoque fiquem na persistência.
+    """
+    return _CARRINHOS.reservado(produto)
+
+
+def db_carrinho_expira() -> int:
+    """
+    Remove os carrinhos expirados da persistência, retornando quantos foram removidos.
+    """
+    return _CARRINHOS.expira()
+
+
+def db_carrinho_estatisticas() -> Dict[str, int]:
+    """
+    Retorna os contadores da persistência dos carrinhos.
+    """
+    return _CARRINHOS.estatisticas()
+
+
+async def db_carrinho_fetch_async(codigo: str) -> Carrinho:
+    """
+    Versão assíncrona de db_carrinho_fetch().
+    """
+    if _CARRINHOS.bloqueante:
+        return await asyncio.to_thread(_CARRINHOS.fetch, codigo)
+    return _CARRINHOS.fetch(codigo)
 
 
-def db_carrinho_save(carrinho: Carrinho) -> None:
+async def db_carrinho_save_async(
+    carrinho: Carrinho,
+    versao_anterior: Optional[int] = None,
+    estoques: Optional[Dict[str, int]] = None,
+) -> None:
     """
-    Salva um carrinho na persistência.
+    Versão assíncrona de db_carrinho_save().
     """
-    _CARRINHOS[carrinho.codigo] = carrinho
+    if _CARRINHOS.bloqueante:
+        await asyncio.to_thread(_CARRINHOS.save, carrinho, versao_anterior, estoques)
+    else:
+        _CARRINHOS.save(carrinho, versao_anterior, estoques)
 
 
-def db_carrinho_delete(codigo: str) -> None:
+async def db_carrinho_delete_async(codigo: str, versao: Optional[int] = None) -> None:
     """
-    Remove um carrinho da persistência.
+    Versão assíncrona de db_carrinho_delete().
     """
-    try:
-        del _CARRINHOS[codigo]
-    except KeyError:
-        raise CarrinhoNaoExisteError("carrinho com código {} não existe".format(codigo))
+    if _CARRINHOS.bloqueante:
+        await asyncio.to_thread(_CARRINHOS.delete, codigo, versao)
+    else:
+        _CARRINHOS.delete(codigo, versao)
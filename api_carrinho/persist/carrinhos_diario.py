@@ -0,0 +1,498 @@
+"""
+Este módulo implementa a persistência dos carrinhos de compras em memória com um diário
+(journal) em disco, para que os carrinhos sobrevivam a um reinício do processo.
+
+Cada gravação ou remoção de um carrinho é acrescentada ao segmento atual do diário
+(`diario-<n>.log`), com o estado completo do carrinho. Os registros de gravações
+concorrentes são escritos juntos, com um único fsync, por uma thread própria (group
+commit). Quando os segmentos passam de um tamanho, é gravado um snapshot compacto com
+todos os carrinhos vivos (`snapshot`), e os segmentos anteriores a ele são removidos.
+
+Ao iniciar o processo, `restaura()` lê o snapshot e os segmentos seguintes, mantendo
+somente o último registro de cada carrinho, e reconstrói os carrinhos em memória.
+
+O diretório do diário é usado por um único processo de cada vez.
+"""
+
+import atexit
+import fcntl
+import os
+import struct
+import threading
+import zlib
+from datetime import timedelta
+from time import sleep
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from api_carrinho.log import log
+from api_carrinho.models.carrinho import Carrinho
+from api_carrinho.persist.carrinhos import CarrinhosMemoria
+
+# Tipos dos registros do diário.
+_GRAVACAO = 1
+_REMOCAO = 2
+
+# Cabeçalho de cada registro: tamanho dos dados, CRC-32 (do tipo, da chave e dos dados),
+# tipo e chave do carrinho. Seguido dos dados (`Carrinho.serializa()`).
+_CABECALHO = struct.Struct("<IIB16s")
+
+# Início do arquivo de snapshot: assinatura e último segmento do diário incluído nele.
+_SNAPSHOT = struct.Struct("<8sQ")
+_ASSINATURA = b"CARRSNP1"
+
+# Tamanho do buffer de leitura e escrita dos arquivos grandes (snapshot e segmentos).
+_BUFFER = 2**20
+
+
+def _registro(tipo: int, chave: bytes, dados: bytes) -> bytes:
+    """
+    Retorna um registro do diário no formato binário.
+    """
+    crc = zlib.crc32(dados, zlib.crc32(chave, zlib.crc32(bytes((tipo,)))))
+    return _CABECALHO.pack(len(dados), crc, tipo, chave) + dados
+
+
+def _le_registros(arquivo: BinaryIO) -> Iterator[Tuple[int, bytes, bytes]]:
+    """
+    Lê os registros de um arquivo (tipo, chave e dados), parando no primeiro incompleto
+    ou corrompido, como o último de um segmento interrompido por uma queda do processo.
+    """
+    while True:
+        cabecalho = arquivo.read(_CABECALHO.size)
+        if len(cabecalho) < _CABECALHO.size:
+            if cabecalho:
+                log.warning("registro incompleto no final de %s", arquivo.name)
+            return
+        tamanho, crc, tipo, chave = _CABECALHO.unpack(cabecalho)
+        dados = arquivo.read(tamanho)
+        if len(dados) < tamanho or crc != zlib.crc32(
+            dados, zlib.crc32(chave, zlib.crc32(bytes((tipo,))))
+        ):
+            log.warning("registro incompleto ou corrompido em %s", arquivo.name)
+            return
+        yield tipo, chave, dados
+
+
+def _sincroniza_diretorio(diretorio: str) -> None:
+    """
+    Garante que a criação, renomeação ou remoção de arquivos no diretório está em disco.
+    """
+    descritor = os.open(diretorio, os.O_RDONLY)
+    try:
+        os.fsync(descritor)
+    finally:
+        os.close(descritor)
+
+
+class Diario:
+    """
+    Segmentos do diário em disco. Os registros são acrescentados ao segmento atual por
+    uma thread própria, em lotes: cada lote tem um único fsync, com todos os registros
+    recebidos enquanto o fsync anterior era feito (group commit). Somente a thread
+    escreve nos segmentos, inclusive no encerrado por uma rotação, de forma que os
+    registros são gravados sempre na ordem das sequências.
+    """
+
+    diretorio: str  # diretório dos segmentos
+    segmento: int  # número do segmento atual
+    intervalo: float  # segundos mínimos entre os fsyncs (0: assim que houver registros)
+    tamanho: int  # bytes gravados nos segmentos desde a última rotação
+
+    def __init__(self, diretorio: str, segmento: int, intervalo: float = 0.0) -> None:
+        self.diretorio = diretorio
+        self.segmento = segmento
+        self.intervalo = intervalo
+        self.tamanho = 0
+        self._arquivo = open(self.caminho(segmento), "ab")
+        _sincroniza_diretorio(diretorio)
+        # Protege os registros pendentes e as sequências.
+        self._trava = threading.Lock()
+        # Avisa a thread de gravação de novos registros, e quem aguarda os registros
+        # gravados.
+        self._novos = threading.Condition(self._trava)
+        self._gravados = threading.Condition(self._trava)
+        self._pendentes: List[bytes] = []
+        # Segmentos encerrados por rotações, com os registros pendentes e a sequência do
+        # último registro de cada um, a serem gravados e fechados pela thread.
+        self._encerrados: List[Tuple[BinaryIO, List[bytes], int]] = []
+        self._sequencia = 0  # sequência do último registro recebido
+        self._gravada = 0  # sequência do último registro gravado com fsync
+        self._erro: Optional[OSError] = None
+        self._fechado = False
+        self._thread = threading.Thread(
+            target=self._grava_lotes, name="diario-carrinhos", daemon=True
+        )
+        self._thread.start()
+
+    def caminho(self, segmento: int) -> str:
+        """
+        Retorna o caminho do arquivo de um segmento.
+        """
+        return os.path.join(self.diretorio, "diario-{:012d}.log".format(segmento))
+
+    def registra(self, registro: bytes) -> int:
+        """
+        Acrescenta um registro ao diário, retornando sua sequência para `aguarda()`.
+        Levanta OSError caso uma gravação anterior tenha falhado.
+        """
+        with self._trava:
+            if self._erro is not None:
+                raise self._erro
+            if self._fechado:
+                raise ValueError("diário fechado")
+            self._pendentes.append(registro)
+            self._sequencia += 1
+            if len(self._pendentes) == 1:
+                self._novos.notify()
+            return self._sequencia
+
+    def aguarda(self, sequencia: int) -> None:
+        """
+        Aguarda um registro ser gravado em disco (com fsync). Levanta OSError caso a
+        gravação falhe.
+        """
+        with self._trava:
+            while self._gravada < sequencia and self._erro is None:
+                self._gravados.wait()
+            if self._gravada < sequencia:
+                raise self._erro  # type: ignore[misc]
+
+    def _grava(
+        self, arquivo: BinaryIO, lote: List[bytes], sequencia: int, conta: bool = True
+    ) -> None:
+        """
+        Escreve um lote de registros em um segmento, com fsync. Somente chamada pela
+        thread de gravação. Com conta=False, o lote não é somado ao tamanho do diário
+        (lote de um segmento já encerrado).
+        """
+        if lote:
+            arquivo.write(b"".join(lote))
+            arquivo.flush()
+            os.fsync(arquivo.fileno())
+        with self._trava:
+            if conta:
+                self.tamanho += sum(len(registro) for registro in lote)
+            self._gravada = max(self._gravada, sequencia)
+            self._gravados.notify_all()
+
+    def _grava_lotes(self) -> None:
+        """
+        Laço da thread de gravação. Os segmentos encerrados são gravados e fechados
+        antes do lote do segmento atual, mantendo a ordem das sequências.
+        """
+        while True:
+            with self._trava:
+                while not self._pendentes and not self._encerrados and not self._fechado:
+                    self._novos.wait()
+                if not self._pendentes and not self._encerrados:
+                    return
+                encerrados, self._encerrados = self._encerrados, []
+                lote, self._pendentes = self._pendentes, []
+                sequencia = self._sequencia
+                arquivo = self._arquivo
+            try:
+                for anterior, lote_anterior, sequencia_anterior in encerrados:
+                    self._grava(anterior, lote_anterior, sequencia_anterior, conta=False)
+                    anterior.close()
+                if encerrados:
+                    # O novo segmento precisa estar no diretório antes dos seus registros
+                    # serem confirmados.
+                    _sincroniza_diretorio(self.diretorio)
+                self._grava(arquivo, lote, sequencia)
+            except OSError as ex:
+                log.exception("falha ao gravar o diário dos carrinhos")
+                with self._trava:
+                    self._erro = ex
+                    self._gravados.notify_all()
+                return
+            if self.intervalo:
+                # Acumula os registros de um intervalo em um único lote.
+                sleep(self.intervalo)
+
+    def rotaciona(self) -> Tuple[int, int]:
+        """
+        Passa a acrescentar os próximos registros em um novo segmento, retornando o
+        número do segmento encerrado e a sequência do seu último registro. Não aguarda
+        nenhum fsync: os registros pendentes são gravados no segmento encerrado pela
+        thread de gravação, antes dos seguintes; use `aguarda()` com a sequência
+        retornada para aguardar o segmento encerrado estar completo em disco.
+        """
+        novo = open(self.caminho(self.segmento + 1), "ab")
+        with self._trava:
+            if self._erro is not None:
+                novo.close()
+                raise self._erro
+            self._encerrados.append((self._arquivo, self._pendentes, self._sequencia))
+            self._pendentes = []
+            encerrado = self.segmento
+            self.segmento += 1
+            self._arquivo = novo
+            self.tamanho = 0
+            self._novos.notify()
+            return encerrado, self._sequencia
+
+    def fecha(self) -> None:
+        """
+        Grava os registros pendentes e encerra a thread de gravação.
+        """
+        with self._trava:
+            self._fechado = True
+            self._novos.notify()
+        self._thread.join()
+        self._arquivo.close()
+
+
+class CarrinhosDiario(CarrinhosMemoria):
+    """
+    Armazena carrinhos na memória, como `CarrinhosMemoria`, registrando cada gravação e
+    remoção em um diário em disco. Os carrinhos são recuperados por `restaura()`, que
+    deve ser chamada antes de qualquer gravação.
+
+    Os carrinhos expirados ou descartados por tamanho máximo não são registrados: ao
+    restaurar, a expiração e o tamanho máximo são aplicados novamente.
+    """
+
+    diretorio: str  # diretório do diário e do snapshot
+    duravel: bool  # caso verdadeiro, as gravações aguardam o fsync do diário
+    # Com o diário durável, as gravações aguardam o fsync e são executadas em uma thread
+    # pelas funções assíncronas da persistência.
+    bloqueante: bool
+    tamanho_compactacao: int  # bytes no diário para gravar um novo snapshot
+    compactacoes: int  # contador de snapshots gravados
+
+    def __init__(
+        self,
+        diretorio: str,
+        ttl: Optional[timedelta] = None,
+        maximo: Optional[int] = None,
+        duravel: bool = True,
+        tamanho_compactacao: int = 64 * 2**20,
+    ) -> None:
+        super().__init__(ttl=ttl, maximo=maximo)
+        self.diretorio = diretorio
+        self.duravel = duravel
+        self.bloqueante = duravel
+        self.tamanho_compactacao = tamanho_compactacao
+        self.compactacoes = 0
+        self._diario: Optional[Diario] = None
+        self._trava_diretorio: Optional[BinaryIO] = None
+        # Somente uma compactação de cada vez.
+        self._compactando = threading.Lock()
+
+    @property
+    def caminho_snapshot(self) -> str:
+        return os.path.join(self.diretorio, "snapshot")
+
+    def _segmentos(self) -> List[int]:
+        """
+        Retorna os números dos segmentos do diário existentes, em ordem.
+        """
+        segmentos = []
+        for nome in os.listdir(self.diretorio):
+            if nome.startswith("diario-") and nome.endswith(".log"):
+                segmentos.append(int(nome[len("diario-") : -len(".log")]))
+        return sorted(segmentos)
+
+    def _remove_segmentos(self, ate: int) -> None:
+        """
+        Remove os segmentos do diário já incluídos no snapshot.
+        """
+        for segmento in self._segmentos():
+            if segmento <= ate:
+                os.remove(
+                    os.path.join(self.diretorio, "diario-{:012d}.log".format(segmento))
+                )
+        _sincroniza_diretorio(self.diretorio)
+
+    def _diario_aberto(self) -> Diario:
+        if self._diario is None:
+            raise RuntimeError("diário dos carrinhos não restaurado")
+        return self._diario
+
+    def restaura(self) -> int:
+        """
+        Trava o diretório do diário e reconstrói os carrinhos a partir do snapshot e dos
+        segmentos seguintes, retornando quantos foram recuperados. Os carrinhos
+        expirados ou além do tamanho máximo são descartados, sem chamar `ao_remover`.
+        """
+        if self._diario is not None:
+            raise RuntimeError("diário dos carrinhos já restaurado")
+        os.makedirs(self.diretorio, exist_ok=True)
+        trava = open(os.path.join(self.diretorio, "trava"), "wb")
+        try:
+            fcntl.flock(trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            trava.close()
+            raise RuntimeError(
+                "diário dos carrinhos {} em uso por outro processo".format(self.diretorio)
+            )
+        self._trava_diretorio = trava
+
+        # Último estado de cada carrinho: chave => dados serializados. Os carrinhos só
+        # são reconstruídos ao final, uma única vez.
+        ultimos: Dict[bytes, bytes] = {}
+        incluido = 0
+        if os.path.exists(self.caminho_snapshot):
+            with open(self.caminho_snapshot, "rb", buffering=_BUFFER) as arquivo:
+                assinatura, incluido = _SNAPSHOT.unpack(arquivo.read(_SNAPSHOT.size))
+                if assinatura != _ASSINATURA:
+                    raise ValueError("snapshot inválido: {}".format(arquivo.name))
+                for _, chave, dados in _le_registros(arquivo):
+                    ultimos[chave] = dados
+        segmentos = self._segmentos()
+        tamanho = 0
+        for segmento in segmentos:
+            if segmento <= incluido:
+                continue
+            caminho = os.path.join(self.diretorio, "diario-{:012d}.log".format(segmento))
+            if os.path.getsize(caminho) == 0:
+                # Segmento de uma execução sem alterações.
+                os.remove(caminho)
+                continue
+            tamanho += os.path.getsize(caminho)
+            with open(caminho, "rb", buffering=_BUFFER) as arquivo:
+                for tipo, chave, dados in _le_registros(arquivo):
+                    if tipo == _GRAVACAO:
+                        ultimos[chave] = dados
+                    else:
+                        ultimos.pop(chave, None)
+
+        carrinhos = [
+            Carrinho.desserializa(dados, chave) for chave, dados in ultimos.items()
+        ]
+        del ultimos
+        carrinhos.sort(key=lambda carrinho: carrinho.timestamp_alteracao)
+        limite = self._limite()
+        if limite is not None:
+            carrinhos = [c for c in carrinhos if c.timestamp_alteracao >= limite]
+        if self.maximo is not None:
+            carrinhos = carrinhos[max(0, len(carrinhos) - self.maximo) :]
+        with self._lock:
+            self._altera_fila()
+            for carrinho in carrinhos:
+                self._carrinhos[carrinho.chave] = (carrinho.timestamp_alteracao, carrinho)
+                self._indexa(carrinho.chave, carrinho)
+        if self.ao_restaurar is not None:
+            for carrinho in carrinhos:
+                self.ao_restaurar(carrinho)
+
+        # Sem aguardar o fsync, os registros são gravados em lotes a cada 10 ms.
+        self._diario = Diario(
+            self.diretorio,
+            max(segmentos + [incluido]) + 1,
+            intervalo=0.0 if self.duravel else 0.01,
+        )
+        self._diario.tamanho = tamanho
+        # Segmentos de uma compactação interrompida antes de removê-los.
+        self._remove_segmentos(incluido)
+        atexit.register(self.fecha)
+        log.info("%d carrinhos restaurados do diário %s", len(carrinhos), self.diretorio)
+        return len(carrinhos)
+
+    def _registrado(self, sequencia: int) -> None:
+        """
+        Aguarda o fsync de um registro (caso durável) e inicia uma compactação em
+        segundo plano caso o diário tenha passado do tamanho.
+        """
+        diario = self._diario_aberto()
+        if self.duravel:
+            diario.aguarda(sequencia)
+        if diario.tamanho >= self.tamanho_compactacao and self._compactando.acquire(
+            blocking=False
+        ):
+            threading.Thread(
+                target=self._compacta_em_segundo_plano,
+                name="compactacao-carrinhos",
+                daemon=True,
+            ).start()
+
+    def save(
+        self,
+        carrinho: Carrinho,
+        versao_anterior: Optional[int] = None,
+        estoques: Optional[Dict[str, int]] = None,
+    ) -> None:
+        diario = self._diario_aberto()
+        registro = _registro(_GRAVACAO, carrinho.chave, carrinho.serializa())
+        # Registra com a trava do armazenamento, na mesma ordem das gravações em memória,
+        # mas aguarda o fsync sem ela, para que gravações concorrentes usem o mesmo.
+        with self._lock:
+            super().save(carrinho, versao_anterior)
+            sequencia = diario.registra(registro)
+        self._registrado(sequencia)
+
+    def delete(self, codigo: str, versao: Optional[int] = None) -> None:
+        diario = self._diario_aberto()
+        registro = _registro(_REMOCAO, self._chave(codigo), b"")
+        with self._lock:
+            super().delete(codigo, versao)
+            sequencia = diario.registra(registro)
+        self._registrado(sequencia)
+
+    @staticmethod
+    def _serializa(carrinho: Carrinho) -> bytes:
+        """
+        Serializa um carrinho que pode estar sendo alterado por outra thread, tentando
+        novamente caso seus produtos sejam alterados durante a serialização.
+        """
+        while True:
+            try:
+                return carrinho.serializa()
+            except RuntimeError:
+                continue
+
+    def compacta(self) -> None:
+        """
+        Grava um snapshot com todos os carrinhos vivos e remove os segmentos do diário
+        anteriores a ele.
+
+        O diário é rotacionado antes de copiar a lista dos carrinhos: um carrinho
+        alterado depois disso pode entrar no snapshot já alterado, mas sua gravação
+        também está no novo segmento, aplicado depois do snapshot ao restaurar.
+
+        Somente a rotação e a cópia da lista são feitas com a trava do armazenamento; o
+        fsync do segmento encerrado e a gravação do snapshot são feitos sem ela, sem
+        bloquear as operações nos carrinhos.
+        """
+        diario = self._diario_aberto()
+        with self._lock:
+            segmento, sequencia = diario.rotaciona()
+            carrinhos = [carrinho for _, carrinho in self._carrinhos.values()]
+        diario.aguarda(sequencia)
+        temporario = self.caminho_snapshot + ".tmp"
+        with open(temporario, "wb", buffering=_BUFFER) as arquivo:
+            arquivo.write(_SNAPSHOT.pack(_ASSINATURA, segmento))
+            for carrinho in carrinhos:
+                arquivo.write(
+                    _registro(_GRAVACAO, carrinho.chave, self._serializa(carrinho))
+                )
+            arquivo.flush()
+            os.fsync(arquivo.fileno())
+        os.replace(temporario, self.caminho_snapshot)
+        _sincroniza_diretorio(self.diretorio)
+        self._remove_segmentos(segmento)
+        self.compactacoes += 1
+        log.info("snapshot dos carrinhos gravado com %d carrinhos", len(carrinhos))
+
+    def _compacta_em_segundo_plano(self) -> None:
+        try:
+            self.compacta()
+        except Exception:
+            log.exception("falha ao compactar o diário dos carrinhos")
+        finally:
+            self._compactando.release()
+
+    def fecha(self) -> None:
+        """
+        Grava os registros pendentes e libera o diretório do diário. Chamada ao terminar
+        o processo.
+        """
+        if self._diario is None:
+            return
+        with self._compactando:
+            self._diario.fecha()
+            self._diario = None
+        if self._trava_diretorio is not None:
+            self._trava_diretorio.close()
+            self._trava_diretorio = None
+        atexit.unregister(self.fecha)
@@ -0,0 +1,384 @@
+"""
+Este módulo implementa a persistência dos carrinhos de compras em um arquivo SQLite, em
+modo WAL, podendo ser compartilhado entre vários processos na mesma máquina, junto com as
+reservas de estoque dos produtos nos carrinhos.
+"""
+
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from os import getpid
+from time import monotonic
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from api_carrinho.models.carrinho import Carrinho
+from api_carrinho.persist.carrinhos import (
+    CarrinhoNaoExisteError,
+    CarrinhosBackend,
+    CarrinhoVersaoConflitoError,
+)
+from api_carrinho.persist.produtos import ProdutoSemEstoqueError
+
+# Carrinhos e índice de produtos: uma linha por produto de cada carrinho, com sua
+# quantidade (a reserva de estoque do carrinho), removidas junto com o carrinho pelo
+# gatilho.
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS carrinhos (
+    chave BLOB PRIMARY KEY,
+    versao INTEGER NOT NULL,
+    data_alteracao REAL NOT NULL,
+    dados BLOB NOT NULL,
+    cliente TEXT
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS carrinhos_data_alteracao ON carrinhos (data_alteracao);
+CREATE INDEX IF NOT EXISTS carrinhos_cliente ON carrinhos (cliente)
+WHERE cliente IS NOT NULL;
+CREATE TABLE IF NOT EXISTS carrinhos_produtos (
+    produto TEXT NOT NULL,
+    chave BLOB NOT NULL,
+    quantidade INTEGER NOT NULL,
+    PRIMARY KEY (produto, chave)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS carrinhos_produtos_chave ON carrinhos_produtos (chave);
+CREATE TRIGGER IF NOT EXISTS carrinhos_produtos_remove AFTER DELETE ON carrinhos BEGIN
+    DELETE FROM carrinhos_produtos WHERE chave = OLD.chave;
+END;
+"""
+
+# Máximo de parâmetros em uma consulta (o limite do SQLite pode ser 999).
+_PARAMETROS = 900
+
+
+class CarrinhosSQLite(CarrinhosBackend):
+    """
+    Armazena carrinhos serializados (`Carrinho.serializa()`) em um arquivo SQLite.
+
+    Cada thread de cada processo usa sua própria conexão. A expiração por TTL usa o
+    índice de `data_alteracao`, sendo executada no máximo a cada `intervalo_expiracao`
+    segundos durante as gravações. Não há limite de tamanho máximo.
+
+    As reservas de estoque são as quantidades do índice de produtos, gravadas e
+    conferidas na mesma transação do carrinho e liberadas pelo gatilho que remove o
+    carrinho: todos os processos veem as mesmas reservas, sem recriá-las ao iniciar.
+    """
+
+    bloqueante = True
+    reservas_compartilhadas = True
+
+    caminho: str  # caminho do arquivo do banco de dados
+    ttl: Optional[timedelta]  # tempo sem alterações para expirar (None: não expira)
+    intervalo_expiracao: float  # segundos entre expirações automáticas
+    expirados: int  # contador de carrinhos removidos por TTL neste processo
+
+    def __init__(
+        self,
+        caminho: str,
+        ttl: Optional[timedelta] = None,
+        intervalo_expiracao: float = 60.0,
+    ) -> None:
+        self.caminho = caminho
+        self.ttl = ttl
+        self.intervalo_expiracao = intervalo_expiracao
+        self.expirados = 0
+        self._local = threading.local()
+        self._proxima_expiracao = monotonic() + intervalo_expiracao
+        self._conexao().executescript(_ESQUEMA)
+
+    def _conexao(self) -> sqlite3.Connection:
+        """
+        Retorna a conexão da thread atual, abrindo uma nova caso necessário (inclusive
+        após um fork, já que conexões SQLite não podem ser herdadas).
+        """
+        conexao = getattr(self._local, "conexao", None)
+        if conexao is None or self._local.pid != getpid():
+            conexao = sqlite3.connect(self.caminho, timeout=30.0, isolation_level=None)
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("PRAGMA synchronous=NORMAL")
+            self._local.conexao = conexao
+            self._local.pid = getpid()
+        return conexao
+
+    def _limite(self) -> Optional[float]:
+        """
+        Retorna o timestamp de alteração abaixo do qual um carrinho está expirado.
+        """
+        if self.ttl is None:
+            return None
+        return (datetime.now() - self.ttl).timestamp()
+
+    @staticmethod
+    def _chave(codigo: str) -> bytes:
+        """
+        Converte o código do carrinho para a chave binária. Um código inválido é tratado
+        como um carrinho inexistente.
+        """
+        try:
+            return Carrinho.chave_de(codigo)
+        except ValueError:
+            raise CarrinhoNaoExisteError(
+                "carrinho com código {} não existe".format(codigo)
+            )
+
+    def fetch(self, codigo: str) -> Carrinho:
+        linha = (
+            self._conexao()
+            .execute(
+                "SELECT data_alteracao, dados FROM carrinhos WHERE chave = ?",
+                (self._chave(codigo),),
+            )
+            .fetchone()
+        )
+        limite = self._limite()
+        if linha is None or (limite is not None and linha[0] < limite):
+            raise CarrinhoNaoExisteError(
+                "carrinho com código {} não existe".format(codigo)
+            )
+        return Carrinho.desserializa(linha[1])
+
+    def save(
+        self,
+        carrinho: Carrinho,
+        versao_anterior: Optional[int] = None,
+        estoques: Optional[Dict[str, int]] = None,
+    ) -> None:
+        conexao = self._conexao()
+        valores = (
+            carrinho.versao,
+            carrinho.timestamp_alteracao,
+            carrinho.serializa(),
+            None if carrinho.cliente is None else str(carrinho.cliente),
+            carrinho.chave,
+        )
+        # O carrinho e seus produtos no índice (as reservas de estoque) são gravados e
+        # conferidos na mesma transação.
+        conexao.execute("BEGIN IMMEDIATE")
+        try:
+            if versao_anterior is None:
+                conexao.execute(
+                    "INSERT OR REPLACE INTO carrinhos (versao, data_alteracao, dados, "
+                    "cliente, chave) VALUES (?, ?, ?, ?, ?)",
+                    valores,
+                )
+            else:
+                # Gravação condicional: só altera a linha caso a versão persistida seja
+                # a lida antes das alterações, mesmo que outro processo tenha gravado.
+                cursor = conexao.execute(
+                    "UPDATE carrinhos SET versao = ?, data_alteracao = ?, dados = ?, "
+                    "cliente = ? WHERE chave = ? AND versao = ?",
+                    valores + (versao_anterior,),
+                )
+                if cursor.rowcount == 0:
+                    linha = conexao.execute(
+                        "SELECT versao FROM carrinhos WHERE chave = ?", (carrinho.chave,)
+                    ).fetchone()
+                    if linha is None:
+                        raise CarrinhoNaoExisteError(
+                            "carrinho com código {} não existe".format(carrinho.codigo)
+                        )
+                    raise CarrinhoVersaoConflitoError(
+                        "carrinho com código {} está na versão {}, esperada {}".format(
+                            carrinho.codigo, linha[0], versao_anterior
+                        )
+                    )
+            conexao.execute(
+                "DELETE FROM carrinhos_produtos WHERE chave = ?", (carrinho.chave,)
+            )
+            conexao.executemany(
+                "INSERT INTO carrinhos_produtos (produto, chave, quantidade)"
+                " VALUES (?, ?, ?)",
+                _produtos(carrinho),
+            )
+            if estoques:
+                self._confere_estoques(conexao, carrinho, estoques)
+            conexao.execute("COMMIT")
+        except BaseException:
+            conexao.execute("ROLLBACK")
+            raise
+        if monotonic() >= self._proxima_expiracao:
+            self.expira()
+
+    @staticmethod
+    def _confere_estoques(
+        conexao: sqlite3.Connection, carrinho: Carrinho, estoques: Dict[str, int]
+    ) -> None:
+        """
+        Confere, na transação da gravação, que a quantidade reservada de cada produto
+        (somada entre os carrinhos, já com este) não ultrapassa seu estoque.
+        """
+        for produto, estoque in estoques.items():
+            if produto not in carrinho.produtos:
+                continue
+            (reservado,) = conexao.execute(
+                "SELECT SUM(quantidade) FROM carrinhos_produtos WHERE produto = ?",
+                (produto,),
+            ).fetchone()
+            if reservado > estoque:
+                quantidade = carrinho.produtos[produto].quantidade
+                raise ProdutoSemEstoqueError(
+                    "produto %s sem estoque suficiente (disponível: %d, pedido: %d)"
+                    % (produto, estoque - reservado + quantidade, quantidade)
+                )
+
+    def reservado(self, produto: str) -> int:
+        (reservado,) = (
+            self._conexao()
+            .execute(
+                "SELECT COALESCE(SUM(quantidade), 0) FROM carrinhos_produtos"
+                " WHERE produto = ?",
+                (produto,),
+            )
+            .fetchone()
+        )
+        return reservado
+
+    def _remove(self, condicao: str, parametros: Tuple) -> int:
+        """
+        Remove os carrinhos que atendem à condição, retornando quantos foram removidos.
+        Caso `ao_remover` esteja definida, os carrinhos são lidos antes de removidos, na
+        mesma transação, e passados para ela.
+        """
+        conexao = self._conexao()
+        if self.ao_remover is None:
+            return conexao.execute(
+                "DELETE FROM carrinhos WHERE " + condicao, parametros
+            ).rowcount
+        conexao.execute("BEGIN IMMEDIATE")
+        try:
+            linhas = conexao.execute(
+                "SELECT dados FROM carrinhos WHERE " + condicao, parametros
+            ).fetchall()
+            conexao.execute("DELETE FROM carrinhos WHERE " + condicao, parametros)
+            conexao.execute("COMMIT")
+        except BaseException:
+            conexao.execute("ROLLBACK")
+            raise
+        for (dados,) in linhas:
+            self._removido(Carrinho.desserializa(dados))
+        return len(linhas)
+
+    def delete(self, codigo: str, versao: Optional[int] = None) -> None:
+        chave = self._chave(codigo)
+        if versao is None:
+            removidos = self._remove("chave = ?", (chave,))
+        else:
+            # Remoção condicional, como a gravação: mesmo que outro processo tenha
+            # gravado o carrinho depois de lido.
+            removidos = self._remove("chave = ? AND versao = ?", (chave, versao))
+        if removidos == 0:
+            linha = None
+            if versao is not None:
+                linha = (
+                    self._conexao()
+                    .execute("SELECT versao FROM carrinhos WHERE chave = ?", (chave,))
+                    .fetchone()
+                )
+            if linha is None:
+                raise CarrinhoNaoExisteError(
+                    "carrinho com código {} não existe".format(codigo)
+                )
+            raise CarrinhoVersaoConflitoError(
+                "carrinho com código {} está na versão {}, esperada {}".format(
+                    codigo, linha[0], versao
+                )
+            )
+
+    def expira(self) -> int:
+        self._proxima_expiracao = monotonic() + self.intervalo_expiracao
+        limite = self._limite()
+        if limite is None:
+            return 0
+        removidos = self._remove("data_alteracao < ?", (limite,))
+        self.expirados += removidos
+        return removidos
+
+    def estatisticas(self) -> Dict[str, int]:
+        (carrinhos,) = (
+            self._conexao().execute("SELECT COUNT(*) FROM carrinhos").fetchone()
+        )
+        return {"carrinhos": carrinhos, "expirados": self.expirados, "descartados": 0}
+
+    def do_cliente(self, cliente: str) -> List[Carrinho]:
+        condicao = "cliente = ?"
+        parametros: Tuple = (cliente,)
+        limite = self._limite()
+        if limite is not None:
+            condicao += " AND data_alteracao >= ?"
+            parametros += (limite,)
+        return [
+            Carrinho.desserializa(dados, chave)
+            for chave, dados in self._conexao().execute(
+                "SELECT chave, dados FROM carrinhos WHERE " + condicao, parametros
+            )
+        ]
+
+    def com_produtos(self, produtos: Iterable[str]) -> List[str]:
+        """
+        Retorna os códigos dos carrinhos vivos com algum dos produtos, consultando o
+        índice de produtos em grupos de até `_PARAMETROS` produtos.
+        """
+        produtos = list(produtos)
+        condicao = ""
+        parametros: Tuple = ()
+        limite = self._limite()
+        if limite is not None:
+            condicao = " AND c.data_alteracao >= ?"
+            parametros = (limite,)
+        conexao = self._conexao()
+        chaves = set()
+        for inicio in range(0, len(produtos), _PARAMETROS):
+            grupo = produtos[inicio : inicio + _PARAMETROS]
+            chaves.update(
+                chave
+                for (chave,) in conexao.execute(
+                    "SELECT DISTINCT p.chave FROM carrinhos_produtos p "
+                    "JOIN carrinhos c ON c.chave = p.chave "
+                    "WHERE p.produto IN ({}){}".format(
+                        ",".join("?" * len(grupo)), condicao
+                    ),
+                    tuple(grupo) + parametros,
+                )
+            )
+        return [str(UUID(bytes=chave)) for chave in chaves]
+
+    def percorre(
+        self, alterado_antes: Optional[float] = None, lote: int = 1000
+    ) -> Iterator[Carrinho]:
+        """
+        Percorre os carrinhos vivos em lotes ordenados pela chave: cada lote é uma
+        consulta a partir da última chave do anterior, sem manter uma transação aberta.
+        """
+        condicoes = ["chave > ?"]
+        parametros: Tuple = ()
+        limite = self._limite()
+        if limite is not None:
+            condicoes.append("data_alteracao >= ?")
+            parametros += (limite,)
+        if alterado_antes is not None:
+            condicoes.append("data_alteracao < ?")
+            parametros += (alterado_antes,)
+        consulta = (
+            "SELECT chave, dados FROM carrinhos WHERE {} ORDER BY chave LIMIT ?".format(
+                " AND ".join(condicoes)
+            )
+        )
+        ultima = b""
+        while True:
+            linhas = (
+                self._conexao()
+                .execute(consulta, (ultima,) + parametros + (lote,))
+                .fetchall()
+            )
+            for chave, dados in linhas:
+                yield Carrinho.desserializa(dados, chave)
+            if len(linhas) < lote:
+                return
+            ultima = linhas[-1][0]
+
+
+def _produtos(carrinho: Carrinho) -> Iterator[Tuple[str, bytes, int]]:
+    """
+    Retorna as linhas do índice de produtos de um carrinho: (produto, chave, quantidade).
+    """
+    for produto in carrinho.produtos.values():
+        yield produto.codigo, carrinho.chave, produto.quantidade
@@ -1,9 +1,23 @@
 """
 Este módulo faz "mock" da persistência dos cupons de desconto.
+
+As regras dos cupons são carregadas e compiladas (`Cupom`) uma única vez, ao iniciar, em
+um cadastro (`CadastroCupons`) indexado pelo código e pelos produtos elegíveis. Por
+padrão, o cadastro tem alguns cupons de exemplo; com a variável de ambiente
+`CUPONS_ARQUIVO`, as regras são lidas de um arquivo JSONL (uma regra por linha, ver
+`regra()`).
 """
+
+import json
 from dataclasses import dataclass
+from datetime import datetime
+from os import environ
+from time import time
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
+from api_carrinho.models.carrinho import Carrinho
 from api_carrinho.models.cupom import Cupom
+from api_carrinho.models.dinheiro import centavos
 
 
 class CupomNaoExisteError(Exception):
@@ -14,6 +28,14 @@ class CupomNaoExisteError(Exception):
     ...
 
 
+class CupomExpiradoError(Exception):
+    """
+    Cupom existe, mas já expirou.
+    """
+
+    ...
+
+
 @dataclass
 class CupomPersisted:
     """
@@ -22,21 +44,212 @@ class CupomPersisted:
     """
 
     codigo: str
-    valor: float
+    valor: int = 0  # em centavos
+    percentual: float = 0.0
+    subtotal_minimo: int = 0  # em centavos
+    produtos: Optional[List[str]] = None
+    validade: Optional[datetime] = None
+
+    def compila(self) -> Cupom:
+        """
+        Compila a regra do cupom, para ser avaliada nos totalizadores dos carrinhos.
+        """
+        return Cupom(
+            codigo=self.codigo,
+            valor=self.valor,
+            percentual=self.percentual,
+            subtotal_minimo=self.subtotal_minimo,
+            produtos=frozenset(self.produtos) if self.produtos is not None else None,
+            validade=self.validade.timestamp() if self.validade is not None else None,
+        )
+
+
+def _numero(dados: Dict, campo: str) -> float:
+    valor = dados.get(campo, 0.0)
+    if isinstance(valor, bool) or not isinstance(valor, (int, float)) or not valor >= 0:
+        raise ValueError("{} deve ser um número não negativo".format(campo))
+    return float(valor)
+
+
+def regra(dados: Any) -> CupomPersisted:
+    """
+    Cria a regra de um cupom a partir de um objeto JSON, com o campo `codigo` e os campos
+    opcionais:
+
+    * `valor`: desconto fixo, em reais;
+    * `percentual`: desconto percentual (0 a 100) sobre os produtos elegíveis;
+    * `subtotal_minimo`: subtotal do carrinho necessário para o desconto, em reais;
+    * `produtos`: lista dos códigos dos produtos elegíveis (omitido: todos);
+    * `validade`: data e hora de expiração no formato ISO 8601.
+
+    Levanta ValueError caso algum campo seja inválido.
+    """
+    if not isinstance(dados, dict):
+        raise ValueError("esperado um objeto com a regra do cupom")
+    codigo = dados.get("codigo")
+    if not isinstance(codigo, str) or not codigo:
+        raise ValueError("codigo deve ser um texto")
+    resultado = CupomPersisted(
+        codigo=codigo,
+        valor=centavos(_numero(dados, "valor")),
+        percentual=_numero(dados, "percentual"),
+        subtotal_minimo=centavos(_numero(dados, "subtotal_minimo")),
+    )
+    if resultado.percentual > 100:
+        raise ValueError("percentual deve ser no máximo 100")
+    if resultado.valor and resultado.percentual:
+        raise ValueError("informe somente valor ou percentual")
+    produtos = dados.get("produtos")
+    if produtos is not None:
+        if not isinstance(produtos, list) or not all(
+            isinstance(produto, str) for produto in produtos
+        ):
+            raise ValueError("produtos deve ser uma lista de códigos")
+        resultado.produtos = produtos
+    validade = dados.get("validade")
+    if validade is not None:
+        try:
+            resultado.validade = datetime.fromisoformat(validade)
+        except (TypeError, ValueError):
+            raise ValueError("validade deve ser uma data ISO 8601")
+    return resultado
+
+
+def le_jsonl(arquivo: IO[str]) -> Iterator[CupomPersisted]:
+    """
+    Lê as regras dos cupons de um arquivo JSONL (uma regra por linha).
+    """
+    for numero, linha in enumerate(arquivo, 1):
+        if not linha.strip():
+            continue
+        try:
+            yield regra(json.loads(linha))
+        except ValueError as e:
+            raise ValueError("linha {}: {}".format(numero, e))
+
+
+class CadastroCupons:
+    """
+    Cadastro dos cupons de desconto compilados, indexados pelo código e pelos produtos
+    elegíveis. Os cupons aplicáveis a um carrinho são encontrados em uma única passagem
+    pelos produtos do carrinho, somando a base de desconto de cada cupom restrito pelo
+    índice de produtos, sem percorrer os produtos do carrinho para cada cupom.
+    """
+
+    _por_codigo: Dict[str, Cupom]  # código => cupom
+    _por_produto: Dict[str, List[Cupom]]  # código do produto => cupons restritos a ele
+    _gerais: List[Cupom]  # cupons válidos para todos os produtos
+
+    def __init__(self, regras: Iterable[CupomPersisted] = ()) -> None:
+        self._por_codigo = {}
+        self._por_produto = {}
+        self._gerais = []
+        for persisted in regras:
+            cupom = persisted.compila()
+            if cupom.codigo in self._por_codigo:
+                raise ValueError("cupom {} duplicado".format(cupom.codigo))
+            self._por_codigo[cupom.codigo] = cupom
+            if cupom.produtos is None:
+                self._gerais.append(cupom)
+            else:
+                for produto in cupom.produtos:
+                    self._por_produto.setdefault(produto, []).append(cupom)
+
+    def __len__(self) -> int:
+        return len(self._por_codigo)
+
+    def fetch(self, codigo: str) -> Cupom:
+        """
+        Obtém um cupom pelo código. Levanta CupomNaoExisteError caso não exista e
+        CupomExpiradoError caso tenha expirado.
+        """
+        try:
+            cupom = self._por_codigo[codigo]
+        except KeyError:
+            raise CupomNaoExisteError("cupom com código {} não existe".format(codigo))
+        if not cupom.valida_cupom():
+            raise CupomExpiradoError("cupom com código {} expirou".format(codigo))
+        return cupom
+
+    def aplicaveis(
+        self, carrinho: Carrinho, agora: Optional[float] = None
+    ) -> List[Tuple[Cupom, int]]:
+        """
+        Retorna os cupons com desconto no carrinho e o desconto de cada um, em centavos
+        e limitado ao subtotal, do maior para o menor desconto.
+        """
+        agora = time() if agora is None else agora
+        subtotal = carrinho.subtotal_centavos
+        bases: Dict[str, int] = {}
+        for codigo, produto in carrinho.produtos.items():
+            restritos = self._por_produto.get(codigo)
+            if restritos:
+                valor = produto.quantidade * produto.preco_por
+                for cupom in restritos:
+                    bases[cupom.codigo] = bases.get(cupom.codigo, 0) + valor
+        resultado = []
+        for cupom in self._gerais:
+            desconto = min(cupom.desconto_centavos(subtotal, subtotal, agora), subtotal)
+            if desconto > 0:
+                resultado.append((cupom, desconto))
+        for codigo, base in bases.items():
+            cupom = self._por_codigo[codigo]
+            desconto = cupom.desconto_centavos(subtotal, base, agora)
+            if desconto > 0:
+                resultado.append((cupom, desconto))
+        resultado.sort(key=lambda aplicavel: (-aplicavel[1], aplicavel[0].codigo))
+        return resultado
+
+
+# Alguns cupons de desconto de exemplo.
+_EXEMPLOS = [
+    CupomPersisted(codigo="VALE10", valor=1000),
+    CupomPersisted(codigo="BLACKFRIDAY15", valor=1500),
+    CupomPersisted(codigo="CAMISETA20", percentual=20.0, produtos=["AB1234567"]),
+    CupomPersisted(codigo="PRIMEIRA5", percentual=5.0, subtotal_minimo=20000),
+]
+
+
+def _cadastro_padrao() -> CadastroCupons:
+    """
+    Cria o cadastro de cupons configurado pelas variáveis de ambiente.
+    """
+    arquivo = environ.get("CUPONS_ARQUIVO")
+    if arquivo is None:
+        return CadastroCupons(_EXEMPLOS)
+    with open(arquivo, encoding="utf-8") as entrada:
+        return CadastroCupons(le_jsonl(entrada))
 
 
-# Insere alguns cupons de desconto de exemplo.
-_CUPOMS = {
-    "VALE10": Cupom(codigo="VALE10", valor=10.0),
-    "BLACKFRIDAY15": Cupom(codigo="BLACKFRIDAY15", valor=15.0),
-}
+_CUPONS: CadastroCupons = _cadastro_padrao()
 
 
-def db_cupom_fetch(codigo: str) -> CupomPersisted:
+def db_cupom_define_cadastro(cadastro: CadastroCupons) -> None:
+    """
+    Substitui o cadastro de cupons (ex: após recarregar as regras).
+    """
+    global _CUPONS
+    _CUPONS = cadastro
+
+
+def db_cupom_fetch(codigo: str) -> Cupom:
     """
     Coleta um cupom de desconto do banco de dados.
     """
-    try:
-        return _CUPOMS[codigo]
-    except KeyError:
-        raise CupomNaoExisteError("cupom com código {} não existe".format(codigo))
+    return _CUPONS.fetch(codigo)
+
+
+def db_cupom_aplicaveis(carrinho: Carrinho) -> List[Tuple[Cupom, int]]:
+    """
+    Retorna os cupons com desconto no carrinho e o desconto de cada um, em centavos, do
+    maior para o menor.
+    """
+    return _CUPONS.aplicaveis(carrinho)
+
+
+async def db_cupom_fetch_async(codigo: str) -> Cupom:
+    """
+    Versão assíncrona de db_cupom_fetch(). Os cupons ficam na memória do processo, sem
+    I/O, e são obtidos diretamente no event loop.
+    """
+    return db_cupom_fetch(codigo)
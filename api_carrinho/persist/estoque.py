@@ -0,0 +1,169 @@
+"""
+Este módulo faz "mock" das reservas de estoque dos produtos nos carrinhos de compras.
+
+Cada produto possui um contador da quantidade reservada pelos carrinhos, de forma que o
+estoque disponível é obtido em O(1): `estoque - reservado`. As reservas de produtos
+diferentes usam travas diferentes (tabela de travas por código do produto), sem uma trava
+global.
+
+Assim como o cadastro de produtos, as reservas ficam na memória do processo, exceto com um
+backend de carrinhos com reservas compartilhadas entre processos (ex: SQLite): neste caso,
+as reservas são as quantidades dos produtos nos carrinhos gravados, conferidas pelo
+próprio backend ao gravar o carrinho, e o livro do processo não é usado.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from api_carrinho.persist.carrinhos import (
+    db_carrinho_reservado,
+    db_carrinho_reservas_compartilhadas,
+)
+from api_carrinho.persist.produtos import ProdutoSemEstoqueError, db_produto_fetch
+from api_carrinho.travas import TabelaTravas
+
+
+class ReservasEstoque:
+    """
+    Livro de reservas de estoque: código do produto => quantidade reservada.
+    """
+
+    def __init__(self, travas: int = 256) -> None:
+        self._reservado: Dict[str, int] = {}
+        self._travas = TabelaTravas(travas)
+
+    def reservado(self, codigo: str) -> int:
+        """
+        Retorna a quantidade reservada de um produto.
+        """
+        return self._reservado.get(codigo, 0)
+
+    def disponivel(self, codigo: str, estoque: int) -> int:
+        """
+        Retorna o estoque disponível (não reservado) de um produto, dado seu estoque no
+        cadastro.
+        """
+        return estoque - self._reservado.get(codigo, 0)
+
+    def reserva(self, codigo: str, quantidade: int, estoque: Optional[int]) -> None:
+        """
+        Reserva uma quantidade de um produto, dado seu estoque no cadastro (já obtido pelo
+        chamador: o livro não consulta o cadastro, que pode bloquear). Levanta exceção
+        ProdutoSemEstoqueError caso não exista estoque disponível suficiente, sem reservar
+        nada.
+
+        Com estoque=None, reserva sem conferir o estoque (ex: para devolver uma reserva
+        liberada indevidamente).
+        """
+        with self._travas.trava(codigo):
+            reservado = self._reservado.get(codigo, 0)
+            if estoque is not None and estoque - reservado < quantidade:
+                raise ProdutoSemEstoqueError(
+                    "produto %s sem estoque suficiente (disponível: %d, pedido: %d)"
+                    % (codigo, estoque - reservado, quantidade)
+                )
+            self._reservado[codigo] = reservado + quantidade
+
+    def libera(self, codigo: str, quantidade: int) -> None:
+        """
+        Libera uma quantidade reservada de um produto.
+        """
+        with self._travas.trava(codigo):
+            reservado = self._reservado.get(codigo, 0) - quantidade
+            if reservado > 0:
+                self._reservado[codigo] = reservado
+            else:
+                self._reservado.pop(codigo, None)
+
+
+class TransacaoReservas:
+    """
+    Agrupa reservas e liberações de estoque feitas durante uma alteração de carrinho,
+    permitindo desfazê-las caso a alteração não seja gravada.
+
+    Com reservas=None, as reservas ficam na persistência dos carrinhos: a transação
+    somente registra o estoque dos produtos reservados (`estoques`), conferido ao gravar
+    o carrinho.
+    """
+
+    # Código do produto => estoque no cadastro, dos produtos reservados com conferência.
+    estoques: Dict[str, int]
+
+    def __init__(self, reservas: Optional[ReservasEstoque]) -> None:
+        self._reservas = reservas
+        self._feitas: List[Tuple[str, int]] = []  # (código do produto, quantidade)
+        self.estoques = {}
+
+    def reserva(self, codigo: str, quantidade: int, estoque: Optional[int]) -> None:
+        """
+        Reserva (quantidade positiva) ou libera (negativa) estoque de um produto, dado seu
+        estoque no cadastro. Com estoque=None, reserva sem conferir o estoque disponível
+        (ex: estoque já reservado por outro carrinho, transferido para este).
+        """
+        if quantidade > 0 and estoque is not None:
+            self.estoques[codigo] = estoque
+        if self._reservas is None:
+            return
+        if quantidade > 0:
+            self._reservas.reserva(codigo, quantidade, estoque)
+        elif quantidade < 0:
+            self._reservas.libera(codigo, -quantidade)
+        else:
+            return
+        self._feitas.append((codigo, quantidade))
+
+    def libera(self, codigo: str, quantidade: int) -> None:
+        """
+        Libera uma quantidade reservada de um produto.
+        """
+        self.reserva(codigo, -quantidade, None)
+
+    def desfaz(self) -> None:
+        """
+        Desfaz as reservas e liberações feitas, na ordem inversa.
+        """
+        while self._feitas:
+            codigo, quantidade = self._feitas.pop()
+            if quantidade > 0:
+                self._reservas.libera(codigo, quantidade)
+            else:
+                self._reservas.reserva(codigo, -quantidade, None)
+
+
+_RESERVAS = ReservasEstoque()
+
+
+def db_estoque_disponivel(codigo: str) -> int:
+    """
+    Retorna o estoque disponível (não reservado por carrinhos) de um produto.
+    """
+    estoque = db_produto_fetch(codigo).estoque
+    if db_carrinho_reservas_compartilhadas():
+        return estoque - db_carrinho_reservado(codigo)
+    return _RESERVAS.disponivel(codigo, estoque)
+
+
+def db_estoque_transacao() -> TransacaoReservas:
+    """
+    Inicia uma transação de reservas de estoque.
+    """
+    return TransacaoReservas(None if db_carrinho_reservas_compartilhadas() else _RESERVAS)
+
+
+def db_estoque_restaura(codigo: str, quantidade: int) -> None:
+    """
+    Reserva uma quantidade de um produto sem conferir o estoque, para recriar as
+    reservas de um carrinho recuperado ao iniciar o processo. Não faz nada caso as
+    reservas fiquem na persistência dos carrinhos.
+    """
+    if not db_carrinho_reservas_compartilhadas():
+        _RESERVAS.reserva(codigo, quantidade, None)
+
+
+def db_estoque_libera(codigo: str, quantidade: int) -> None:
+    """
+    Libera uma quantidade reservada de um produto (ex: carrinho expirado). Não faz nada
+    caso as reservas fiquem na persistência dos carrinhos, liberadas junto com o
+    carrinho.
+    """
+    if not db_carrinho_reservas_compartilhadas():
+        _RESERVAS.libera(codigo, quantidade)
@@ -1,8 +1,22 @@
 """
 Este módulo faz "mock" de um cadastro persistido de produtos.
+
+O cadastro é consultado por um backend (`ProdutosBackend`), escolhido pela variável de
+ambiente `PRODUTOS_BACKEND`:
+
+* `memoria` (padrão): alguns produtos de exemplo em um dicionário.
+* `sqlite`: um arquivo SQLite (`PRODUTOS_SQLITE`) indexado pelo código do produto,
+  gerado a partir de uma exportação CSV ou JSONL do cadastro por
+  `python -m api_carrinho.persist.produtos_sqlite`. O arquivo é somente lido, sem
+  carregar os produtos na memória do processo, com um cache LRU na frente
+  (`PRODUTOS_CACHE_MAXIMO`, `PRODUTOS_CACHE_TTL` e `PRODUTOS_CACHE_TTL_NEGATIVO`).
 """
 
-from dataclasses import dataclass
+import asyncio
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, replace
+from os import environ
+from typing import Dict, Iterable, Optional, Tuple
 
 
 class ProdutoNaoExisteError(Exception):
@@ -29,8 +43,8 @@ class ProdutoPersisted:
 
     codigo: str
     descricao: str
-    preco_de: float
-    preco_por: float
+    preco_de: int  # em centavos
+    preco_por: int  # em centavos
     estoque: int
 
 
@@ -39,32 +53,180 @@ _PRODUTOS = {
     "AB1234567": ProdutoPersisted(
         codigo="AB1234567",
         descricao="Camiseta Pólo",
-        preco_de=170.0,
-        preco_por=170.0,
+        preco_de=17000,
+        preco_por=17000,
         estoque=10,
     ),
     "CD7654321": ProdutoPersisted(
         codigo="CD7654321",
         descricao="Calça Jeans",
-        preco_de=280.0,
-        preco_por=250.0,
+        preco_de=28000,
+        preco_por=25000,
         estoque=5,
     ),
     "EF3567942": ProdutoPersisted(
         codigo="EF3567942",
         descricao="Sapato Social Masculino",
-        preco_de=500.0,
-        preco_por=450.0,
+        preco_de=50000,
+        preco_por=45000,
         estoque=1,
     ),
 }
 
 
+class ProdutosBackend(ABC):
+    """
+    Interface dos backends de consulta ao cadastro de produtos.
+    """
+
+    # Caso verdadeiro, as consultas fazem I/O bloqueante e são executadas em uma thread
+    # pelas funções assíncronas (`db_produto_*_async`), sem bloquear o event loop.
+    bloqueante: bool = False
+
+    @abstractmethod
+    def fetch(self, codigo: str) -> ProdutoPersisted:
+        """
+        Obtém um produto. Levanta ProdutoNaoExisteError caso não exista.
+        """
+
+    @abstractmethod
+    def fetch_many(self, codigos: Iterable[str]) -> Dict[str, ProdutoPersisted]:
+        """
+        Obtém vários produtos de uma vez, retornando um dicionário código => produto.
+        Códigos inexistentes ficam fora do dicionário.
+        """
+
+    @abstractmethod
+    def atualiza_precos(self, precos: Dict[str, Tuple[int, int]]) -> None:
+        """
+        Altera os preços de produtos no cadastro: código do produto => (preco_de,
+        preco_por), em centavos. Códigos inexistentes são ignorados.
+        """
+
+    def invalida(self, codigo: Optional[str] = None) -> None:
+        """
+        Descarta o que estiver em cache de um produto (ou de todos, com codigo=None),
+        após uma alteração de preço ou estoque no cadastro. Backends sem cache não fazem
+        nada.
+        """
+
+    def estatisticas(self) -> Dict[str, int]:
+        """
+        Retorna contadores do backend (ex: acertos e falhas do cache).
+        """
+        return {}
+
+
+class ProdutosMemoria(ProdutosBackend):
+    """
+    Cadastro de produtos em um dicionário na memória.
+    """
+
+    def __init__(self, produtos: Dict[str, ProdutoPersisted]) -> None:
+        self.produtos = produtos
+
+    def fetch(self, codigo: str) -> ProdutoPersisted:
+        try:
+            return self.produtos[codigo]
+        except KeyError:
+            raise ProdutoNaoExisteError("produto com código {} não existe".format(codigo))
+
+    def fetch_many(self, codigos: Iterable[str]) -> Dict[str, ProdutoPersisted]:
+        return {
+            codigo: self.produtos[codigo] for codigo in codigos if codigo in self.produtos
+        }
+
+    def atualiza_precos(self, precos: Dict[str, Tuple[int, int]]) -> None:
+        """
+        Substitui os produtos alterados por cópias com os novos preços, sem alterar os
+        objetos já obtidos por outras requisições.
+        """
+        for codigo, (preco_de, preco_por) in precos.items():
+            produto = self.produtos.get(codigo)
+            if produto is not None:
+                self.produtos[codigo] = replace(
+                    produto, preco_de=preco_de, preco_por=preco_por
+                )
+
+
+def _backend_padrao() -> ProdutosBackend:
+    """
+    Cria o backend do cadastro de produtos configurado pelas variáveis de ambiente.
+    """
+    backend = environ.get("PRODUTOS_BACKEND", "memoria")
+    if backend == "memoria":
+        return ProdutosMemoria(_PRODUTOS)
+    if backend == "sqlite":
+        from api_carrinho.persist.produtos_cache import ProdutosCache
+        from api_carrinho.persist.produtos_sqlite import ProdutosSQLite
+
+        sqlite = ProdutosSQLite(environ.get("PRODUTOS_SQLITE", "produtos.db"))
+        maximo = int(environ.get("PRODUTOS_CACHE_MAXIMO", 10000))
+        if maximo == 0:
+            return sqlite
+        return ProdutosCache(
+            sqlite,
+            maximo=maximo,
+            ttl=float(environ.get("PRODUTOS_CACHE_TTL", 60)),
+            ttl_negativo=float(environ.get("PRODUTOS_CACHE_TTL_NEGATIVO", 5)),
+        )
+    raise ValueError("backend de produtos desconhecido: {}".format(backend))
+
+
+_CADASTRO: ProdutosBackend = _backend_padrao()
+
+
+def db_produto_define_backend(backend: ProdutosBackend) -> None:
+    """
+    Substitui o backend do cadastro de produtos.
+    """
+    global _CADASTRO
+    _CADASTRO = backend
+
+
 def db_produto_fetch(codigo: str) -> ProdutoPersisted:
     """
     Obtém um produto da persistência.
     """
-    try:
-        return _PRODUTOS[codigo]
-    except KeyError:
-        raise ProdutoNaoExisteError("produto com código {} não existe".format(codigo))
+    return _CADASTRO.fetch(codigo)
+
+
+def db_produto_fetch_many(codigos: Iterable[str]) -> Dict[str, ProdutoPersisted]:
+    """
+    Obtém vários produtos da persistência de uma vez (código => produto), ignorando os
+    códigos inexistentes.
+    """
+    return _CADASTRO.fetch_many(codigos)
+
+
+def db_produto_atualiza_precos(precos: Dict[str, Tuple[int, int]]) -> None:
+    """
+    Altera os preços de produtos no cadastro (código => (preco_de, preco_por), em
+    centavos), descartando-os do cache deste processo. Nos demais processos, o cache
+    mantém o preço anterior por até `PRODUTOS_CACHE_TTL` segundos.
+    """
+    _CADASTRO.atualiza_precos(precos)
+
+
+def db_produto_invalida(codigo: Optional[str] = None) -> None:
+    """
+    Descarta o cache de um produto (ou de todos, com codigo=None). Deve ser chamada após
+    alterações de preço ou estoque no cadastro.
+    """
+    _CADASTRO.invalida(codigo)
+
+
+def db_produto_estatisticas() -> Dict[str, int]:
+    """
+    Retorna os contadores do cadastro de produtos (ex: acertos e falhas do cache).
+    """
+    return _CADASTRO.estatisticas()
+
+
+async def db_produto_fetch_async(codigo: str) -> ProdutoPersisted:
+    """
+    Versão assíncrona de db_produto_fetch().
+    """
+    if _CADASTRO.bloqueante:
+        return await asyncio.to_thread(_CADASTRO.fetch, codigo)
+    return _CADASTRO.fetch(codigo)
@@ -0,0 +1,205 @@
+"""
+Este módulo implementa um cache de leitura na frente de um cadastro de produtos, para
+evitar uma consulta ao armazenamento a cada produto adicionado ou alterado no carrinho.
+"""
+
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from api_carrinho.persist.produtos import (
+    ProdutoNaoExisteError,
+    ProdutoPersisted,
+    ProdutosBackend,
+)
+
+
+class _Carga:
+    """
+    Consulta em andamento de um produto, aguardada pelas demais threads que pedirem o
+    mesmo código enquanto ela não termina.
+    """
+
+    def __init__(self) -> None:
+        self.pronta = threading.Event()
+        self.produto: Optional[ProdutoPersisted] = None
+        self.erro: Optional[BaseException] = None
+        self.invalidada = False
+
+
+class ProdutosCache(ProdutosBackend):
+    """
+    Cache LRU com expiração por tempo (TTL) na frente de outro cadastro de produtos.
+
+    Produtos inexistentes também são armazenados (cache negativo), com um TTL próprio,
+    normalmente menor. Somente uma consulta por código é feita ao cadastro de cada vez:
+    as demais threads aguardam o seu resultado.
+
+    Alterações de preço ou estoque no cadastro devem ser seguidas de `invalida()`; caso
+    contrário, ficam visíveis somente após o TTL.
+    """
+
+    maximo: int  # número máximo de produtos no cache
+    ttl: float  # segundos que um produto fica no cache
+    ttl_negativo: float  # segundos que um produto inexistente fica no cache
+    acertos: int  # consultas respondidas pelo cache
+    falhas: int  # consultas feitas ao cadastro
+    descartados: int  # produtos removidos por tamanho máximo
+
+    def __init__(
+        self,
+        origem: ProdutosBackend,
+        maximo: int = 10000,
+        ttl: float = 60.0,
+        ttl_negativo: float = 5.0,
+    ) -> None:
+        self.origem = origem
+        self.maximo = maximo
+        self.ttl = ttl
+        self.ttl_negativo = ttl_negativo
+        self.acertos = 0
+        self.falhas = 0
+        self.descartados = 0
+        self._lock = threading.Lock()
+        # código => (instante de expiração, produto ou None caso não exista)
+        self._entradas: "OrderedDict[str, Tuple[float, Optional[ProdutoPersisted]]]" = (
+            OrderedDict()
+        )
+        self._cargas: Dict[str, _Carga] = {}
+        # Incrementada a cada invalidação, para descartar consultas em lote feitas antes.
+        self._geracao = 0
+
+    @property
+    def bloqueante(self) -> bool:  # type: ignore[override]
+        return self.origem.bloqueante
+
+    def __len__(self) -> int:
+        return len(self._entradas)
+
+    @staticmethod
+    def _produto(codigo: str, produto: Optional[ProdutoPersisted]) -> ProdutoPersisted:
+        if produto is None:
+            raise ProdutoNaoExisteError("produto com código {} não existe".format(codigo))
+        return produto
+
+    def _obtem(
+        self, codigo: str, agora: float
+    ) -> Tuple[bool, Optional[ProdutoPersisted]]:
+        """
+        Procura um código no cache, retornando se foi encontrado e o produto. Deve ser
+        chamada com a trava.
+        """
+        entrada = self._entradas.get(codigo)
+        if entrada is None:
+            return False, None
+        if entrada[0] <= agora:
+            del self._entradas[codigo]
+            return False, None
+        self._entradas.move_to_end(codigo)
+        self.acertos += 1
+        return True, entrada[1]
+
+    def _grava(self, codigo: str, produto: Optional[ProdutoPersisted]) -> None:
+        """
+        Armazena o resultado da consulta de um código. Deve ser chamada com a trava.
+        """
+        ttl = self.ttl if produto is not None else self.ttl_negativo
+        self._entradas[codigo] = (monotonic() + ttl, produto)
+        self._entradas.move_to_end(codigo)
+        while len(self._entradas) > self.maximo:
+            self._entradas.popitem(last=False)
+            self.descartados += 1
+
+    def fetch(self, codigo: str) -> ProdutoPersisted:
+        with self._lock:
+            encontrado, produto = self._obtem(codigo, monotonic())
+            if encontrado:
+                return self._produto(codigo, produto)
+            carga = self._cargas.get(codigo)
+            responsavel = carga is None
+            if responsavel:
+                carga = self._cargas[codigo] = _Carga()
+                self.falhas += 1
+        if not responsavel:
+            carga.pronta.wait()
+            if carga.erro is not None:
+                raise carga.erro
+            return self._produto(codigo, carga.produto)
+        try:
+            carga.produto = self.origem.fetch(codigo)
+        except ProdutoNaoExisteError:
+            pass
+        except BaseException as ex:
+            carga.erro = ex
+            raise
+        finally:
+            with self._lock:
+                del self._cargas[codigo]
+                if carga.erro is None and not carga.invalidada:
+                    self._grava(codigo, carga.produto)
+            carga.pronta.set()
+        return self._produto(codigo, carga.produto)
+
+    def fetch_many(self, codigos: Iterable[str]) -> Dict[str, ProdutoPersisted]:
+        produtos: Dict[str, ProdutoPersisted] = {}
+        faltantes: List[str] = []
+        with self._lock:
+            agora = monotonic()
+            for codigo in codigos:
+                encontrado, produto = self._obtem(codigo, agora)
+                if not encontrado:
+                    faltantes.append(codigo)
+                elif produto is not None:
+                    produtos[codigo] = produto
+            self.falhas += len(faltantes)
+            geracao = self._geracao
+        if faltantes:
+            # Os faltantes são consultados em lote, sem aguardar as cargas individuais
+            # em andamento.
+            obtidos = self.origem.fetch_many(faltantes)
+            with self._lock:
+                if geracao == self._geracao:
+                    for codigo in faltantes:
+                        if codigo not in self._cargas:
+                            self._grava(codigo, obtidos.get(codigo))
+            produtos.update(obtidos)
+        return produtos
+
+    def atualiza_precos(self, precos: Dict[str, Tuple[int, int]]) -> None:
+        """
+        Altera os preços no cadastro de origem e descarta os produtos alterados do cache.
+        Os caches de outros processos só veem os novos preços após o TTL.
+        """
+        self.origem.atualiza_precos(precos)
+        for codigo in precos:
+            self.invalida(codigo)
+
+    def invalida(self, codigo: Optional[str] = None) -> None:
+        """
+        Remove um produto do cache (ou todos, com codigo=None), inclusive descartando o
+        resultado de uma consulta em andamento, que pode estar desatualizado.
+        """
+        with self._lock:
+            self._geracao += 1
+            if codigo is None:
+                self._entradas.clear()
+                cargas = list(self._cargas.values())
+            else:
+                self._entradas.pop(codigo, None)
+                cargas = [self._cargas[codigo]] if codigo in self._cargas else []
+            for carga in cargas:
+                carga.invalidada = True
+
+    def estatisticas(self) -> Dict[str, int]:
+        """
+        Retorna os contadores do cache: produtos armazenados, acertos, falhas e
+        descartados por tamanho máximo.
+        """
+        with self._lock:
+            return {
+                "produtos": len(self._entradas),
+                "acertos": self.acertos,
+                "falhas": self.falhas,
+                "descartados": self.descartados,
+            }
@@ -0,0 +1,241 @@
+"""
+Este módulo implementa o cadastro de produtos em um arquivo SQLite indexado pelo código
+do produto, consultado somente para leitura (exceto a atualização de preços), e a sua
+importação a partir de uma exportação do cadastro em CSV ou JSONL:
+
+    python -m api_carrinho.persist.produtos_sqlite produtos.csv [--banco produtos.db]
+
+A importação lê o arquivo em fluxo, gravando em lotes em um banco temporário que só
+substitui o banco final ao terminar, de forma que os workers em execução nunca veem um
+cadastro incompleto.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from itertools import islice
+from os import getpid
+from typing import IO, Dict, Iterable, Iterator, List, Tuple
+
+from api_carrinho.models.dinheiro import centavos, centavos_persistidos
+from api_carrinho.persist.produtos import (
+    ProdutoNaoExisteError,
+    ProdutoPersisted,
+    ProdutosBackend,
+)
+
+_ESQUEMA = """
+CREATE TABLE produtos (
+    codigo TEXT PRIMARY KEY,
+    descricao TEXT NOT NULL,
+    preco_de INTEGER NOT NULL,
+    preco_por INTEGER NOT NULL,
+    estoque INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+_CAMPOS = "codigo, descricao, preco_de, preco_por, estoque"
+
+# Quantidade máxima de códigos por consulta em fetch_many (parâmetros do SQLite).
+_LOTE_CONSULTA = 500
+
+# Quantidade de produtos gravados por lote na importação.
+_LOTE_IMPORTACAO = 10_000
+
+# Linha da tabela de produtos: (codigo, descricao, preco_de, preco_por, estoque), com os
+# preços em centavos.
+Linha = Tuple[str, str, int, int, int]
+
+
+def _produto(linha: Tuple) -> ProdutoPersisted:
+    """
+    Converte uma linha da tabela para o produto. Os cadastros importados antes dos preços
+    em centavos têm os preços em reais.
+    """
+    codigo, descricao, preco_de, preco_por, estoque = linha
+    return ProdutoPersisted(
+        codigo,
+        descricao,
+        centavos_persistidos(preco_de),
+        centavos_persistidos(preco_por),
+        estoque,
+    )
+
+
+class ProdutosSQLite(ProdutosBackend):
+    """
+    Consulta o cadastro de produtos em um arquivo SQLite gerado por `importa()`.
+
+    Cada thread de cada processo usa sua própria conexão, somente leitura e com o arquivo
+    mapeado em memória: abrir o cadastro não carrega nenhum produto, e as páginas do
+    arquivo são compartilhadas entre os workers pelo cache do sistema operacional. A
+    atualização de preços, rara, abre uma conexão de escrita própria.
+    """
+
+    bloqueante = True
+
+    caminho: str  # caminho do arquivo do banco de dados
+    mmap: int  # bytes do arquivo mapeados em memória por conexão
+
+    def __init__(self, caminho: str, mmap: int = 256 * 1024 * 1024) -> None:
+        self.caminho = caminho
+        self.mmap = mmap
+        self._local = threading.local()
+        # Falha já na criação caso o arquivo não exista ou não seja um cadastro.
+        self._conexao().execute("SELECT 1 FROM produtos LIMIT 1")
+
+    def _conexao(self) -> sqlite3.Connection:
+        """
+        Retorna a conexão da thread atual, abrindo uma nova caso necessário (inclusive
+        após um fork, já que conexões SQLite não podem ser herdadas).
+        """
+        conexao = getattr(self._local, "conexao", None)
+        if conexao is None or self._local.pid != getpid():
+            conexao = sqlite3.connect(
+                "file:{}?mode=ro".format(self.caminho),
+                uri=True,
+            )
+            conexao.execute("PRAGMA mmap_size={:d}".format(self.mmap))
+            self._local.conexao = conexao
+            self._local.pid = getpid()
+        return conexao
+
+    def fetch(self, codigo: str) -> ProdutoPersisted:
+        linha = (
+            self._conexao()
+            .execute(
+                "SELECT {} FROM produtos WHERE codigo = ?".format(_CAMPOS), (codigo,)
+            )
+            .fetchone()
+        )
+        if linha is None:
+            raise ProdutoNaoExisteError("produto com código {} não existe".format(codigo))
+        return _produto(linha)
+
+    def fetch_many(self, codigos: Iterable[str]) -> Dict[str, ProdutoPersisted]:
+        conexao = self._conexao()
+        produtos = {}
+        codigos = iter(set(codigos))
+        while True:
+            lote = list(islice(codigos, _LOTE_CONSULTA))
+            if not lote:
+                break
+            cursor = conexao.execute(
+                "SELECT {} FROM produtos WHERE codigo IN ({})".format(
+                    _CAMPOS, ",".join("?" * len(lote))
+                ),
+                lote,
+            )
+            for linha in cursor:
+                produtos[linha[0]] = _produto(linha)
+        return produtos
+
+    def atualiza_precos(self, precos: Dict[str, Tuple[int, int]]) -> None:
+        with closing(sqlite3.connect(self.caminho, timeout=30.0)) as conexao:
+            with conexao:
+                conexao.executemany(
+                    "UPDATE produtos SET preco_de = ?, preco_por = ? WHERE codigo = ?",
+                    (
+                        (preco_de, preco_por, codigo)
+                        for codigo, (preco_de, preco_por) in precos.items()
+                    ),
+                )
+
+
+def _linha(registro: Dict) -> Linha:
+    """
+    Converte um registro da exportação do cadastro (preços em reais) para uma linha da
+    tabela.
+    """
+    return (
+        str(registro["codigo"]),
+        str(registro["descricao"]),
+        centavos(registro["preco_de"]),
+        centavos(registro["preco_por"]),
+        int(registro["estoque"]),
+    )
+
+
+def le_csv(arquivo: IO[str]) -> Iterator[Linha]:
+    """
+    Lê uma exportação do cadastro em CSV, com cabeçalho contendo as colunas codigo,
+    descricao, preco_de, preco_por e estoque.
+    """
+    for registro in csv.DictReader(arquivo):
+        yield _linha(registro)
+
+
+def le_jsonl(arquivo: IO[str]) -> Iterator[Linha]:
+    """
+    Lê uma exportação do cadastro em JSONL: um objeto por linha, com as chaves codigo,
+    descricao, preco_de, preco_por e estoque.
+    """
+    for texto in arquivo:
+        if texto.strip():
+            yield _linha(json.loads(texto))
+
+
+def importa(caminho: str, linhas: Iterable[Linha]) -> int:
+    """
+    Grava os produtos em um novo banco SQLite, substituindo atomicamente o arquivo em
+    `caminho` ao final. Retorna a quantidade de produtos importados. Códigos repetidos
+    mantêm o último registro.
+    """
+    temporario = "{}.{}.tmp".format(caminho, getpid())
+    if os.path.exists(temporario):
+        os.remove(temporario)
+    conexao = sqlite3.connect(temporario, isolation_level=None)
+    try:
+        # Sem journal nem fsync durante a carga: em caso de falha, o arquivo temporário
+        # é simplesmente descartado.
+        conexao.execute("PRAGMA journal_mode=OFF")
+        conexao.execute("PRAGMA synchronous=OFF")
+        conexao.executescript(_ESQUEMA)
+        conexao.execute("BEGIN")
+        total = 0
+        linhas = iter(linhas)
+        while True:
+            lote: List[Linha] = list(islice(linhas, _LOTE_IMPORTACAO))
+            if not lote:
+                break
+            conexao.executemany(
+                "INSERT OR REPLACE INTO produtos ({}) VALUES (?, ?, ?, ?, ?)".format(
+                    _CAMPOS
+                ),
+                lote,
+            )
+            total += len(lote)
+        conexao.execute("COMMIT")
+    except BaseException:
+        conexao.close()
+        os.remove(temporario)
+        raise
+    conexao.close()
+    os.replace(temporario, caminho)
+    return total
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Importa uma exportação do cadastro de produtos (CSV ou JSONL)."
+    )
+    parser.add_argument("arquivo", help="arquivo .csv ou .jsonl")
+    parser.add_argument(
+        "--banco", default=os.environ.get("PRODUTOS_SQLITE", "produtos.db")
+    )
+    parser.add_argument("--formato", choices=("csv", "jsonl"))
+    args = parser.parse_args()
+
+    formato = args.formato or ("csv" if args.arquivo.endswith(".csv") else "jsonl")
+    with open(args.arquivo, encoding="utf-8", newline="") as arquivo:
+        le = le_csv if formato == "csv" else le_jsonl
+        total = importa(args.banco, le(arquivo))
+    print("{} produtos importados em {}".format(total, args.banco))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Este módulo implementa a reprecificação em lote dos carrinhos de compras, quando os
+preços do cadastro de produtos mudam (ex: uma campanha que altera milhares de produtos).
+
+Os produtos guardam os preços do momento em que foram adicionados ao carrinho. A partir
+de um lote de novos preços, somente os carrinhos com algum dos produtos são consultados,
+pelo índice de produtos da persistência, e cada um é alterado e gravado uma única vez.
+"""
+
+from typing import Any, Dict, Tuple
+
+from api_carrinho.models.dinheiro import centavos
+from api_carrinho.persist.carrinhos import (
+    CarrinhoNaoExisteError,
+    CarrinhoVersaoConflitoError,
+    db_carrinho_fetch,
+    db_carrinho_save,
+)
+
+# Novos preços: código do produto => (preco_de, preco_por), em centavos.
+Precos = Dict[str, Tuple[int, int]]
+
+
+class PrecosInvalidosError(Exception):
+    """
+    Lote de preços da reprecificação inválido.
+    """
+
+    ...
+
+
+def _preco(item: Dict, campo: str) -> int:
+    valor = item.get(campo)
+    if isinstance(valor, bool) or not isinstance(valor, (int, float)) or not valor >= 0:
+        raise PrecosInvalidosError("{} deve ser um número não negativo".format(campo))
+    try:
+        return centavos(valor)
+    except ValueError:
+        raise PrecosInvalidosError("{} deve ser um número não negativo".format(campo))
+
+
+def atualizacoes(corpo: Any) -> Precos:
+    """
+    Cria o lote de novos preços a partir de uma lista JSON de objetos com os campos
+    `codigo`, `preco_de` e `preco_por` (em reais). Um produto repetido fica com o último
+    preço.
+
+    Levanta PrecosInvalidosError caso algum item seja inválido.
+    """
+    if not isinstance(corpo, list):
+        raise PrecosInvalidosError("esperada uma lista de preços")
+    precos: Precos = {}
+    for item in corpo:
+        if not isinstance(item, dict) or not isinstance(item.get("codigo"), str):
+            raise PrecosInvalidosError("cada preço deve ser um objeto com o codigo")
+        precos[item["codigo"]] = (_preco(item, "preco_de"), _preco(item, "preco_por"))
+    return precos
+
+
+def reprecifica(codigo: str, precos: Precos) -> bool:
+    """
+    Reprecifica e grava um carrinho, retornando se algum preço mudou. Deve ser chamada
+    com a trava do carrinho. Caso outro processo grave o carrinho no meio, ele é obtido
+    novamente; um carrinho removido é ignorado.
+    """
+    while True:
+        try:
+            carrinho = db_carrinho_fetch(codigo)
+        except CarrinhoNaoExisteError:
+            return False
+        versao_anterior = carrinho.versao
+        if not carrinho.reprecifica(precos):
+            return False
+        try:
+            db_carrinho_save(carrinho, versao_anterior=versao_anterior)
+        except CarrinhoNaoExisteError:
+            return False
+        except CarrinhoVersaoConflitoError:
+            continue
+        return True
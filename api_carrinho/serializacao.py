@@ -0,0 +1,55 @@
+"""
+Este módulo implementa a serialização em JSON das requisições e respostas da API, usando o
+orjson caso esteja instalado e o módulo json da biblioteca padrão caso contrário.
+
+Nos dois casos, o formato é o mesmo: chaves ordenadas, sem espaços, em UTF-8 e com uma
+quebra de linha no final.
+"""
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+
+_CODIFICADOR_COMPACTO = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+def _codifica_json(dados: Any) -> bytes:
+    return (
+        json.dumps(dados, separators=(",", ":"), sort_keys=True, ensure_ascii=False)
+        + "\n"
+    ).encode("utf-8")
+
+
+def codifica(dados: Any) -> bytes:
+    """
+    Serializa dados compatíveis com JSON.
+    """
+    if orjson is not None:
+        return orjson.dumps(
+            dados, option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE
+        )
+    return _codifica_json(dados)
+
+
+def codifica_compacto(dados: Any) -> bytes:
+    """
+    Serializa dados compatíveis com JSON sem ordenar as chaves e sem a quebra de linha,
+    para serem persistidos (ex: `Carrinho.serializa()`).
+    """
+    if orjson is not None:
+        return orjson.dumps(dados)
+    return _CODIFICADOR_COMPACTO.encode(dados).encode("utf-8")
+
+
+def decodifica(corpo: bytes) -> Any:
+    """
+    Decodifica um corpo em JSON, levantando ValueError caso seja inválido.
+    """
+    if orjson is not None:
+        return orjson.loads(corpo)
+    return json.loads(corpo)
@@ -0,0 +1,38 @@
+"""
+Este módulo implementa uma tabela de travas (locks) "listradas": um número fixo de
+travas, escolhidas pelo hash da chave. Chaves diferentes raramente compartilham uma
+trava, sem a necessidade de criar e remover uma trava por chave.
+"""
+
+import threading
+from typing import List
+
+
+class TabelaTravas:
+    """
+    Tabela com um número fixo de travas, selecionadas pelo hash da chave.
+    """
+
+    _travas: List[threading.Lock]
+
+    def __init__(self, quantidade: int = 1024) -> None:
+        self._travas = [threading.Lock() for _ in range(quantidade)]
+
+    def __len__(self) -> int:
+        return len(self._travas)
+
+    def trava(self, chave: str) -> threading.Lock:
+        """
+        Retorna a trava correspondente a uma chave. A mesma chave sempre retorna a mesma
+        trava neste processo.
+        """
+        return self._travas[hash(chave) % len(self._travas)]
+
+    def travas(self, *chaves: str) -> List[threading.Lock]:
+        """
+        Retorna as travas correspondentes a várias chaves, sem repetições e na ordem da
+        tabela. Adquiridas nesta ordem, não há deadlock entre quem trava as mesmas
+        chaves em ordens diferentes, nem com chaves que compartilham uma trava.
+        """
+        indices = sorted({hash(chave) % len(self._travas) for chave in chaves})
+        return [self._travas[indice] for indice in indices]
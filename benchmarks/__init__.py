@@ -0,0 +1,43 @@
+"""
+Benchmarks do projeto. Cada módulo pode ser executado com `python -m benchmarks.<nome>`
+e imprime um relatório em JSON na saída padrão, para que execuções possam ser
+comparadas.
+"""
+
+import json
+import platform
+import sys
+from datetime import datetime
+from typing import Dict, List
+
+
+def percentis(amostras: List[float]) -> Dict[str, float]:
+    """
+    Retorna os percentis 50, 95 e 99 de uma lista de amostras (ex: latências).
+    """
+    if not amostras:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    ordenadas = sorted(amostras)
+
+    def percentil(p: float) -> float:
+        return ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * p))]
+
+    return {"p50": percentil(0.50), "p95": percentil(0.95), "p99": percentil(0.99)}
+
+
+def relatorio(nome: str, resultados: Dict) -> None:
+    """
+    Imprime o relatório de um benchmark em JSON na saída padrão.
+    """
+    json.dump(
+        {
+            "benchmark": nome,
+            "data": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "resultados": resultados,
+        },
+        sys.stdout,
+        indent=2,
+        ensure_ascii=False,
+    )
+    sys.stdout.write("\n")
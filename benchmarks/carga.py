@@ -0,0 +1,233 @@
+"""
+Teste de carga da API: vários usuários virtuais concorrentes executando um perfil de
+requisições (criação de carrinho, adição de produto, alteração de quantidade, cupom e
+leitura do carrinho).
+
+O perfil é gerado a partir de uma semente e pode ser gravado em um arquivo e repetido
+depois, para comparar execuções com exatamente as mesmas requisições. Por padrão, as
+requisições são feitas pelo cliente de testes do Flask, no mesmo processo; com `--url`,
+são feitas via HTTP em um servidor já em execução.
+
+    python -m benchmarks.carga [--usuarios N] [--requisicoes N] [--semente N]
+                               [--grava-perfil ARQUIVO | --perfil ARQUIVO] [--url URL]
+"""
+
+import argparse
+import json
+import random
+import threading
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+from benchmarks import percentis, relatorio
+
+# Pesos de cada operação no perfil de carga.
+PESOS = {
+    "produto-adiciona": 4,
+    "produto-define-quantidade": 3,
+    "cupom-define": 1,
+    "carrinho": 10,
+}
+
+# Produtos e cupons do cadastro de exemplo, usados com um servidor externo (--url).
+PRODUTOS_CADASTRO = ["AB1234567", "CD7654321", "EF3567942"]
+CUPONS = ["VALE10", "BLACKFRIDAY15"]
+
+Perfil = List[List[Dict]]  # uma lista de operações por usuário virtual
+
+
+def gera_perfil(
+    semente: int, usuarios: int, requisicoes: int, produtos: List[str]
+) -> Perfil:
+    """
+    Gera um perfil de carga determinístico: cada usuário cria um carrinho e executa
+    `requisicoes` operações sorteadas conforme os pesos.
+    """
+    aleatorio = random.Random(semente)
+    operacoes, pesos = zip(*PESOS.items())
+    perfil = []
+    for _ in range(usuarios):
+        adicionados: List[str] = []
+        roteiro = [{"operacao": "novo"}]
+        for _ in range(requisicoes - 1):
+            operacao = aleatorio.choices(operacoes, pesos)[0]
+            if operacao == "produto-define-quantidade" and not adicionados:
+                operacao = "produto-adiciona"
+            if operacao == "produto-adiciona":
+                produto = aleatorio.choice(produtos)
+                adicionados.append(produto)
+                roteiro.append({"operacao": operacao, "produto": produto})
+            elif operacao == "produto-define-quantidade":
+                roteiro.append(
+                    {
+                        "operacao": operacao,
+                        "produto": aleatorio.choice(adicionados),
+                        "quantidade": aleatorio.randint(1, 5),
+                    }
+                )
+            elif operacao == "cupom-define":
+                roteiro.append({"operacao": operacao, "cupom": aleatorio.choice(CUPONS)})
+            else:
+                roteiro.append({"operacao": operacao})
+        perfil.append(roteiro)
+    return perfil
+
+
+class _ClienteFlask:
+    """
+    Faz as requisições pelo cliente de testes do Flask, no mesmo processo.
+    """
+
+    def __init__(self) -> None:
+        from api_carrinho.app import app
+
+        self._cliente = app.test_client()
+
+    def post(self, uri: str, dados: Dict) -> Dict:
+        return self._cliente.post(uri, data=dados).get_json()
+
+    def get(self, uri: str) -> Dict:
+        return self._cliente.get(uri).get_json()
+
+
+class _ClienteHTTP:
+    """
+    Faz as requisições via HTTP em um servidor já em execução.
+    """
+
+    def __init__(self, url: str) -> None:
+        import requests
+
+        self._url = url.rstrip("/")
+        self._sessao = requests.Session()
+
+    def post(self, uri: str, dados: Dict) -> Dict:
+        return self._sessao.post(self._url + uri, data=dados, timeout=30).json()
+
+    def get(self, uri: str) -> Dict:
+        return self._sessao.get(self._url + uri, timeout=30).json()
+
+
+def _executa_roteiro(cliente, roteiro: List[Dict]) -> List[Tuple[str, float, bool]]:
+    """
+    Executa as operações de um usuário, retornando (operação, segundos, sucesso) de cada.
+    """
+    medicoes = []
+    carrinho = None
+    for passo in roteiro:
+        operacao = passo["operacao"]
+        inicio = perf_counter()
+        if operacao == "novo":
+            resposta = cliente.post("/novo", {})
+            if resposta["sucesso"]:
+                carrinho = resposta["dados"]["carrinho_codigo"]
+        elif operacao == "carrinho":
+            resposta = cliente.get("/carrinho/{}".format(carrinho))
+        else:
+            dados = {k: v for k, v in passo.items() if k != "operacao"}
+            dados["carrinho"] = carrinho
+            resposta = cliente.post("/{}".format(operacao), dados)
+        medicoes.append((operacao, perf_counter() - inicio, resposta["sucesso"]))
+    return medicoes
+
+
+def executa(perfil: Perfil, fabrica_cliente) -> Dict:
+    """
+    Executa o perfil com uma thread por usuário virtual, retornando o relatório.
+    """
+    medicoes: List[Tuple[str, float, bool]] = []
+    lock = threading.Lock()
+    barreira = threading.Barrier(len(perfil) + 1)
+
+    def usuario(roteiro: List[Dict]) -> None:
+        cliente = fabrica_cliente()
+        barreira.wait()
+        resultado = _executa_roteiro(cliente, roteiro)
+        with lock:
+            medicoes.extend(resultado)
+
+    threads = [threading.Thread(target=usuario, args=(r,)) for r in perfil]
+    for thread in threads:
+        thread.start()
+    barreira.wait()
+    inicio = perf_counter()
+    for thread in threads:
+        thread.join()
+    duracao = perf_counter() - inicio
+
+    por_operacao: Dict[str, Dict] = {}
+    for operacao in sorted({m[0] for m in medicoes}):
+        amostras = [m for m in medicoes if m[0] == operacao]
+        latencias = percentis([m[1] * 1000 for m in amostras])
+        por_operacao[operacao] = {
+            "requisicoes": len(amostras),
+            "erros": sum(1 for m in amostras if not m[2]),
+            **{chave: round(valor, 3) for chave, valor in latencias.items()},
+        }
+    latencias = percentis([m[1] * 1000 for m in medicoes])
+    return {
+        "usuarios": len(perfil),
+        "requisicoes": len(medicoes),
+        "erros": sum(1 for m in medicoes if not m[2]),
+        "segundos": round(duracao, 4),
+        "requisicoes_por_segundo": round(len(medicoes) / duracao, 1),
+        "latencia_ms": {chave: round(valor, 3) for chave, valor in latencias.items()},
+        "operacoes": por_operacao,
+    }
+
+
+def _cadastra_produtos(quantidade: int) -> List[str]:
+    """
+    Cadastra produtos com estoque grande para a carga no mesmo processo, de forma que as
+    reservas de estoque não limitem o teste.
+    """
+    from api_carrinho.persist.produtos import _PRODUTOS, ProdutoPersisted
+
+    codigos = []
+    for i in range(quantidade):
+        codigo = "CARGA{:05d}".format(i)
+        _PRODUTOS[codigo] = ProdutoPersisted(
+            codigo=codigo,
+            descricao="Produto de carga {}".format(i),
+            preco_de=9990,
+            preco_por=8990,
+            estoque=10**9,
+        )
+        codigos.append(codigo)
+    return codigos
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--usuarios", type=int, default=16)
+    parser.add_argument("--requisicoes", type=int, default=200)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--produtos", type=int, default=500)
+    parser.add_argument("--perfil", help="repete o perfil gravado neste arquivo")
+    parser.add_argument("--grava-perfil", help="grava o perfil gerado neste arquivo")
+    parser.add_argument("--url", help="servidor da API (padrão: cliente do Flask)")
+    args = parser.parse_args()
+
+    if args.url:
+        produtos = PRODUTOS_CADASTRO
+        fabrica_cliente = lambda: _ClienteHTTP(args.url)  # noqa: E731
+    else:
+        produtos = _cadastra_produtos(args.produtos)
+        fabrica_cliente = _ClienteFlask
+    if args.perfil:
+        with open(args.perfil) as arquivo:
+            perfil = json.load(arquivo)
+    else:
+        perfil = gera_perfil(args.semente, args.usuarios, args.requisicoes, produtos)
+    if args.grava_perfil:
+        with open(args.grava_perfil, "w") as arquivo:
+            json.dump(perfil, arquivo)
+
+    resultado = executa(perfil, fabrica_cliente)
+    resultado["semente"] = None if args.perfil else args.semente
+    resultado["alvo"] = args.url or "flask-test-client"
+    relatorio("carga", resultado)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Micro-benchmarks das alterações e totalizadores do `Carrinho`, com carrinhos de 1, 100 e
+1000 produtos.
+
+    python -m benchmarks.carrinho [--repeticoes N]
+"""
+
+import argparse
+from time import perf_counter_ns
+from typing import Callable, Dict, List
+
+from api_carrinho.models.carrinho import Carrinho
+from api_carrinho.models.cupom import Cupom
+from api_carrinho.models.produto import Produto
+from benchmarks import percentis, relatorio
+
+TAMANHOS = (1, 100, 1000)
+
+
+def _produto(i: int) -> Produto:
+    return Produto(
+        codigo="P{:07d}".format(i),
+        descricao="Produto {}".format(i),
+        preco_de=1990,
+        preco_por=990,
+        quantidade=1,
+    )
+
+
+def _carrinho(linhas: int) -> Carrinho:
+    carrinho = Carrinho(cliente=None)
+    for i in range(linhas):
+        carrinho.adiciona_produto(_produto(i))
+    return carrinho
+
+
+def _mede(operacao: Callable[[int], None], repeticoes: int) -> Dict[str, float]:
+    """
+    Executa a operação repetidas vezes, retornando os percentis do tempo de cada
+    execução, em microssegundos.
+    """
+    amostras: List[float] = []
+    for i in range(repeticoes):
+        inicio = perf_counter_ns()
+        operacao(i)
+        amostras.append((perf_counter_ns() - inicio) / 1000)
+    resultado = percentis(amostras)
+    resultado["media"] = sum(amostras) / len(amostras)
+    return {chave: round(valor, 3) for chave, valor in resultado.items()}
+
+
+def _benchmarks(linhas: int, repeticoes: int) -> Dict[str, Dict[str, float]]:
+    carrinho = _carrinho(linhas)
+    codigos = list(carrinho.produtos)
+    cupom = Cupom(codigo="VALE10", valor=1000)
+    resultados = {}
+
+    resultados["define_produto_quantidade"] = _mede(
+        lambda i: carrinho.define_produto_quantidade(
+            codigos[i % len(codigos)], i % 10 + 1
+        ),
+        repeticoes,
+    )
+    resultados["adiciona_produto_existente"] = _mede(
+        lambda i: carrinho.adiciona_produto(carrinho.produtos[codigos[i % len(codigos)]]),
+        repeticoes,
+    )
+    resultados["define_cupom_desconto"] = _mede(
+        lambda i: carrinho.define_cupom_desconto(cupom if i % 2 else None), repeticoes
+    )
+
+    def remove_e_adiciona(i: int) -> None:
+        codigo = codigos[i % len(codigos)]
+        produto = carrinho.produtos[codigo]
+        carrinho.remove_produto(codigo)
+        carrinho.adiciona_produto(produto)
+
+    resultados["remove_e_adiciona_produto"] = _mede(remove_e_adiciona, repeticoes)
+    resultados["recalcula_subtotal"] = _mede(
+        lambda i: carrinho.recalcula_subtotal(), repeticoes
+    )
+    resultados["serializa"] = _mede(lambda i: carrinho.serializa(), repeticoes)
+    dados = carrinho.serializa()
+    resultados["desserializa"] = _mede(lambda i: Carrinho.desserializa(dados), repeticoes)
+    return resultados
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeticoes", type=int, default=2000)
+    args = parser.parse_args()
+    relatorio(
+        "carrinho",
+        {
+            "unidade": "microssegundos por operação",
+            "repeticoes": args.repeticoes,
+            "linhas": {
+                str(linhas): _benchmarks(linhas, args.repeticoes) for linhas in TAMANHOS
+            },
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
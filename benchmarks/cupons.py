@@ -0,0 +1,148 @@
+"""
+Benchmark das regras de cupons: compilação do cadastro e busca dos cupons aplicáveis a
+carrinhos de 200 produtos, com o cadastro indexado (`CadastroCupons.aplicaveis`) e com
+uma avaliação ingênua, que percorre os produtos do carrinho para cada regra. Mede também
+os totalizadores do carrinho com um cupom restrito a produtos.
+
+    python -m benchmarks.cupons [--regras N] [--linhas N] [--repeticoes N]
+"""
+
+import argparse
+import random
+from time import perf_counter, perf_counter_ns, time
+from typing import Callable, Dict, List, Tuple
+
+from api_carrinho.models.carrinho import Carrinho
+from api_carrinho.models.cupom import Cupom
+from api_carrinho.models.produto import Produto
+from api_carrinho.persist.cupons import CadastroCupons, CupomPersisted
+from benchmarks import percentis, relatorio
+
+# Produtos distintos do catálogo, dos quais saem os carrinhos e os produtos das regras.
+CATALOGO = 50_000
+
+
+def _codigo(i: int) -> str:
+    return "P{:07d}".format(i)
+
+
+def _regras(quantidade: int, aleatorio: random.Random) -> List[CupomPersisted]:
+    """
+    Gera as regras: 20% valem para todos os produtos (metade com subtotal mínimo) e as
+    demais são restritas a 1 a 5 produtos, em valor ou percentual.
+    """
+    regras = []
+    for i in range(quantidade):
+        regra = CupomPersisted(codigo="C{:06d}".format(i))
+        if i % 2:
+            regra.percentual = float(aleatorio.randint(1, 30))
+        else:
+            regra.valor = aleatorio.randint(1, 50) * 100
+        if i % 5 == 0:
+            if i % 10 == 0:
+                regra.subtotal_minimo = aleatorio.randint(100, 5000) * 100
+        else:
+            regra.produtos = [
+                _codigo(aleatorio.randrange(CATALOGO))
+                for _ in range(aleatorio.randint(1, 5))
+            ]
+        regras.append(regra)
+    return regras
+
+
+def _carrinho(linhas: int, aleatorio: random.Random) -> Carrinho:
+    carrinho = Carrinho(cliente=None)
+    for i in aleatorio.sample(range(CATALOGO), linhas):
+        carrinho.adiciona_produto(
+            Produto(
+                codigo=_codigo(i),
+                descricao=None,
+                preco_de=1990,
+                preco_por=990,
+                quantidade=aleatorio.randint(1, 3),
+            )
+        )
+    return carrinho
+
+
+def _ingenuo(cupons: List[Cupom], carrinho: Carrinho) -> List[Tuple[Cupom, int]]:
+    """
+    Avaliação sem índices: para cada regra, percorre todos os produtos do carrinho.
+    """
+    agora = time()
+    subtotal = carrinho.subtotal_centavos
+    resultado = []
+    for cupom in cupons:
+        base = 0
+        for codigo, produto in carrinho.produtos.items():
+            if cupom.produtos is None or codigo in cupom.produtos:
+                base += produto.quantidade * produto.preco_por
+        desconto = cupom.desconto_centavos(subtotal, base, agora)
+        if desconto > 0:
+            resultado.append((cupom, desconto))
+    resultado.sort(key=lambda aplicavel: (-aplicavel[1], aplicavel[0].codigo))
+    return resultado
+
+
+def _mede(operacao: Callable[[int], object], repeticoes: int) -> Dict[str, float]:
+    """
+    Executa a operação repetidas vezes, retornando os percentis do tempo de cada
+    execução, em microssegundos.
+    """
+    amostras: List[float] = []
+    for i in range(repeticoes):
+        inicio = perf_counter_ns()
+        operacao(i)
+        amostras.append((perf_counter_ns() - inicio) / 1000)
+    resultado = percentis(amostras)
+    resultado["media"] = sum(amostras) / len(amostras)
+    return {chave: round(valor, 3) for chave, valor in resultado.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--regras", type=int, default=10_000)
+    parser.add_argument("--linhas", type=int, default=200)
+    parser.add_argument("--repeticoes", type=int, default=50)
+    parser.add_argument("--semente", type=int, default=1)
+    args = parser.parse_args()
+
+    aleatorio = random.Random(args.semente)
+    regras = _regras(args.regras, aleatorio)
+    inicio = perf_counter()
+    cadastro = CadastroCupons(regras)
+    compilacao = perf_counter() - inicio
+    cupons = [cadastro.fetch(regra.codigo) for regra in regras]
+    carrinhos = [_carrinho(args.linhas, aleatorio) for _ in range(args.repeticoes)]
+    for carrinho in carrinhos:
+        assert cadastro.aplicaveis(carrinho) == _ingenuo(cupons, carrinho)
+
+    # Cupom restrito a metade dos produtos do carrinho, nos totalizadores.
+    carrinho = carrinhos[0]
+    restrito = Cupom(
+        codigo="METADE", percentual=10.0, produtos=list(carrinho.produtos)[::2]
+    )
+    totais = {"sem_cupom": _mede(lambda i: carrinho.totais, args.repeticoes)}
+    carrinho.define_cupom_desconto(restrito)
+    totais["cupom_restrito"] = _mede(lambda i: carrinho.totais, args.repeticoes)
+    carrinho.define_cupom_desconto(None)
+
+    relatorio(
+        "cupons",
+        {
+            "regras": args.regras,
+            "linhas": args.linhas,
+            "milissegundos_compilacao": round(compilacao * 1000, 2),
+            "aplicaveis_indexado": _mede(
+                lambda i: cadastro.aplicaveis(carrinhos[i]), args.repeticoes
+            ),
+            "aplicaveis_ingenuo": _mede(
+                lambda i: _ingenuo(cupons, carrinhos[i]), args.repeticoes
+            ),
+            "totais": totais,
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
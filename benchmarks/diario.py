@@ -0,0 +1,140 @@
+"""
+Benchmarks do diário dos carrinhos (`CarrinhosDiario`):
+
+* escrita: custo de cada alteração gravada (cliente alterado e carrinho gravado) na
+  memória, no diário sem aguardar o fsync e no diário durável, com 1 e várias threads
+  (as gravações concorrentes compartilham o fsync);
+* restauracao: tempo para recuperar os carrinhos ao iniciar, a partir somente dos
+  segmentos do diário e a partir do snapshot.
+
+    python -m benchmarks.diario [--carrinhos N] [--alteracoes N] [--threads N]
+        [--diretorio DIR]
+"""
+
+import argparse
+import tempfile
+import threading
+from time import perf_counter
+from typing import Dict, List
+
+from api_carrinho.models.carrinho import Carrinho
+from api_carrinho.models.produto import Produto
+from api_carrinho.persist.carrinhos import CarrinhosBackend, CarrinhosMemoria
+from api_carrinho.persist.carrinhos_diario import CarrinhosDiario
+from benchmarks import relatorio
+
+
+def _carrinho(i: int) -> Carrinho:
+    carrinho = Carrinho(cliente=i)
+    carrinho.adiciona_produto(
+        Produto(
+            codigo="AB{:07d}".format(i % 1000),
+            descricao=None,
+            preco_de=10000,
+            preco_por=9000,
+            quantidade=1,
+        )
+    )
+    return carrinho
+
+
+def _escrita(
+    backend: CarrinhosBackend, alteracoes: int, threads: int
+) -> Dict[str, float]:
+    """
+    Altera e grava carrinhos com várias threads, cada uma com seus carrinhos, retornando
+    as alterações por segundo e o tempo médio de cada uma por thread.
+    """
+    carrinhos = [[_carrinho(i) for i in range(100)] for _ in range(threads)]
+    for lista in carrinhos:
+        for carrinho in lista:
+            backend.save(carrinho)
+    por_thread = alteracoes // threads
+
+    def altera(lista: List[Carrinho]) -> None:
+        for i in range(por_thread):
+            carrinho = lista[i % len(lista)]
+            carrinho.define_cliente(i)
+            backend.save(carrinho)
+
+    executando = [threading.Thread(target=altera, args=(lista,)) for lista in carrinhos]
+    inicio = perf_counter()
+    for thread in executando:
+        thread.start()
+    for thread in executando:
+        thread.join()
+    segundos = perf_counter() - inicio
+    return {
+        "alteracoes_por_segundo": round(por_thread * threads / segundos),
+        "microssegundos_por_alteracao": round(segundos / por_thread * 1e6, 2),
+    }
+
+
+def _benchmark_escrita(diretorio: str, alteracoes: int, threads: int) -> Dict:
+    resultados: Dict[str, Dict] = {}
+    for quantidade in sorted({1, threads}):
+        resultados["{}_threads".format(quantidade)] = por_backend = {}
+        por_backend["memoria"] = _escrita(CarrinhosMemoria(), alteracoes, quantidade)
+        for nome, duravel in (("diario", False), ("diario_duravel", True)):
+            with tempfile.TemporaryDirectory(dir=diretorio) as subdiretorio:
+                backend = CarrinhosDiario(subdiretorio, duravel=duravel)
+                backend.restaura()
+                por_backend[nome] = _escrita(backend, alteracoes, quantidade)
+                backend.fecha()
+    return resultados
+
+
+def _benchmark_restauracao(diretorio: str, carrinhos: int) -> Dict:
+    with tempfile.TemporaryDirectory(dir=diretorio) as subdiretorio:
+        backend = CarrinhosDiario(subdiretorio, duravel=False)
+        backend.restaura()
+        inicio = perf_counter()
+        for i in range(carrinhos):
+            backend.save(_carrinho(i))
+        gravacao = perf_counter() - inicio
+        backend.fecha()
+
+        backend = CarrinhosDiario(subdiretorio)
+        inicio = perf_counter()
+        backend.restaura()
+        pelo_diario = perf_counter() - inicio
+        inicio = perf_counter()
+        backend.compacta()
+        compactacao = perf_counter() - inicio
+        backend.fecha()
+        del backend
+
+        backend = CarrinhosDiario(subdiretorio)
+        inicio = perf_counter()
+        restaurados = backend.restaura()
+        pelo_snapshot = perf_counter() - inicio
+        backend.fecha()
+    return {
+        "carrinhos": restaurados,
+        "segundos_gravacao": round(gravacao, 2),
+        "segundos_restauracao_diario": round(pelo_diario, 2),
+        "segundos_compactacao": round(compactacao, 2),
+        "segundos_restauracao_snapshot": round(pelo_snapshot, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--carrinhos", type=int, default=1_000_000)
+    parser.add_argument("--alteracoes", type=int, default=20_000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument(
+        "--diretorio", default=None, help="diretório dos arquivos temporários"
+    )
+    args = parser.parse_args()
+    relatorio(
+        "diario",
+        {
+            "escrita": _benchmark_escrita(args.diretorio, args.alteracoes, args.threads),
+            "restauracao": _benchmark_restauracao(args.diretorio, args.carrinhos),
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
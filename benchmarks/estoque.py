@@ -0,0 +1,78 @@
+"""
+Benchmark de concorrência das reservas de estoque: várias threads reservando e liberando
+estoque de produtos aleatórios, comparando uma única trava com a tabela de travas por
+produto.
+
+    python -m benchmarks.estoque [--operacoes N] [--produtos N]
+"""
+
+import argparse
+import random
+import sys
+import threading
+from time import perf_counter
+from typing import Dict
+
+from api_carrinho.persist.estoque import ReservasEstoque
+from benchmarks import relatorio
+
+# Estoque informado às reservas, como se obtido do cadastro: nunca se esgota.
+ESTOQUE = 10**9
+
+
+def _executa(
+    reservas: ReservasEstoque, threads: int, operacoes: int, produtos: int
+) -> Dict:
+    """
+    Executa `operacoes` pares de reserva/liberação divididos entre as threads, retornando
+    a vazão em operações por segundo.
+    """
+    codigos = ["BENCH{:06d}".format(i) for i in range(produtos)]
+    por_thread = operacoes // threads
+    barreira = threading.Barrier(threads + 1)
+
+    def trabalho(semente: int) -> None:
+        aleatorio = random.Random(semente)
+        sorteados = [aleatorio.choice(codigos) for _ in range(por_thread)]
+        barreira.wait()
+        for codigo in sorteados:
+            reservas.reserva(codigo, 1, ESTOQUE)
+            reservas.libera(codigo, 1)
+
+    trabalhadores = [threading.Thread(target=trabalho, args=(i,)) for i in range(threads)]
+    for trabalhador in trabalhadores:
+        trabalhador.start()
+    barreira.wait()
+    inicio = perf_counter()
+    for trabalhador in trabalhadores:
+        trabalhador.join()
+    duracao = perf_counter() - inicio
+    return {
+        "threads": threads,
+        "operacoes": por_thread * threads,
+        "segundos": round(duracao, 4),
+        "operacoes_por_segundo": round(por_thread * threads / duracao),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--operacoes", type=int, default=200_000)
+    parser.add_argument("--produtos", type=int, default=1000)
+    args = parser.parse_args()
+
+    # Troca de thread mais frequente, aproximando a contenção de um servidor real.
+    sys.setswitchinterval(1e-4)
+    resultados = []
+    for travas in (1, 256):
+        for threads in (1, 2, 4, 8):
+            resultado = _executa(
+                ReservasEstoque(travas=travas), threads, args.operacoes, args.produtos
+            )
+            resultado["travas"] = travas
+            resultados.append(resultado)
+    relatorio("estoque", {"produtos": args.produtos, "execucoes": resultados})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark dos formatos das requisições e respostas na API síncrona: parâmetros em
+formulário ou em JSON em `/produto-adiciona`, e a serialização da resposta de
+`/carrinho/<codigo>` (sem o cache de respostas), com o orjson e com a biblioteca padrão.
+
+    python -m benchmarks.formatos [--repeticoes N] [--linhas N]
+"""
+
+import argparse
+from contextlib import contextmanager
+from time import perf_counter_ns
+from typing import Callable, Dict, Iterator, List
+
+from api_carrinho import app as app_modulo
+from api_carrinho import serializacao
+from api_carrinho.persist.carrinhos import db_carrinho_delete
+from api_carrinho.persist.produtos import _PRODUTOS, ProdutoPersisted
+from benchmarks import percentis, relatorio
+
+
+def _mede(requisicao: Callable[[], None], repeticoes: int) -> Dict[str, float]:
+    """
+    Executa a requisição repetidas vezes, retornando os percentis do tempo de cada
+    execução, em microssegundos.
+    """
+    amostras: List[float] = []
+    for _ in range(repeticoes):
+        inicio = perf_counter_ns()
+        requisicao()
+        amostras.append((perf_counter_ns() - inicio) / 1000)
+    resultado = percentis(amostras)
+    resultado["media"] = sum(amostras) / len(amostras)
+    return {chave: round(valor, 3) for chave, valor in resultado.items()}
+
+
+@contextmanager
+def _serializacao(orjson: bool) -> Iterator[None]:
+    """
+    Usa ou não o orjson durante o bloco.
+    """
+    original = serializacao.orjson
+    if not orjson:
+        serializacao.orjson = None
+    try:
+        yield
+    finally:
+        serializacao.orjson = original
+
+
+def _benchmarks(repeticoes: int, linhas: int) -> Dict:
+    cliente = app_modulo.app.test_client()
+    codigos = ["BF{:07d}".format(i) for i in range(linhas)]
+    for codigo in codigos:
+        _PRODUTOS[codigo] = ProdutoPersisted(
+            codigo=codigo,
+            descricao="Produto {}".format(codigo),
+            preco_de=1990,
+            preco_por=990,
+            estoque=10**9,
+        )
+    # Sem o cache de respostas, para medir a serialização a cada requisição.
+    app_modulo._CACHE_CARRINHOS.maximo = 0
+    carrinho = cliente.post("/novo").json["dados"]["carrinho_codigo"]
+    cliente.post(
+        "/carrinho/{}/operacoes".format(carrinho),
+        json=[{"operacao": "produto-adiciona", "produto": codigo} for codigo in codigos],
+    )
+    parametros = {"carrinho": carrinho, "produto": codigos[0]}
+    resultados: Dict[str, Dict] = {}
+    try:
+        for nome, orjson in (("orjson", True), ("json", False)):
+            if orjson and serializacao.orjson is None:
+                continue
+            with _serializacao(orjson):
+                resultados[nome] = {
+                    "produto_adiciona_formulario": _mede(
+                        lambda: cliente.post("/produto-adiciona", data=parametros),
+                        repeticoes,
+                    ),
+                    "produto_adiciona_json": _mede(
+                        lambda: cliente.post("/produto-adiciona", json=parametros),
+                        repeticoes,
+                    ),
+                    "carrinho": _mede(
+                        lambda: cliente.get("/carrinho/{}".format(carrinho)), repeticoes
+                    ),
+                }
+    finally:
+        db_carrinho_delete(carrinho)
+        for codigo in codigos:
+            del _PRODUTOS[codigo]
+    return resultados
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeticoes", type=int, default=2000)
+    parser.add_argument(
+        "--linhas", type=int, default=100, help="produtos no carrinho de /carrinho"
+    )
+    args = parser.parse_args()
+    relatorio(
+        "formatos",
+        {
+            "unidade": "microssegundos por requisição",
+            "repeticoes": args.repeticoes,
+            "linhas": args.linhas,
+            "serializacao": _benchmarks(args.repeticoes, args.linhas),
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark de concorrência do armazenamento dos carrinhos em memória: várias threads
+obtendo e gravando carrinhos aleatórios, comparando uma única trava (`CarrinhosMemoria`)
+com os carrinhos divididos em fragmentos (`CarrinhosFragmentados`).
+
+    python -m benchmarks.fragmentos [--operacoes N] [--carrinhos N]
+"""
+
+import argparse
+import random
+import sys
+import threading
+from datetime import timedelta
+from time import perf_counter
+from typing import Dict, List
+
+from api_carrinho.models.carrinho import Carrinho
+from api_carrinho.persist.carrinhos import (
+    CarrinhosBackend,
+    CarrinhosFragmentados,
+    CarrinhosMemoria,
+)
+from benchmarks import relatorio
+
+
+def _executa(
+    backend: CarrinhosBackend, carrinhos: List[Carrinho], threads: int, operacoes: int
+) -> Dict:
+    """
+    Executa `operacoes` pares de leitura/gravação divididos entre as threads, retornando
+    a vazão em operações por segundo.
+    """
+    for carrinho in carrinhos:
+        backend.save(carrinho)
+    por_thread = operacoes // threads
+    barreira = threading.Barrier(threads + 1)
+
+    def trabalho(semente: int) -> None:
+        aleatorio = random.Random(semente)
+        codigos = [aleatorio.choice(carrinhos).codigo for _ in range(por_thread)]
+        barreira.wait()
+        for codigo in codigos:
+            backend.save(backend.fetch(codigo))
+
+    trabalhadores = [threading.Thread(target=trabalho, args=(i,)) for i in range(threads)]
+    for trabalhador in trabalhadores:
+        trabalhador.start()
+    barreira.wait()
+    inicio = perf_counter()
+    for trabalhador in trabalhadores:
+        trabalhador.join()
+    duracao = perf_counter() - inicio
+    return {
+        "threads": threads,
+        "operacoes": por_thread * threads,
+        "segundos": round(duracao, 4),
+        "operacoes_por_segundo": round(por_thread * threads / duracao),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--operacoes", type=int, default=200_000)
+    parser.add_argument("--carrinhos", type=int, default=10_000)
+    args = parser.parse_args()
+
+    carrinhos = [Carrinho(cliente=None) for _ in range(args.carrinhos)]
+    # Troca de thread mais frequente, aproximando a contenção de um servidor real.
+    sys.setswitchinterval(1e-4)
+    ttl = timedelta(days=7)
+    resultados = []
+    for fragmentos in (1, 4, 16, 64):
+        for threads in (1, 2, 4, 8):
+            if fragmentos == 1:
+                backend: CarrinhosBackend = CarrinhosMemoria(ttl=ttl)
+            else:
+                backend = CarrinhosFragmentados(fragmentos, ttl=ttl)
+            resultado = _executa(backend, carrinhos, threads, args.operacoes)
+            resultado["fragmentos"] = fragmentos
+            resultados.append(resultado)
+    relatorio("fragmentos", {"carrinhos": args.carrinhos, "execucoes": resultados})
+
+
+if __name__ == "__main__":
+    main()
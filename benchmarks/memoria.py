@@ -0,0 +1,61 @@
+"""
+Benchmark de memória dos carrinhos: bytes ocupados por carrinho vivo no armazenamento em
+memória, com 0, 1 e 5 produtos, medidos com tracemalloc.
+
+    python -m benchmarks.memoria [--carrinhos N]
+"""
+
+import argparse
+import gc
+import tracemalloc
+from typing import Dict
+
+from api_carrinho.models.carrinho import Carrinho
+from api_carrinho.models.produto import Produto
+from api_carrinho.persist.carrinhos import CarrinhosMemoria
+from benchmarks import relatorio
+
+
+def _executa(carrinhos: int, produtos: int) -> Dict:
+    """
+    Cria `carrinhos` carrinhos com `produtos` produtos cada, gravando-os em um
+    armazenamento em memória, e retorna os bytes alocados por carrinho.
+    """
+    gc.collect()
+    tracemalloc.start()
+    inicio, _ = tracemalloc.get_traced_memory()
+    armazem = CarrinhosMemoria()
+    for _ in range(carrinhos):
+        carrinho = Carrinho(cliente=123456)
+        for i in range(produtos):
+            carrinho.adiciona_produto(
+                Produto(
+                    codigo="AB{:07d}".format(i),
+                    descricao=None,
+                    preco_de=10000,
+                    preco_por=9000,
+                    quantidade=1,
+                )
+            )
+        armazem.save(carrinho)
+    gc.collect()
+    fim, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "produtos": produtos,
+        "carrinhos": len(armazem),
+        "bytes_por_carrinho": round((fim - inicio) / carrinhos),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--carrinhos", type=int, default=20_000)
+    args = parser.parse_args()
+
+    resultados = [_executa(args.carrinhos, produtos) for produtos in (0, 1, 5)]
+    relatorio("memoria", {"execucoes": resultados})
+
+
+if __name__ == "__main__":
+    main()
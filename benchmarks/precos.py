@@ -0,0 +1,110 @@
+"""
+Benchmark da reprecificação em lote: um lote de novos preços aplicado aos carrinhos em
+memória, consultando somente os carrinhos com os produtos pelo índice de produtos
+(`api_carrinho.precos`), comparado a percorrer todos os carrinhos, com lotes de 1, 10 e
+50 mil produtos.
+
+    python -m benchmarks.precos [--carrinhos N] [--produtos N]
+"""
+
+import argparse
+import random
+from time import perf_counter
+from typing import Dict
+
+from api_carrinho import precos
+from api_carrinho.models.carrinho import Carrinho
+from api_carrinho.models.produto import Produto
+from api_carrinho.persist.carrinhos import (
+    CarrinhosMemoria,
+    db_carrinho_com_produtos,
+    db_carrinho_define_backend,
+    db_carrinho_percorre,
+    db_carrinho_save,
+)
+from api_carrinho.travas import TabelaTravas
+from benchmarks import relatorio
+
+
+def _codigo(i: int) -> str:
+    return "P{:07d}".format(i)
+
+
+def _popula(carrinhos: int, produtos: int, aleatorio: random.Random) -> None:
+    """
+    Grava os carrinhos, cada um com 1 a 10 produtos do catálogo.
+    """
+    db_carrinho_define_backend(CarrinhosMemoria())
+    for _ in range(carrinhos):
+        carrinho = Carrinho(cliente=None)
+        for i in aleatorio.sample(range(produtos), aleatorio.randint(1, 10)):
+            carrinho.adiciona_produto(
+                Produto(
+                    codigo=_codigo(i),
+                    descricao=None,
+                    preco_de=1990,
+                    preco_por=990,
+                    quantidade=1,
+                )
+            )
+        db_carrinho_save(carrinho)
+
+
+def _indexado(novos: precos.Precos) -> Dict:
+    travas = TabelaTravas(1024)
+    inicio = perf_counter()
+    codigos = db_carrinho_com_produtos(novos)
+    consulta = perf_counter() - inicio
+    alterados = 0
+    for codigo in codigos:
+        with travas.trava(codigo):
+            alterados += precos.reprecifica(codigo, novos)
+    return {
+        "segundos_consulta": round(consulta, 3),
+        "segundos": round(perf_counter() - inicio, 3),
+        "carrinhos_consultados": len(codigos),
+        "carrinhos_alterados": alterados,
+    }
+
+
+def _varredura(novos: precos.Precos) -> Dict:
+    inicio = perf_counter()
+    consultados = alterados = 0
+    for carrinho in db_carrinho_percorre():
+        consultados += 1
+        versao_anterior = carrinho.versao
+        if carrinho.reprecifica(novos):
+            db_carrinho_save(carrinho, versao_anterior=versao_anterior)
+            alterados += 1
+    return {
+        "segundos": round(perf_counter() - inicio, 3),
+        "carrinhos_consultados": consultados,
+        "carrinhos_alterados": alterados,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--carrinhos", type=int, default=200_000)
+    parser.add_argument("--produtos", type=int, default=500_000)
+    parser.add_argument("--semente", type=int, default=1)
+    args = parser.parse_args()
+
+    aleatorio = random.Random(args.semente)
+    _popula(args.carrinhos, args.produtos, aleatorio)
+    execucoes = []
+    for lote in (1_000, 10_000, 50_000):
+        codigos = [_codigo(i) for i in aleatorio.sample(range(args.produtos), lote)]
+        for nome, reprecifica in (("indexado", _indexado), ("varredura", _varredura)):
+            # Um novo preço a cada execução, para que todos os carrinhos mudem.
+            preco = (len(execucoes) + 1) * 100
+            resultado = reprecifica({codigo: (1990, preco) for codigo in codigos})
+            execucoes.append(dict(resultado, precos=lote, estrategia=nome))
+    relatorio(
+        "precos",
+        {"carrinhos": args.carrinhos, "produtos": args.produtos, "execucoes": execucoes},
+    )
+
+
+if __name__ == "__main__":
+    main()
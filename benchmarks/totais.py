@@ -0,0 +1,103 @@
+"""
+Benchmark do recálculo completo dos totalizadores do carrinho, com carrinhos de 1 e 10
+mil produtos, comparando:
+
+* `reais`: preços em float, convertidos para centavos a cada produto (a representação
+  anterior aos valores em centavos);
+* `centavos`: preços inteiros em centavos (`Carrinho.recalcula_subtotal()`);
+* `arrays_paralelos`: quantidades e preços em arrays paralelos de inteiros, somados com
+  `sum(map(mul, ...))`, com o custo em memória dos arrays.
+
+    python -m benchmarks.totais [--repeticoes N]
+"""
+
+import argparse
+import sys
+from array import array
+from operator import mul
+from time import perf_counter_ns
+from typing import Callable, Dict, List
+
+from api_carrinho.models.carrinho import Carrinho
+from api_carrinho.models.produto import Produto
+from benchmarks import percentis, relatorio
+
+TAMANHOS = (1_000, 10_000)
+
+
+def _carrinho(linhas: int, reais: bool) -> Carrinho:
+    carrinho = Carrinho(cliente=None)
+    for i in range(linhas):
+        preco = 990 + i % 100
+        carrinho.adiciona_produto(
+            Produto(
+                codigo="P{:07d}".format(i),
+                descricao=None,
+                preco_de=preco / 100 if reais else preco,
+                preco_por=preco / 100 if reais else preco,
+                quantidade=i % 3 + 1,
+            )
+        )
+    return carrinho
+
+
+def _mede(operacao: Callable[[], int], repeticoes: int) -> Dict[str, float]:
+    """
+    Executa a operação repetidas vezes, retornando os percentis do tempo de cada
+    execução, em microssegundos.
+    """
+    amostras: List[float] = []
+    for _ in range(repeticoes):
+        inicio = perf_counter_ns()
+        operacao()
+        amostras.append((perf_counter_ns() - inicio) / 1000)
+    resultado = percentis(amostras)
+    resultado["media"] = sum(amostras) / len(amostras)
+    return {chave: round(valor, 3) for chave, valor in resultado.items()}
+
+
+def _benchmarks(linhas: int, repeticoes: int) -> Dict:
+    em_reais = _carrinho(linhas, reais=True).produtos.values()
+
+    def reais() -> int:
+        return sum(
+            produto.quantidade * int(round(produto.preco_por * 100))
+            for produto in em_reais
+        )
+
+    carrinho = _carrinho(linhas, reais=False)
+    quantidades = array("q", (p.quantidade for p in carrinho.produtos.values()))
+    precos = array("q", (p.preco_por for p in carrinho.produtos.values()))
+
+    def arrays_paralelos() -> int:
+        return sum(map(mul, quantidades, precos))
+
+    assert reais() == carrinho.recalcula_subtotal() == arrays_paralelos()
+    return {
+        "reais": _mede(reais, repeticoes),
+        "centavos": _mede(carrinho.recalcula_subtotal, repeticoes),
+        "arrays_paralelos": dict(
+            _mede(arrays_paralelos, repeticoes),
+            bytes_adicionais=sys.getsizeof(quantidades) + sys.getsizeof(precos),
+        ),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeticoes", type=int, default=200)
+    args = parser.parse_args()
+    relatorio(
+        "totais",
+        {
+            "unidade": "microssegundos por recálculo",
+            "repeticoes": args.repeticoes,
+            "linhas": {
+                str(linhas): _benchmarks(linhas, args.repeticoes) for linhas in TAMANHOS
+            },
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
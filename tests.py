@@ -2,12 +2,91 @@
 Testes de unidade do projeto.
 """
 
+import asyncio
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
 import unittest
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from unittest import mock
+from urllib.parse import urlencode
 
-from api_carrinho.models.carrinho import Carrinho
+from werkzeug.test import encode_multipart
+
+from api_carrinho import admin, asgi, gunicorn_conf, metricas, perfil, serializacao
+from api_carrinho.app import app
+from api_carrinho.cache import CacheRespostas
+from api_carrinho.log import cria_fila
+from api_carrinho.models.carrinho import (
+    Carrinho,
+    CarrinhoTotais,
+    TotaisDivergentesError,
+)
 from api_carrinho.models.cupom import Cupom
+from api_carrinho.models.dinheiro import centavos, reais
 from api_carrinho.models.produto import Produto
+from api_carrinho.persist import carrinhos, cupons
+from api_carrinho.persist.carrinhos import (
+    CarrinhoNaoExisteError,
+    CarrinhosFragmentados,
+    CarrinhosMemoria,
+    CarrinhoVersaoConflitoError,
+    db_carrinho_define_backend,
+    db_carrinho_delete,
+    db_carrinho_delete_async,
+    db_carrinho_fetch_async,
+    db_carrinho_save,
+    db_carrinho_save_async,
+)
+from api_carrinho.persist.carrinhos_diario import CarrinhosDiario
+from api_carrinho.persist.carrinhos_sqlite import CarrinhosSQLite
+from api_carrinho.persist.cupons import db_cupom_fetch_async
+from api_carrinho.persist.estoque import (
+    ReservasEstoque,
+    TransacaoReservas,
+    db_estoque_disponivel,
+)
+from api_carrinho.persist.produtos import (
+    _PRODUTOS,
+    ProdutoNaoExisteError,
+    ProdutoPersisted,
+    ProdutoSemEstoqueError,
+    ProdutosMemoria,
+    db_produto_fetch_async,
+)
+from api_carrinho.persist.produtos_cache import ProdutosCache
+from api_carrinho.persist.produtos_sqlite import (
+    ProdutosSQLite,
+    importa,
+    le_csv,
+    le_jsonl,
+)
+
+
+def _produto_teste(codigo: str, preco: int = 1000) -> Produto:
+    return Produto(
+        codigo=codigo, descricao=None, preco_de=preco, preco_por=preco, quantidade=1
+    )
+
+
+class TestModelsDinheiro(unittest.TestCase):
+    def test_centavos(self):
+        "Testa a conversão dos valores em reais para centavos"
+        self.assertEqual(centavos(1.005), 101)
+        self.assertEqual(centavos(0.1) + centavos(0.2), centavos(0.3))
+        self.assertEqual(centavos("19.99"), 1999)
+        self.assertEqual(centavos(7), 700)
+        self.assertEqual(reais(1999), 19.99)
+        for invalido in ("abc", float("nan"), float("inf")):
+            with self.assertRaises(ValueError):
+                centavos(invalido)
 
 
 class TestModelsProduto(unittest.TestCase):
@@ -15,8 +94,8 @@ class TestModelsProduto(unittest.TestCase):
         return Produto(
             codigo="B33F0123456",
             descricao="Produto Teste",
-            preco_de=10.0,
-            preco_por=10.00,
+            preco_de=1000,
+            preco_por=1000,
             quantidade=3,
         )
 
@@ -38,7 +117,7 @@ class TestModelsProduto(unittest.TestCase):
 
 class TestModelsCupom(unittest.TestCase):
     def _new(self):
-        return Cupom(codigo="NOVO15", valor=15.0)
+        return Cupom(codigo="NOVO15", valor=1500)
 
     def test_new(self):
         "Teste de criação de um novo cupom de desconto"
@@ -48,6 +127,51 @@ class TestModelsCupom(unittest.TestCase):
         "Teste de validação do cupom"
         cupom = self._new()
         self.assertTrue(cupom.valida_cupom())
+        cupom = Cupom(codigo="ONTEM", valor=1500, validade=time.time() - 86400)
+        self.assertFalse(cupom.valida_cupom())
+
+    def test_regras(self):
+        "Testa o desconto das regras de cupom nos totalizadores do carrinho"
+        carrinho = Carrinho(cliente=None)
+        for codigo, preco, quantidade in (("A1", 10000, 2), ("B2", 5050, 1)):
+            carrinho.adiciona_produto(
+                Produto(
+                    codigo=codigo,
+                    descricao=None,
+                    preco_de=preco,
+                    preco_por=preco,
+                    quantidade=quantidade,
+                )
+            )
+        for cupom, total in (
+            (Cupom(codigo="P10", percentual=10.0), 22545),
+            (Cupom(codigo="M", valor=2000, subtotal_minimo=25000), 23050),
+            (Cupom(codigo="M", valor=2000, subtotal_minimo=25051), 25050),
+            (Cupom(codigo="SKU", percentual=50.0, produtos=["B2", "X9"]), 22525),
+            (Cupom(codigo="SKU", valor=500, produtos={"X9"}), 25050),
+            (Cupom(codigo="SKU", valor=8000, produtos={"B2"}), 20000),
+            (Cupom(codigo="EXP", valor=500, validade=time.time() - 1), 25050),
+        ):
+            carrinho.define_cupom_desconto(cupom)
+            self.assertEqual(carrinho.totais, CarrinhoTotais(25050, total), cupom)
+            copia = Carrinho.desserializa(carrinho.serializa())
+            self.assertEqual(copia.cupom, cupom)
+            self.assertEqual(copia.totais, carrinho.totais)
+
+    def test_desconto_limitado(self):
+        "Testa que o desconto de valor fixo não deixa o total negativo"
+        carrinho = Carrinho(cliente=None)
+        carrinho.adiciona_produto(
+            Produto(
+                codigo="A1", descricao=None, preco_de=1500, preco_por=1500, quantidade=1
+            )
+        )
+        for cupom in (
+            Cupom(codigo="SKU", valor=5000, produtos={"A1"}),
+            Cupom(codigo="V50", valor=5000),
+        ):
+            carrinho.define_cupom_desconto(cupom)
+            self.assertEqual(carrinho.totais, CarrinhoTotais(1500, 0), cupom)
 
 
 class TestModelsCarrinho(unittest.TestCase):
@@ -63,6 +187,15 @@ class TestModelsCarrinho(unittest.TestCase):
         )
         self.assertEqual((datetime.now() - carrinho.data_alteracao).days, 0)
 
+    def test_representacao_compacta(self):
+        "Testa o código binário e a ausência de __dict__ no carrinho"
+        carrinho = Carrinho(cliente=None)
+        self.assertFalse(hasattr(carrinho, "__dict__"))
+        self.assertEqual(len(carrinho.chave), 16)
+        self.assertEqual(Carrinho.chave_de(carrinho.codigo), carrinho.chave)
+        with self.assertRaises(ValueError):
+            Carrinho.chave_de("inexistente")
+
     def test_cliente(self):
         "Teste de alteração de cliente"
         carrinho = Carrinho(cliente=None)
@@ -72,14 +205,31 @@ class TestModelsCarrinho(unittest.TestCase):
         carrinho.define_cliente(None)
         self.assertIsNone(carrinho.cliente)
 
+    def test_mescla(self):
+        "Testa a mescla dos produtos de outro carrinho, somando as quantidades"
+        destino = Carrinho(cliente=None)
+        destino.adiciona_produto(Produto("AB1234567", None, 10000, 9000, 1))
+        origem = Carrinho(cliente=123456)
+        origem.adiciona_produto(Produto("AB1234567", None, 10000, 8000, 2))
+        origem.adiciona_produto(Produto("CD7654321", None, 5000, 5000, 1))
+        origem.define_cupom_desconto(Cupom(codigo="VALE10", valor=1000))
+        destino.mescla(origem)
+        self.assertEqual(destino.produtos["AB1234567"].quantidade, 3)
+        self.assertEqual(destino.produtos["CD7654321"].quantidade, 1)
+        self.assertIsNot(destino.produtos["CD7654321"], origem.produtos["CD7654321"])
+        self.assertEqual(destino.totais, CarrinhoTotais(subtotal=32000, total=31000))
+        self.assertEqual(destino.cliente, 123456)
+        self.assertEqual(origem.produtos["AB1234567"].quantidade, 2)
+        destino.verifica_totais_completo()
+
     def test_adiciona_produto(self):
         "Teste de adição de produto ao carrinho"
         carrinho = Carrinho(cliente=None)
         produto = Produto(
             codigo="AB1234567",
             descricao="Descrição",
-            preco_de=100.0,
-            preco_por=90.0,
+            preco_de=10000,
+            preco_por=9000,
             quantidade=1,
         )
         carrinho.adiciona_produto(produto)
@@ -91,8 +241,8 @@ class TestModelsCarrinho(unittest.TestCase):
         produto = Produto(
             codigo="AB1234567",
             descricao="Descrição",
-            preco_de=100.0,
-            preco_por=90.0,
+            preco_de=10000,
+            preco_por=9000,
             quantidade=1,
         )
         carrinho.adiciona_produto(produto)
@@ -108,8 +258,8 @@ class TestModelsCarrinho(unittest.TestCase):
         produto = Produto(
             codigo="AB1234567",
             descricao="Descrição",
-            preco_de=100.0,
-            preco_por=90.0,
+            preco_de=10000,
+            preco_por=9000,
             quantidade=1,
         )
         carrinho.adiciona_produto(produto)
@@ -124,8 +274,8 @@ class TestModelsCarrinho(unittest.TestCase):
             Produto(
                 codigo="AB1234567",
                 descricao="Descrição",
-                preco_de=100.0,
-                preco_por=90.0,
+                preco_de=10000,
+                preco_por=9000,
                 quantidade=1,
             )
         )
@@ -134,8 +284,8 @@ class TestModelsCarrinho(unittest.TestCase):
             Produto(
                 codigo="CD1234567",
                 descricao="Descrição 2",
-                preco_de=100.0,
-                preco_por=100.0,
+                preco_de=10000,
+                preco_por=10000,
                 quantidade=3,
             )
         )
@@ -150,8 +300,8 @@ class TestModelsCarrinho(unittest.TestCase):
             Produto(
                 codigo="AB1234567",
                 descricao="Descrição",
-                preco_de=100.0,
-                preco_por=90.0,
+                preco_de=10000,
+                preco_por=9000,
                 quantidade=1,
             )
         )
@@ -159,52 +309,1864 @@ class TestModelsCarrinho(unittest.TestCase):
         carrinho.define_produto_quantidade("AB1234567", 2)
         self.assertEqual(carrinho.produtos["AB1234567"].quantidade, 2)
 
+    def test_alteracao_falha_mantem_versao(self):
+        "Testa que uma alteração que falha não muda a versão nem a data do carrinho"
+        carrinho = Carrinho(cliente=None)
+        carrinho.adiciona_produto(_produto_teste("A"))
+        carrinho.data_alteracao -= timedelta(hours=1)
+        alteracao, versao = carrinho.timestamp_alteracao, carrinho.versao
+        with self.assertRaises(ValueError):
+            carrinho.define_produto_quantidade("A", 0)
+        with self.assertRaises(KeyError):
+            carrinho.define_produto_quantidade("X", 2)
+        self.assertEqual(carrinho.versao, versao)
+        self.assertEqual(carrinho.timestamp_alteracao, alteracao)
+
     def test_define_cupom(self):
         "Testa associação de cupom de desconto ao carrinho"
         carrinho = Carrinho(cliente=None)
-        cupom = Cupom(codigo="VALE15", valor=15.0)
+        cupom = Cupom(codigo="VALE15", valor=1500)
         carrinho.define_cupom_desconto(cupom)
         self.assertEqual(carrinho.cupom.codigo, "VALE15")
 
     def test_totais(self):
         "Testa cálculo de totalizadores do carrinho"
         carrinho = Carrinho(cliente=None)
-        self.assertEqual(carrinho.totais.subtotal, 0.0)
-        self.assertEqual(carrinho.totais.total, 0.0)
+        self.assertEqual(carrinho.totais.subtotal, 0)
+        self.assertEqual(carrinho.totais.total, 0)
         carrinho.adiciona_produto(
             Produto(
                 codigo="CD1234567",
                 descricao="Descrição 2",
-                preco_de=90.0,
-                preco_por=100.0,
+                preco_de=9000,
+                preco_por=10000,
                 quantidade=3,
             )
         )
-        self.assertEqual(carrinho.totais.subtotal, 300.0)
-        self.assertEqual(carrinho.totais.total, 300.0)
+        self.assertEqual(carrinho.totais.subtotal, 30000)
+        self.assertEqual(carrinho.totais.total, 30000)
         carrinho.adiciona_produto(
             Produto(
                 codigo="FG1234567",
                 descricao="Descrição 3",
-                preco_de=30.0,
-                preco_por=25.5,
+                preco_de=3000,
+                preco_por=2550,
                 quantidade=1,
             )
         )
-        self.assertEqual(carrinho.totais.subtotal, 325.5)
-        self.assertEqual(carrinho.totais.total, 325.5)
-        carrinho.define_cupom_desconto(Cupom(codigo="AX10", valor=10.0))
-        self.assertEqual(carrinho.totais.subtotal, 325.5)
-        self.assertEqual(carrinho.totais.total, 315.5)
+        self.assertEqual(carrinho.totais.subtotal, 32550)
+        self.assertEqual(carrinho.totais.total, 32550)
+        carrinho.define_cupom_desconto(Cupom(codigo="AX10", valor=1000))
+        self.assertEqual(carrinho.totais.subtotal, 32550)
+        self.assertEqual(carrinho.totais.total, 31550)
         carrinho.remove_produto("FG1234567")
-        self.assertEqual(carrinho.totais.subtotal, 300.0)
-        self.assertEqual(carrinho.totais.total, 290.0)
+        self.assertEqual(carrinho.totais.subtotal, 30000)
+        self.assertEqual(carrinho.totais.total, 29000)
         carrinho.remove_todos_produtos()
-        self.assertEqual(carrinho.totais.subtotal, 0.0)
-        self.assertEqual(carrinho.totais.total, -10.0)
+        self.assertEqual(carrinho.totais.subtotal, 0)
+        self.assertEqual(carrinho.totais.total, 0)
         carrinho.define_cupom_desconto(None)
-        self.assertEqual(carrinho.totais.subtotal, 0.0)
-        self.assertEqual(carrinho.totais.total, 0.0)
+        self.assertEqual(carrinho.totais.subtotal, 0)
+        self.assertEqual(carrinho.totais.total, 0)
+
+    def test_totais_centavos(self):
+        "Testa que os totalizadores não acumulam erro de arredondamento"
+        carrinho = Carrinho(cliente=None)
+        for i in range(1000):
+            carrinho.adiciona_produto(
+                Produto(
+                    codigo="P{}".format(i),
+                    descricao="Produto {}".format(i),
+                    preco_de=10,
+                    preco_por=10,
+                    quantidade=1,
+                )
+            )
+            carrinho.define_produto_quantidade("P{}".format(i), 3)
+        self.assertEqual(carrinho.totais.subtotal, 30000)
+        for i in range(500):
+            carrinho.remove_produto("P{}".format(i))
+        self.assertEqual(carrinho.totais.subtotal, 15000)
+        self.assertEqual(carrinho.recalcula_subtotal(), 15000)
+
+    def test_verifica_totais(self):
+        "Testa o modo de verificação dos totalizadores incrementais"
+        carrinho = Carrinho(cliente=None)
+        Carrinho.verifica_totais = True
+        self.addCleanup(setattr, Carrinho, "verifica_totais", False)
+        produto = Produto(
+            codigo="AB1234567",
+            descricao="Descrição",
+            preco_de=10000,
+            preco_por=9000,
+            quantidade=1,
+        )
+        carrinho.adiciona_produto(produto)
+        carrinho.define_produto_quantidade("AB1234567", 5)
+        self.assertEqual(carrinho.totais.subtotal, 45000)
+        # Alteração por fora do carrinho dessincroniza os totalizadores.
+        produto.quantidade = 2
+        with self.assertRaises(TotaisDivergentesError):
+            carrinho.define_cupom_desconto(None)
+
+    def test_reprecifica(self):
+        "Testa a atualização dos preços dos produtos do carrinho"
+        carrinho = Carrinho(cliente=None)
+        for codigo in ("A", "B", "C"):
+            carrinho.adiciona_produto(_produto_teste(codigo))
+        carrinho.define_produto_quantidade("B", 3)
+        carrinho.data_alteracao -= timedelta(hours=1)
+        alteracao, versao = carrinho.timestamp_alteracao, carrinho.versao
+        self.assertTrue(carrinho.reprecifica({"B": (1200, 990), "X": (100, 100)}))
+        self.assertEqual(carrinho.produtos["B"].preco_de, 1200)
+        self.assertEqual(carrinho.totais, CarrinhoTotais(4970, 4970))
+        self.assertEqual(carrinho.versao, versao + 1)
+        self.assertEqual(carrinho.timestamp_alteracao, alteracao)
+        carrinho.verifica_totais_completo()
+        # Sem mudança de preço, o carrinho não é alterado.
+        self.assertFalse(carrinho.reprecifica({"A": (1000, 1000), "B": (1200, 990)}))
+        self.assertEqual(carrinho.versao, versao + 1)
+
+    def test_desserializa_reais(self):
+        "Testa a leitura dos carrinhos gravados com os valores em reais"
+        carrinho = Carrinho(cliente=None)
+        dados = serializacao.codifica_compacto(
+            [
+                carrinho.codigo,
+                3,
+                carrinho.timestamp_alteracao,
+                None,
+                ["VALE10", 10.0],
+                [["A", None, 19.9, 9.9, 3]],
+            ]
+        )
+        copia = Carrinho.desserializa(dados)
+        self.assertEqual(copia.produtos["A"].preco_por, 990)
+        self.assertEqual(copia.cupom, Cupom(codigo="VALE10", valor=1000))
+        self.assertEqual(copia.totais, CarrinhoTotais(2970, 1970))
+
+
+class TestPersistCarrinhos(unittest.TestCase):
+    def test_save_fetch_delete(self):
+        "Testa gravação, leitura e remoção de carrinhos na memória"
+        armazem = CarrinhosMemoria()
+        carrinho = Carrinho(cliente=None)
+        armazem.save(carrinho)
+        self.assertIs(armazem.fetch(carrinho.codigo), carrinho)
+        with self.assertRaises(CarrinhoVersaoConflitoError):
+            armazem.delete(carrinho.codigo, versao=carrinho.versao + 1)
+        armazem.delete(carrinho.codigo, versao=carrinho.versao)
+        with self.assertRaises(CarrinhoNaoExisteError):
+            armazem.fetch(carrinho.codigo)
+        with self.assertRaises(CarrinhoNaoExisteError):
+            armazem.delete(carrinho.codigo)
+
+    def test_expira_ttl(self):
+        "Testa expiração dos carrinhos sem alteração há mais tempo que o TTL"
+        armazem = CarrinhosMemoria(ttl=timedelta(hours=1))
+        antigo = Carrinho(cliente=None)
+        antigo.data_alteracao -= timedelta(hours=2)
+        armazem.save(antigo)
+        novo = Carrinho(cliente=None)
+        armazem.save(novo)
+        self.assertEqual(len(armazem), 1)
+        with self.assertRaises(CarrinhoNaoExisteError):
+            armazem.fetch(antigo.codigo)
+        self.assertIs(armazem.fetch(novo.codigo), novo)
+        self.assertEqual(armazem.estatisticas()["expirados"], 1)
+
+    def test_expira_carrinho_alterado_sem_gravar(self):
+        "Testa que um carrinho alterado após a gravação não é expirado"
+        armazem = CarrinhosMemoria()
+        carrinho = Carrinho(cliente=None)
+        carrinho.data_alteracao -= timedelta(hours=2)
+        armazem.save(carrinho)
+        armazem.ttl = timedelta(hours=1)
+        carrinho.define_cliente(123456)
+        self.assertEqual(armazem.expira(), 0)
+        self.assertIs(armazem.fetch(carrinho.codigo), carrinho)
+
+    def test_maximo(self):
+        "Testa descarte dos carrinhos mais antigos ao atingir o tamanho máximo"
+        armazem = CarrinhosMemoria(maximo=2)
+        carrinhos = [Carrinho(cliente=None) for _ in range(3)]
+        for carrinho in carrinhos:
+            armazem.save(carrinho)
+        with self.assertRaises(CarrinhoNaoExisteError):
+            armazem.fetch(carrinhos[0].codigo)
+        self.assertEqual(
+            armazem.estatisticas(), {"carrinhos": 2, "expirados": 0, "descartados": 1}
+        )
+
+    def test_percorre(self):
+        "Testa o percurso dos carrinhos em lotes, filtrando pela data de alteração"
+        armazem = CarrinhosMemoria(ttl=timedelta(hours=3))
+        antigos = [Carrinho(cliente=None) for _ in range(5)]
+        for carrinho in antigos:
+            carrinho.data_alteracao -= timedelta(hours=2)
+            armazem.save(carrinho)
+        novos = [Carrinho(cliente=None) for _ in range(3)]
+        for carrinho in novos:
+            armazem.save(carrinho)
+        percurso = armazem.percorre(lote=2)
+        self.assertIs(next(percurso), antigos[0])
+        # Removido durante o percurso: não é incluído.
+        armazem.delete(antigos[3].codigo)
+        self.assertEqual([antigos[0]] + list(percurso), antigos[:3] + antigos[4:] + novos)
+        limite = (datetime.now() - timedelta(hours=1)).timestamp()
+        self.assertEqual(list(armazem.percorre(limite)), antigos[:3] + antigos[4:])
+
+    def test_indice_clientes(self):
+        "Testa o índice de clientes nas gravações, remoções e expirações"
+        armazem = CarrinhosMemoria(ttl=timedelta(hours=1), maximo=3)
+        carrinhos = [Carrinho(cliente=123456) for _ in range(3)]
+        for carrinho in carrinhos:
+            armazem.save(carrinho)
+        self.assertCountEqual(armazem.do_cliente("123456"), carrinhos)
+        carrinhos[0].define_cliente(654321)
+        armazem.save(carrinhos[0])
+        self.assertEqual(armazem.do_cliente("654321"), carrinhos[:1])
+        armazem.delete(carrinhos[1].codigo)
+        self.assertEqual(armazem.do_cliente("123456"), carrinhos[2:])
+        # Expira pelo TTL ao ser obtido e descarta o mais antigo pelo tamanho máximo.
+        carrinhos[2].data_alteracao -= timedelta(hours=2)
+        with self.assertRaises(CarrinhoNaoExisteError):
+            armazem.fetch(carrinhos[2].codigo)
+        for _ in range(3):
+            armazem.save(Carrinho(cliente=None))
+        self.assertEqual(armazem.do_cliente("123456"), [])
+        self.assertEqual(armazem.do_cliente("654321"), [])
+        self.assertEqual(armazem._clientes, {})
+        self.assertEqual(armazem._cliente_indexado, {})
+
+    def test_indice_produtos(self):
+        "Testa o índice de produtos nas gravações, remoções e expirações"
+        armazem = CarrinhosMemoria(ttl=timedelta(hours=1))
+        carrinhos = [Carrinho(cliente=None) for _ in range(3)]
+        for carrinho, produtos in zip(carrinhos, ("AB", "BC", "")):
+            for codigo in produtos:
+                carrinho.adiciona_produto(_produto_teste(codigo))
+            armazem.save(carrinho)
+        codigos = [carrinho.codigo for carrinho in carrinhos]
+        self.assertEqual(armazem.com_produtos(["A"]), codigos[:1])
+        self.assertCountEqual(armazem.com_produtos(["B", "X"]), codigos[:2])
+        carrinhos[0].remove_produto("A")
+        carrinhos[2].adiciona_produto(_produto_teste("A"))
+        # O índice só muda ao gravar o carrinho.
+        self.assertEqual(armazem.com_produtos(["A"]), codigos[:1])
+        armazem.save(carrinhos[0])
+        armazem.save(carrinhos[2])
+        self.assertEqual(armazem.com_produtos(["A"]), codigos[2:])
+        armazem.delete(codigos[1])
+        self.assertEqual(armazem.com_produtos(["B", "C"]), codigos[:1])
+        carrinhos[0].data_alteracao -= timedelta(hours=2)
+        self.assertEqual(armazem.com_produtos(["B"]), [])
+        with self.assertRaises(CarrinhoNaoExisteError):
+            armazem.fetch(codigos[0])
+        self.assertEqual(armazem._produtos, {"A": {carrinhos[2].chave}})
+        self.assertEqual(armazem._produtos_indexados, {carrinhos[2].chave: ("A",)})
+
+    def test_gravacao_sem_alterar_data(self):
+        "Testa que um carrinho gravado sem alterar a data mantém a posição na expiração"
+        armazem = CarrinhosMemoria(ttl=timedelta(hours=1))
+        carrinhos = [Carrinho(cliente=None) for _ in range(2)]
+        for carrinho in carrinhos:
+            armazem.save(carrinho)
+        armazem.save(carrinhos[0])
+        self.assertEqual(list(armazem.percorre()), carrinhos)
+
+    def test_percorre_com_gravacoes(self):
+        "Testa o percurso dos carrinhos com a fila alterada entre os lotes"
+        armazem = CarrinhosMemoria(maximo=5)
+        carrinhos = [Carrinho(cliente=None) for _ in range(5)]
+        for carrinho in carrinhos:
+            armazem.save(carrinho)
+        percurso = armazem.percorre(lote=2)
+        self.assertEqual([next(percurso), next(percurso)], carrinhos[:2])
+        self.assertEqual(len(armazem._percursos), 1)
+        # Reordenado (já percorrido), descartado pelo tamanho máximo e incluído depois
+        # do início do percurso: as chaves restantes são copiadas uma única vez.
+        carrinhos[0].data_alteracao += timedelta(seconds=1)
+        armazem.save(carrinhos[0])
+        armazem.save(Carrinho(cliente=None))
+        armazem.save(Carrinho(cliente=None))
+        self.assertEqual(list(percurso), carrinhos[3:])
+        self.assertEqual(armazem._percursos, set())
+
+
+class TestPersistCarrinhosFragmentados(unittest.TestCase):
+    def test_fragmentos(self):
+        "Testa gravação, leitura, remoção e expiração dos carrinhos em fragmentos"
+        armazem = CarrinhosFragmentados(4, ttl=timedelta(hours=1))
+        removidos = []
+        armazem.ao_remover = removidos.append
+        carrinhos = [Carrinho(cliente=None) for _ in range(20)]
+        for carrinho in carrinhos:
+            armazem.save(carrinho)
+        self.assertEqual(len(armazem), 20)
+        self.assertTrue(all(len(fragmento) for fragmento in armazem._fragmentos))
+        for carrinho in carrinhos:
+            self.assertIs(armazem.fetch(carrinho.codigo), carrinho)
+        armazem.delete(carrinhos[0].codigo)
+        with self.assertRaises(CarrinhoNaoExisteError):
+            armazem.fetch(carrinhos[0].codigo)
+        with self.assertRaises(CarrinhoNaoExisteError):
+            armazem.fetch("invalido")
+        carrinhos[1].data_alteracao -= timedelta(hours=2)
+        armazem.save(carrinhos[1])
+        with self.assertRaises(CarrinhoNaoExisteError):
+            armazem.fetch(carrinhos[1].codigo)
+        self.assertEqual(removidos, carrinhos[:2])
+        self.assertEqual(
+            armazem.estatisticas(), {"carrinhos": 18, "expirados": 1, "descartados": 0}
+        )
+
+    def test_indice_clientes(self):
+        "Testa a consulta dos carrinhos de um cliente em todos os fragmentos"
+        armazem = CarrinhosFragmentados(4)
+        carrinhos = [Carrinho(cliente=123456) for _ in range(8)]
+        for carrinho in carrinhos:
+            armazem.save(carrinho)
+        self.assertCountEqual(armazem.do_cliente("123456"), carrinhos)
+
+    def test_indice_produtos(self):
+        "Testa a consulta dos carrinhos com um produto em todos os fragmentos"
+        armazem = CarrinhosFragmentados(4)
+        carrinhos = [Carrinho(cliente=None) for _ in range(8)]
+        for carrinho in carrinhos:
+            carrinho.adiciona_produto(_produto_teste("A"))
+            armazem.save(carrinho)
+        self.assertCountEqual(
+            armazem.com_produtos(iter(["A"])), [c.codigo for c in carrinhos]
+        )
+
+    def test_maximo(self):
+        "Testa que o tamanho máximo é dividido entre os fragmentos"
+        armazem = CarrinhosFragmentados(2, maximo=3)
+        for _ in range(20):
+            armazem.save(Carrinho(cliente=None))
+        self.assertEqual(len(armazem), 4)
+        self.assertEqual(armazem.estatisticas()["descartados"], 16)
+
+
+class TestPersistCarrinhosSQLite(unittest.TestCase):
+    def setUp(self):
+        self.diretorio = tempfile.TemporaryDirectory()
+        self.caminho = os.path.join(self.diretorio.name, "carrinhos.db")
+
+    def tearDown(self):
+        self.diretorio.cleanup()
+
+    def _carrinho(self) -> Carrinho:
+        carrinho = Carrinho(cliente=123456)
+        carrinho.adiciona_produto(
+            Produto(
+                codigo="AB1234567",
+                descricao="Camiseta Pólo",
+                preco_de=17000,
+                preco_por=16990,
+                quantidade=2,
+            )
+        )
+        carrinho.define_cupom_desconto(Cupom(codigo="VALE10", valor=1000))
+        return carrinho
+
+    def test_serializa(self):
+        "Testa a serialização compacta do carrinho"
+        carrinho = self._carrinho()
+        copia = Carrinho.desserializa(carrinho.serializa())
+        self.assertEqual(copia.codigo, carrinho.codigo)
+        self.assertEqual(copia.versao, carrinho.versao)
+        self.assertEqual(copia.cliente, 123456)
+        self.assertEqual(copia.data_alteracao, carrinho.data_alteracao)
+        self.assertEqual(copia.produtos, carrinho.produtos)
+        self.assertEqual(copia.cupom, carrinho.cupom)
+        self.assertEqual(copia.totais, carrinho.totais)
+
+    def test_compartilhado(self):
+        "Testa que carrinhos gravados por um processo são vistos por outro"
+        backend_a = CarrinhosSQLite(self.caminho)
+        backend_b = CarrinhosSQLite(self.caminho)
+        carrinho = self._carrinho()
+        backend_a.save(carrinho)
+        self.assertEqual(backend_b.fetch(carrinho.codigo).totais.total, 32980)
+        backend_b.delete(carrinho.codigo)
+        with self.assertRaises(CarrinhoNaoExisteError):
+            backend_a.fetch(carrinho.codigo)
+        with self.assertRaises(CarrinhoNaoExisteError):
+            backend_a.delete(carrinho.codigo)
+
+    def test_gravacao_condicional(self):
+        "Testa que a gravação condicional detecta alterações de outro processo"
+        backend_a = CarrinhosSQLite(self.caminho)
+        backend_b = CarrinhosSQLite(self.caminho)
+        carrinho = self._carrinho()
+        backend_a.save(carrinho)
+        carrinho_a = backend_a.fetch(carrinho.codigo)
+        carrinho_b = backend_b.fetch(carrinho.codigo)
+        versao = carrinho_a.versao
+        carrinho_a.define_cliente(1)
+        backend_a.save(carrinho_a, versao_anterior=versao)
+        carrinho_b.define_cliente(2)
+        with self.assertRaises(CarrinhoVersaoConflitoError):
+            backend_b.save(carrinho_b, versao_anterior=versao)
+        self.assertEqual(backend_b.fetch(carrinho.codigo).cliente, 1)
+        # A remoção condicional também.
+        with self.assertRaises(CarrinhoVersaoConflitoError):
+            backend_b.delete(carrinho.codigo, versao=versao)
+        backend_b.delete(carrinho.codigo, versao=carrinho_a.versao)
+        with self.assertRaises(CarrinhoNaoExisteError):
+            backend_a.delete(carrinho.codigo, versao=carrinho_a.versao)
+
+    def test_reservas_compartilhadas(self):
+        "Testa as reservas de estoque no SQLite, compartilhadas entre processos"
+        backend_a = CarrinhosSQLite(self.caminho)
+        backend_b = CarrinhosSQLite(self.caminho)
+        carrinho_a = self._carrinho()
+        backend_a.save(carrinho_a, estoques={"AB1234567": 3})
+        self.assertEqual(backend_b.reservado("AB1234567"), 2)
+        carrinho_b = self._carrinho()
+        with self.assertRaisesRegex(ProdutoSemEstoqueError, "disponível: 1, pedido: 2"):
+            backend_b.save(carrinho_b, estoques={"AB1234567": 3})
+        with self.assertRaises(CarrinhoNaoExisteError):
+            backend_a.fetch(carrinho_b.codigo)
+        self.assertEqual(backend_a.reservado("AB1234567"), 2)
+        # Sem conferir o estoque (ex: reservas transferidas na mescla).
+        backend_b.save(carrinho_b)
+        self.assertEqual(backend_a.reservado("AB1234567"), 4)
+        backend_b.delete(carrinho_a.codigo)
+        self.assertEqual(backend_a.reservado("AB1234567"), 2)
+
+    def test_expira_ttl(self):
+        "Testa expiração dos carrinhos no SQLite"
+        backend = CarrinhosSQLite(self.caminho, ttl=timedelta(hours=1))
+        antigo = self._carrinho()
+        antigo.data_alteracao -= timedelta(hours=2)
+        backend.save(antigo)
+        backend.save(self._carrinho())
+        with self.assertRaises(CarrinhoNaoExisteError):
+            backend.fetch(antigo.codigo)
+        self.assertEqual(backend.expira(), 1)
+        self.assertEqual(
+            backend.estatisticas(), {"carrinhos": 1, "expirados": 1, "descartados": 0}
+        )
+
+    def test_percorre(self):
+        "Testa o percurso dos carrinhos do SQLite em lotes pela chave"
+        backend = CarrinhosSQLite(self.caminho, ttl=timedelta(hours=3))
+        carrinhos = [self._carrinho() for _ in range(5)]
+        carrinhos[0].data_alteracao -= timedelta(hours=4)
+        carrinhos[1].data_alteracao -= timedelta(hours=2)
+        for carrinho in carrinhos:
+            backend.save(carrinho)
+        percorridos = list(backend.percorre(lote=2))
+        self.assertEqual(
+            [carrinho.codigo for carrinho in percorridos],
+            sorted(carrinho.codigo for carrinho in carrinhos[1:]),
+        )
+        self.assertEqual(percorridos[0].totais.total, 32980)
+        limite = (datetime.now() - timedelta(hours=1)).timestamp()
+        self.assertEqual(
+            [carrinho.codigo for carrinho in backend.percorre(limite)],
+            [carrinhos[1].codigo],
+        )
+
+    def test_funcoes_assincronas(self):
+        "Testa as versões assíncronas das funções de persistência com o SQLite"
+        self.addCleanup(db_carrinho_define_backend, carrinhos._CARRINHOS)
+        db_carrinho_define_backend(CarrinhosSQLite(self.caminho))
+        carrinho = self._carrinho()
+
+        async def altera():
+            await db_carrinho_save_async(carrinho)
+            gravado = await db_carrinho_fetch_async(carrinho.codigo)
+            gravado.define_cupom_desconto(await db_cupom_fetch_async("BLACKFRIDAY15"))
+            await db_carrinho_save_async(gravado, versao_anterior=carrinho.versao)
+            with self.assertRaises(CarrinhoVersaoConflitoError):
+                await db_carrinho_save_async(carrinho, versao_anterior=carrinho.versao)
+            produto = await db_produto_fetch_async("CD7654321")
+            await db_carrinho_delete_async(carrinho.codigo)
+            return gravado, produto
+
+        gravado, produto = asyncio.run(altera())
+        self.assertEqual(gravado.cupom.codigo, "BLACKFRIDAY15")
+        self.assertEqual(produto.codigo, "CD7654321")
+        with self.assertRaises(CarrinhoNaoExisteError):
+            CarrinhosSQLite(self.caminho).fetch(carrinho.codigo)
+
+    def test_indice_clientes(self):
+        "Testa o índice de clientes no SQLite"
+        backend = CarrinhosSQLite(self.caminho)
+        antigo = self._carrinho()
+        backend.save(antigo)
+        novo = self._carrinho()
+        backend.save(novo)
+        self.assertEqual(
+            sorted(carrinho.codigo for carrinho in backend.do_cliente("123456")),
+            sorted([antigo.codigo, novo.codigo]),
+        )
+        novo.define_cliente(None)
+        backend.save(novo, versao_anterior=novo.versao - 1)
+        self.assertEqual(
+            [carrinho.codigo for carrinho in backend.do_cliente("123456")],
+            [antigo.codigo],
+        )
+
+    def test_indice_produtos(self):
+        "Testa o índice de produtos no SQLite"
+        backend = CarrinhosSQLite(self.caminho, ttl=timedelta(hours=1))
+        antigo = self._carrinho()
+        backend.save(antigo)
+        conexao = backend._conexao()
+        self.assertEqual(backend.com_produtos(["AB1234567"]), [antigo.codigo])
+        novo = self._carrinho()
+        novo.adiciona_produto(_produto_teste("X1"))
+        backend.save(novo)
+        self.assertCountEqual(
+            backend.com_produtos(["AB1234567", "X1"]), [antigo.codigo, novo.codigo]
+        )
+        novo.remove_produto("AB1234567")
+        backend.save(novo, versao_anterior=novo.versao - 1)
+        self.assertEqual(backend.com_produtos(["AB1234567"]), [antigo.codigo])
+        # Mais produtos que o limite de parâmetros de uma consulta.
+        self.assertEqual(
+            backend.com_produtos(["P{}".format(i) for i in range(2000)] + ["X1"]),
+            [novo.codigo],
+        )
+        backend.delete(antigo.codigo)
+        self.assertEqual(backend.com_produtos(["AB1234567"]), [])
+        novo.data_alteracao -= timedelta(hours=2)
+        backend.save(novo)
+        self.assertEqual(backend.com_produtos(["X1"]), [])
+        backend.expira()
+        self.assertEqual(
+            conexao.execute("SELECT COUNT(*) FROM carrinhos_produtos").fetchone(), (0,)
+        )
+
+
+class TestPersistCarrinhosDiario(unittest.TestCase):
+    def setUp(self):
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        self.diretorio = diretorio.name
+
+    def _backend(self, **parametros) -> CarrinhosDiario:
+        backend = CarrinhosDiario(self.diretorio, **parametros)
+        self.addCleanup(backend.fecha)
+        return backend
+
+    def _carrinho(self) -> Carrinho:
+        carrinho = Carrinho(cliente=123456)
+        carrinho.adiciona_produto(
+            Produto(
+                codigo="AB1234567",
+                descricao=None,
+                preco_de=17000,
+                preco_por=16990,
+                quantidade=2,
+            )
+        )
+        return carrinho
+
+    def test_restaura(self):
+        "Testa a recuperação dos carrinhos gravados e removidos pelo diário"
+        backend = self._backend()
+        self.assertEqual(backend.restaura(), 0)
+        carrinho = self._carrinho()
+        backend.save(carrinho)
+        carrinho.define_produto_quantidade("AB1234567", 3)
+        backend.save(carrinho)
+        removido = self._carrinho()
+        backend.save(removido)
+        backend.delete(removido.codigo)
+        backend.fecha()
+
+        restaurados = []
+        backend = self._backend()
+        backend.ao_restaurar = restaurados.append
+        self.assertEqual(backend.restaura(), 1)
+        copia = backend.fetch(carrinho.codigo)
+        self.assertEqual(copia.versao, carrinho.versao)
+        self.assertEqual(copia.produtos["AB1234567"].quantidade, 3)
+        self.assertEqual(copia.totais, carrinho.totais)
+        self.assertEqual(restaurados, [copia])
+        self.assertEqual(backend.com_produtos(["AB1234567"]), [carrinho.codigo])
+        with self.assertRaises(CarrinhoNaoExisteError):
+            backend.fetch(removido.codigo)
+
+    def test_compacta(self):
+        "Testa o snapshot, a remoção dos segmentos e um registro incompleto no final"
+        backend = self._backend(duravel=False)
+        backend.restaura()
+        carrinhos = [self._carrinho() for _ in range(3)]
+        for carrinho in carrinhos:
+            backend.save(carrinho)
+        backend.compacta()
+        backend.delete(carrinhos[0].codigo)
+        carrinhos[1].define_cliente(1)
+        backend.save(carrinhos[1])
+        backend.fecha()
+        arquivos = sorted(os.listdir(self.diretorio))
+        self.assertIn("snapshot", arquivos)
+        self.assertNotIn("diario-000000000001.log", arquivos)
+        # Gravação interrompida no meio de um registro.
+        with open(os.path.join(self.diretorio, arquivos[0]), "ab") as arquivo:
+            arquivo.write(b"\x10\x00\x00")
+
+        backend = self._backend()
+        self.assertEqual(backend.restaura(), 2)
+        self.assertEqual(backend.fetch(carrinhos[1].codigo).cliente, 1)
+        self.assertEqual(backend.fetch(carrinhos[2].codigo).cliente, 123456)
+
+    def test_compacta_sem_trava(self):
+        "Testa que a compactação não faz fsync com a trava dos carrinhos"
+        backend = self._backend()
+        self.assertTrue(backend.bloqueante)
+        self.assertFalse(CarrinhosDiario(self.diretorio, duravel=False).bloqueante)
+        backend.restaura()
+        for _ in range(3):
+            backend.save(self._carrinho())
+        livre = []
+        fsync = os.fsync
+
+        def sonda():
+            # A trava é reentrante: a tentativa é feita por outra thread.
+            if backend._lock.acquire(blocking=False):
+                backend._lock.release()
+                livre.append(True)
+            else:
+                livre.append(False)
+
+        def fsync_com_sonda(descritor):
+            thread = threading.Thread(target=sonda)
+            thread.start()
+            thread.join()
+            fsync(descritor)
+
+        with mock.patch("os.fsync", fsync_com_sonda):
+            backend.compacta()
+        self.assertTrue(livre)
+        self.assertTrue(all(livre))
+        backend.fecha()
+        self.assertEqual(self._backend().restaura(), 3)
+
+    def test_expira_e_trava(self):
+        "Testa a expiração ao restaurar e o uso do diário por um único processo"
+        backend = self._backend()
+        backend.restaura()
+        antigo = self._carrinho()
+        antigo.data_alteracao -= timedelta(hours=2)
+        backend.save(antigo)
+        backend.save(self._carrinho())
+        with self.assertRaises(RuntimeError):
+            self._backend().restaura()
+        backend.fecha()
+
+        backend = self._backend(ttl=timedelta(hours=1))
+        self.assertEqual(backend.restaura(), 1)
+        with self.assertRaises(CarrinhoNaoExisteError):
+            backend.fetch(antigo.codigo)
+
+
+def _token_admin(teste):
+    """
+    Ativa as rotas administrativas com um token restaurado ao final do teste, retornando
+    os cabeçalhos das requisições autenticadas.
+    """
+    teste.addCleanup(admin.define_token, admin._TOKEN)
+    admin.define_token("token-de-teste")
+    return {"Authorization": "Bearer token-de-teste"}
+
+
+def _carrinhos_exportacao(teste):
+    """
+    Cria carrinhos para os testes de exportação, em um armazenamento próprio restaurado
+    ao final do teste: um sem cliente alterado há dois dias e três com cliente, o
+    primeiro deles com um produto.
+    """
+    teste.addCleanup(db_carrinho_define_backend, carrinhos._CARRINHOS)
+    db_carrinho_define_backend(CarrinhosMemoria())
+    cliente = app.test_client()
+    antigo = Carrinho(cliente=None)
+    antigo.data_alteracao -= timedelta(days=2)
+    db_carrinho_save(antigo)
+    codigos = [antigo.codigo]
+    for numero in range(3):
+        codigo = cliente.post("/novo", data={"cliente": numero}).json["dados"][
+            "carrinho_codigo"
+        ]
+        # Remove os carrinhos antes de restaurar o armazenamento, liberando o
+        # estoque reservado.
+        teste.addCleanup(db_carrinho_delete, codigo)
+        codigos.append(codigo)
+    cliente.post(
+        "/produto-adiciona", data={"carrinho": codigos[1], "produto": "ZZ0000000"}
+    )
+    return codigos
+
+
+class TestApp(unittest.TestCase):
+    def setUp(self):
+        self.cliente = app.test_client()
+        self.carrinho = self.cliente.post("/novo").json["dados"]["carrinho_codigo"]
+        # Remove o carrinho ao final, liberando o estoque reservado por ele.
+        self.addCleanup(db_carrinho_delete, self.carrinho)
+        # Produto com estoque suficiente para os testes de concorrência.
+        _PRODUTOS["ZZ0000000"] = ProdutoPersisted(
+            codigo="ZZ0000000",
+            descricao="Produto Teste",
+            preco_de=17000,
+            preco_por=17000,
+            estoque=1000,
+        )
+        self.addCleanup(_PRODUTOS.pop, "ZZ0000000")
+
+    def test_operacoes(self):
+        "Testa aplicação de operações em lote no carrinho"
+        res = self.cliente.post(
+            "/carrinho/{}/operacoes".format(self.carrinho),
+            json=[
+                {"operacao": "cliente-define", "cliente": 123456},
+                {"operacao": "produto-adiciona", "produto": "AB1234567"},
+                {"operacao": "produto-adiciona", "produto": "CD7654321"},
+                {
+                    "operacao": "produto-define-quantidade",
+                    "produto": "CD7654321",
+                    "quantidade": 2,
+                },
+                {"operacao": "cupom-define", "cupom": "VALE10"},
+            ],
+        ).json
+        self.assertTrue(res["sucesso"])
+        self.assertEqual(res["dados"]["cliente"], 123456)
+        self.assertEqual(len(res["dados"]["produtos"]), 2)
+        self.assertEqual(res["dados"]["totais"], {"subtotal": 670.0, "total": 660.0})
+        dados = self.cliente.get("/carrinho/{}".format(self.carrinho)).json["dados"]
+        self.assertEqual(dados, res["dados"])
+
+    def test_cliente_e_mescla(self):
+        "Testa a consulta dos carrinhos do cliente e a mescla ao fazer login"
+        cliente = str(time.time_ns())
+        anterior = self.cliente.post("/novo", data={"cliente": cliente}).json["dados"][
+            "carrinho_codigo"
+        ]
+        for carrinho, produto in (
+            (anterior, "ZZ0000000"),
+            (self.carrinho, "ZZ0000000"),
+            (self.carrinho, "AB1234567"),
+        ):
+            self.cliente.post(
+                "/produto-adiciona", data={"carrinho": carrinho, "produto": produto}
+            )
+        url = "/cliente/{}/carrinhos".format(cliente)
+        res = self.cliente.get(url)
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res.json["erro"]["tipo"], "AcessoNegadoError")
+        cabecalhos = _token_admin(self)
+        res = self.cliente.get(url, headers=cabecalhos).json
+        self.assertEqual(
+            res["dados"]["carrinhos"],
+            [self.cliente.get("/carrinho/{}".format(anterior)).json["dados"]],
+        )
+        mescla = "/carrinho/{}/mescla".format(self.carrinho)
+        res = self.cliente.post(mescla, data={"origem": anterior}).json
+        self.assertEqual(res["erro"]["tipo"], "BadRequestKeyError")
+        res = self.cliente.post(mescla, data={"origem": anterior, "cliente": "1"}).json
+        self.assertEqual(res["erro"]["tipo"], "OperacaoInvalidaError")
+        res = self.cliente.post(
+            mescla, data={"origem": anterior, "cliente": cliente}
+        ).json
+        self.assertEqual(res["dados"]["cliente"], cliente)
+        quantidades = {p["codigo"]: p["quantidade"] for p in res["dados"]["produtos"]}
+        self.assertEqual(quantidades, {"ZZ0000000": 2, "AB1234567": 1})
+        # As reservas da origem foram transferidas, e não liberadas.
+        self.assertEqual(db_estoque_disponivel("ZZ0000000"), 998)
+        res = self.cliente.get("/carrinho/{}".format(anterior)).json
+        self.assertEqual(res["erro"]["tipo"], "CarrinhoNaoExisteError")
+        res = self.cliente.get(url, headers=cabecalhos).json
+        self.assertEqual(
+            [c["codigo"] for c in res["dados"]["carrinhos"]], [self.carrinho]
+        )
+        res = self.cliente.post(
+            mescla, data={"origem": self.carrinho, "cliente": cliente}
+        ).json
+        self.assertEqual(res["erro"]["tipo"], "OperacaoInvalidaError")
+
+    def test_mescla_conflitos(self):
+        "Testa a mescla com a origem ou o destino alterados por outro processo"
+        origem = self.cliente.post("/novo").json["dados"]["carrinho_codigo"]
+        self.addCleanup(db_carrinho_delete, origem)
+        self.cliente.post(
+            "/produto-adiciona", data={"carrinho": origem, "produto": "ZZ0000000"}
+        )
+        versao = self.cliente.get("/carrinho/{}".format(origem)).json["dados"]["versao"]
+        obtem = carrinhos.db_carrinho_fetch
+
+        def obtem_alterado(codigo):
+            # Cópia da origem lida antes de outro processo alterá-la.
+            carrinho = obtem(codigo)
+            if codigo == origem:
+                carrinho = Carrinho.desserializa(carrinho.serializa(), carrinho.chave)
+                carrinho.versao = versao - 1
+            return carrinho
+
+        with mock.patch("api_carrinho.app.db_carrinho_fetch", obtem_alterado):
+            res = self.cliente.post(
+                "/carrinho/{}/mescla".format(self.carrinho),
+                data={"origem": origem, "cliente": ""},
+            )
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(res.json["erro"]["tipo"], "MesclaConflitoError")
+        # Nenhum dos carrinhos foi alterado, e as reservas foram mantidas.
+        res = self.cliente.get("/carrinho/{}".format(origem)).json
+        self.assertEqual(res["dados"]["versao"], versao)
+        res = self.cliente.get("/carrinho/{}".format(self.carrinho)).json
+        self.assertEqual(res["dados"]["produtos"], [])
+        self.assertEqual(db_estoque_disponivel("ZZ0000000"), 999)
+        grava = carrinhos.db_carrinho_save
+
+        def grava_destino_alterado(carrinho, **kwargs):
+            if carrinho.codigo == self.carrinho:
+                raise CarrinhoVersaoConflitoError("destino alterado")
+            grava(carrinho, **kwargs)
+
+        # A origem já removida é recriada, com suas reservas.
+        with mock.patch("api_carrinho.app.db_carrinho_save", grava_destino_alterado):
+            res = self.cliente.post(
+                "/carrinho/{}/mescla".format(self.carrinho),
+                data={"origem": origem, "cliente": ""},
+            ).json
+        self.assertEqual(res["erro"]["tipo"], "CarrinhoVersaoConflitoError")
+        res = self.cliente.get("/carrinho/{}".format(origem)).json
+        self.assertEqual(res["dados"]["versao"], versao)
+        res = self.cliente.get("/carrinho/{}".format(self.carrinho)).json
+        self.assertEqual(res["dados"]["produtos"], [])
+        self.assertEqual(db_estoque_disponivel("ZZ0000000"), 999)
+
+    def test_cupons(self):
+        "Testa os cupons aplicáveis ao carrinho e o desconto de um cupom percentual"
+        self.cliente.post(
+            "/produto-adiciona", data={"carrinho": self.carrinho, "produto": "AB1234567"}
+        )
+        url = "/carrinho/{}/cupons".format(self.carrinho)
+        self.assertEqual(
+            self.cliente.get(url).json["dados"]["cupons"],
+            [
+                {"codigo": "CAMISETA20", "desconto": 34.0},
+                {"codigo": "BLACKFRIDAY15", "desconto": 15.0},
+                {"codigo": "VALE10", "desconto": 10.0},
+            ],
+        )
+        self.cliente.post(
+            "/cupom-define", data={"carrinho": self.carrinho, "cupom": "CAMISETA20"}
+        )
+        dados = self.cliente.get("/carrinho/{}".format(self.carrinho)).json["dados"]
+        self.assertEqual(dados["cupom"], {"codigo": "CAMISETA20", "valor": 34.0})
+        self.assertEqual(dados["totais"], {"subtotal": 170.0, "total": 136.0})
+
+    def test_cupom_expira_em_cache(self):
+        "Testa que a resposta em cache e o ETag mudam quando o cupom expira"
+        self.cliente.post(
+            "/produto-adiciona", data={"carrinho": self.carrinho, "produto": "AB1234567"}
+        )
+        carrinho = carrinhos.db_carrinho_fetch(self.carrinho)
+        carrinho.define_cupom_desconto(
+            Cupom(codigo="PRAZO", valor=1000, validade=time.time() + 3600)
+        )
+        url = "/carrinho/{}".format(self.carrinho)
+        res = self.cliente.get(url)
+        self.assertEqual(res.json["dados"]["totais"], {"subtotal": 170.0, "total": 160.0})
+        etag = res.headers["ETag"]
+        self.assertEqual(
+            self.cliente.get(url, headers={"If-None-Match": etag}).status_code, 304
+        )
+        # O cupom expira sem alterar a versão do carrinho.
+        carrinho.cupom.validade = time.time() - 1
+        res = self.cliente.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json["dados"]["totais"], {"subtotal": 170.0, "total": 170.0})
+        self.assertEqual(res.json["dados"]["cupom"], {"codigo": "PRAZO", "valor": 0.0})
+        self.assertNotEqual(res.headers["ETag"], etag)
+        # O novo ETag continua valendo como a versão esperada em If-Match.
+        res = self.cliente.post(
+            "/limpa",
+            data={"carrinho": self.carrinho},
+            headers={"If-Match": res.headers["ETag"]},
+        )
+        self.assertTrue(res.json["sucesso"])
+
+    def test_precos(self):
+        "Testa a reprecificação dos carrinhos com um produto em lote"
+        cabecalhos = _token_admin(self)
+        _PRODUTOS["PRECO0001"] = ProdutoPersisted(
+            codigo="PRECO0001",
+            descricao="Produto Teste",
+            preco_de=10000,
+            preco_por=9000,
+            estoque=10,
+        )
+        self.addCleanup(_PRODUTOS.pop, "PRECO0001")
+        self.cliente.post(
+            "/produto-adiciona", data={"carrinho": self.carrinho, "produto": "PRECO0001"}
+        )
+        versao = self.cliente.get("/carrinho/{}".format(self.carrinho)).json["dados"][
+            "versao"
+        ]
+        lote = [
+            {"codigo": "PRECO0001", "preco_de": 100.0, "preco_por": 80.0},
+            {"codigo": "XX0000000", "preco_de": 1, "preco_por": 1},
+        ]
+        res = self.cliente.post("/produtos/precos", json=lote, headers=cabecalhos).json
+        self.assertEqual(
+            res["dados"], {"carrinhos_consultados": 1, "carrinhos_alterados": 1}
+        )
+        dados = self.cliente.get("/carrinho/{}".format(self.carrinho)).json["dados"]
+        self.assertEqual(dados["versao"], versao + 1)
+        self.assertEqual(dados["totais"], {"subtotal": 80.0, "total": 80.0})
+        res = self.cliente.post("/produtos/precos", json=lote, headers=cabecalhos).json
+        self.assertEqual(res["dados"]["carrinhos_alterados"], 0)
+        # O cadastro também tem o novo preço: um novo carrinho já o recebe.
+        outro = self.cliente.post("/novo").json["dados"]["carrinho_codigo"]
+        self.addCleanup(db_carrinho_delete, outro)
+        self.cliente.post(
+            "/produto-adiciona", data={"carrinho": outro, "produto": "PRECO0001"}
+        )
+        dados = self.cliente.get("/carrinho/{}".format(outro)).json["dados"]
+        self.assertEqual(dados["totais"], {"subtotal": 80.0, "total": 80.0})
+        self.assertNotIn("XX0000000", _PRODUTOS)
+        res = self.cliente.post(
+            "/produtos/precos", json=[{"codigo": "PRECO0001"}], headers=cabecalhos
+        ).json
+        self.assertEqual(res["erro"]["tipo"], "PrecosInvalidosError")
+
+    def test_precos_sem_autenticacao(self):
+        "Testa que a reprecificação recusa requisições sem o token de administração"
+        lote = [{"codigo": "AB1234567", "preco_de": 0, "preco_por": 0}]
+        for cabecalhos in ({}, {"Authorization": "Bearer errado"}):
+            res = self.cliente.post("/produtos/precos", json=lote, headers=cabecalhos)
+            self.assertEqual(res.status_code, 401)
+            self.assertEqual(res.json["erro"]["tipo"], "AcessoNegadoError")
+        # Sem ADMIN_TOKEN, a rota fica desativada.
+        cabecalhos = _token_admin(self)
+        admin.define_token(None)
+        res = self.cliente.post("/produtos/precos", json=lote, headers=cabecalhos)
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(_PRODUTOS["AB1234567"].preco_por, 17000)
+
+    def test_exporta(self):
+        "Testa a exportação de carrinhos em JSON delimitado por linhas"
+        codigos = _carrinhos_exportacao(self)
+        cabecalhos = _token_admin(self)
+
+        def exporta(filtro):
+            res = self.cliente.post("/carrinhos/exporta", json=filtro, headers=cabecalhos)
+            self.assertEqual(res.mimetype, "application/x-ndjson")
+            return [json.loads(linha) for linha in res.data.splitlines()]
+
+        linhas = exporta({"carrinhos": [codigos[1], "inexistente", codigos[3]]})
+        self.assertEqual(
+            linhas,
+            [
+                self.cliente.get("/carrinho/{}".format(codigo)).json["dados"]
+                for codigo in (codigos[1], codigos[3])
+            ],
+        )
+        self.assertEqual(linhas[0]["produtos"][0]["descricao"], "Produto Teste")
+        self.assertEqual(
+            sorted(linha["codigo"] for linha in exporta({})), sorted(codigos)
+        )
+        alterado_antes = (datetime.now() - timedelta(days=1)).isoformat()
+        self.assertEqual(
+            [linha["codigo"] for linha in exporta({"alterado_antes": alterado_antes})],
+            codigos[:1],
+        )
+        self.assertEqual(
+            sorted(linha["codigo"] for linha in exporta({"com_cliente": True})),
+            sorted(codigos[1:]),
+        )
+        res = self.cliente.post(
+            "/carrinhos/exporta", json={"com_cliente": "sim"}, headers=cabecalhos
+        ).json
+        self.assertEqual(res["erro"]["tipo"], "FiltroInvalidoError")
+        # Sem o token de administração, nenhum carrinho é exportado.
+        res = self.cliente.post("/carrinhos/exporta", json={})
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res.json["erro"]["tipo"], "AcessoNegadoError")
+
+    def test_corpo_json(self):
+        "Testa os parâmetros enviados em JSON em vez de formulário"
+        res = self.cliente.post(
+            "/produto-adiciona", json={"carrinho": self.carrinho, "produto": "AB1234567"}
+        ).json
+        self.assertTrue(res["sucesso"])
+        versao = self.cliente.get("/carrinho/{}".format(self.carrinho)).json["dados"][
+            "versao"
+        ]
+        parametros = {"carrinho": self.carrinho, "produto": "AB1234567", "quantidade": 2}
+        res = self.cliente.post(
+            "/produto-define-quantidade", json=dict(parametros, versao=versao - 1)
+        ).json
+        self.assertEqual(res["erro"]["tipo"], "CarrinhoVersaoConflitoError")
+        res = self.cliente.post(
+            "/produto-define-quantidade", json=dict(parametros, versao=versao)
+        ).json
+        self.assertTrue(res["sucesso"])
+        res = self.cliente.post("/cliente-define", json={"carrinho": self.carrinho}).json
+        self.assertEqual(res["erro"]["tipo"], "BadRequestKeyError")
+        res = self.cliente.post("/limpa", data="{", content_type="application/json").json
+        self.assertEqual(res["erro"]["tipo"], "BadRequest")
+        res = self.cliente.get("/carrinho/{}".format(self.carrinho))
+        self.assertEqual(res.json["dados"]["produtos"][0]["quantidade"], 2)
+        # Serialização em UTF-8, com as chaves ordenadas e sem espaços.
+        self.assertIn('"descricao":"Camiseta Pólo"'.encode(), res.data)
+
+    def test_descricao_do_cadastro(self):
+        "Testa que a descrição dos produtos é obtida do cadastro ao exibir o carrinho"
+        self.cliente.post(
+            "/produto-adiciona", data={"carrinho": self.carrinho, "produto": "ZZ0000000"}
+        )
+        _PRODUTOS["ZZ0000000"].descricao = "Produto Renomeado"
+        dados = self.cliente.get("/carrinho/{}".format(self.carrinho)).json["dados"]
+        self.assertEqual(dados["produtos"][0]["descricao"], "Produto Renomeado")
+
+    def test_operacoes_atomicas(self):
+        "Testa que nenhuma operação em lote é gravada caso uma delas falhe"
+        res = self.cliente.post(
+            "/carrinho/{}/operacoes".format(self.carrinho),
+            json=[
+                {"operacao": "produto-adiciona", "produto": "EF3567942"},
+                {
+                    "operacao": "produto-define-quantidade",
+                    "produto": "EF3567942",
+                    "quantidade": 2,
+                },
+            ],
+        ).json
+        self.assertFalse(res["sucesso"])
+        self.assertEqual(res["erro"]["tipo"], "ProdutoSemEstoqueError")
+        dados = self.cliente.get("/carrinho/{}".format(self.carrinho)).json["dados"]
+        self.assertEqual(dados["produtos"], [])
+
+    def test_operacoes_invalidas(self):
+        "Testa operações em lote desconhecidas ou com parâmetros faltando"
+        for operacoes in (
+            {},
+            [{"operacao": "explode"}],
+            [{"operacao": "produto-remove"}],
+        ):
+            res = self.cliente.post(
+                "/carrinho/{}/operacoes".format(self.carrinho), json=operacoes
+            ).json
+            self.assertEqual(res["erro"]["tipo"], "OperacaoInvalidaError")
+
+    def test_carrinho_etag(self):
+        "Testa ETag e If-None-Match na representação do carrinho"
+        url = "/carrinho/{}".format(self.carrinho)
+        res = self.cliente.get(url)
+        self.assertEqual(res.status_code, 200)
+        etag = res.headers["ETag"]
+        res = self.cliente.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b"")
+        self.cliente.post(
+            "/produto-adiciona", data={"carrinho": self.carrinho, "produto": "AB1234567"}
+        )
+        res = self.cliente.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers["ETag"], etag)
+        self.assertEqual(len(res.json["dados"]["produtos"]), 1)
+
+    def test_concorrencia(self):
+        "Testa alterações concorrentes em um mesmo carrinho a partir de várias threads"
+        threads, repeticoes = 16, 25
+        # Troca de thread mais frequente, para que as condições de corrida apareçam.
+        intervalo = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, intervalo)
+
+        def adiciona(_):
+            cliente = app.test_client()
+            for _ in range(repeticoes):
+                res = cliente.post(
+                    "/produto-adiciona",
+                    data={"carrinho": self.carrinho, "produto": "ZZ0000000"},
+                )
+                self.assertTrue(res.json["sucesso"])
+                cliente.get("/carrinho/{}".format(self.carrinho))
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(adiciona, range(threads)))
+        self.cliente.post(
+            "/cupom-define", data={"carrinho": self.carrinho, "cupom": "VALE10"}
+        )
+        dados = self.cliente.get("/carrinho/{}".format(self.carrinho)).json["dados"]
+        self.assertEqual(dados["produtos"][0]["quantidade"], threads * repeticoes)
+        self.assertEqual(db_estoque_disponivel("ZZ0000000"), 1000 - threads * repeticoes)
+        self.assertEqual(
+            dados["totais"],
+            {
+                "subtotal": threads * repeticoes * 170.0,
+                "total": threads * repeticoes * 170.0 - 10,
+            },
+        )
+
+    def test_versao(self):
+        "Testa alterações condicionais à versão do carrinho"
+        url = "/carrinho/{}".format(self.carrinho)
+        versao = self.cliente.get(url).json["dados"]["versao"]
+        dados = {"carrinho": self.carrinho, "produto": "AB1234567", "versao": versao}
+        self.assertTrue(
+            self.cliente.post("/produto-adiciona", data=dados).json["sucesso"]
+        )
+        res = self.cliente.post("/produto-adiciona", data=dados).json
+        self.assertEqual(res["erro"]["tipo"], "CarrinhoVersaoConflitoError")
+        etag = self.cliente.get(url).headers["ETag"]
+        res = self.cliente.post(
+            "/produto-remove",
+            data={"carrinho": self.carrinho, "produto": "AB1234567"},
+            headers={"If-Match": etag},
+        ).json
+        self.assertTrue(res["sucesso"])
+        res = self.cliente.post(
+            "/carrinho/{}/operacoes".format(self.carrinho),
+            json=[{"operacao": "limpa"}],
+            headers={"If-Match": etag},
+        ).json
+        self.assertEqual(res["erro"]["tipo"], "CarrinhoVersaoConflitoError")
+        self.assertEqual(self.cliente.get(url).json["dados"]["versao"], versao + 2)
+        # Versão malformada: status 400, sem alterar o carrinho.
+        for parametros, cabecalhos in (
+            ({"versao": "abc"}, {}),
+            ({"versao": "-1"}, {}),
+            ({}, {"If-Match": '"xyz"'}),
+        ):
+            res = self.cliente.post(
+                "/limpa",
+                data=dict(parametros, carrinho=self.carrinho),
+                headers=cabecalhos,
+            )
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(res.json["erro"]["tipo"], "VersaoInvalidaError")
+        res = self.cliente.post("/limpa", json={"carrinho": self.carrinho, "versao": 1.5})
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(self.cliente.get(url).json["dados"]["versao"], versao + 2)
+
+    def test_reserva_estoque(self):
+        "Testa reserva de estoque ao adicionar, alterar e remover produtos"
+        outro = self.cliente.post("/novo").json["dados"]["carrinho_codigo"]
+        self.addCleanup(db_carrinho_delete, outro)
+        disponivel = db_estoque_disponivel("EF3567942")
+        self.assertEqual(disponivel, 1)
+        dados = {"carrinho": self.carrinho, "produto": "EF3567942"}
+        self.assertTrue(
+            self.cliente.post("/produto-adiciona", data=dados).json["sucesso"]
+        )
+        self.assertEqual(db_estoque_disponivel("EF3567942"), 0)
+        res = self.cliente.post(
+            "/produto-adiciona", data={"carrinho": outro, "produto": "EF3567942"}
+        ).json
+        self.assertEqual(res["erro"]["tipo"], "ProdutoSemEstoqueError")
+        self.cliente.post("/produto-remove", data=dados)
+        self.assertEqual(db_estoque_disponivel("EF3567942"), 1)
+        dados = {"carrinho": self.carrinho, "produto": "CD7654321"}
+        self.cliente.post("/produto-adiciona", data=dados)
+        res = self.cliente.post(
+            "/produto-define-quantidade", data=dict(dados, quantidade=6)
+        ).json
+        self.assertEqual(res["erro"]["tipo"], "ProdutoSemEstoqueError")
+        self.assertEqual(db_estoque_disponivel("CD7654321"), 4)
+        self.cliente.post("/produto-define-quantidade", data=dict(dados, quantidade=5))
+        self.assertEqual(db_estoque_disponivel("CD7654321"), 0)
+        self.cliente.post("/produto-define-quantidade", data=dict(dados, quantidade=2))
+        self.assertEqual(db_estoque_disponivel("CD7654321"), 3)
+        self.cliente.post("/limpa", data={"carrinho": self.carrinho})
+        self.assertEqual(db_estoque_disponivel("CD7654321"), 5)
+
+    def test_reserva_estoque_carrinho_removido(self):
+        "Testa liberação do estoque reservado por um carrinho removido"
+        outro = self.cliente.post("/novo").json["dados"]["carrinho_codigo"]
+        self.cliente.post(
+            "/produto-adiciona", data={"carrinho": outro, "produto": "EF3567942"}
+        )
+        self.assertEqual(db_estoque_disponivel("EF3567942"), 0)
+        db_carrinho_delete(outro)
+        self.assertEqual(db_estoque_disponivel("EF3567942"), 1)
+
+    def test_reserva_estoque_compartilhada(self):
+        "Testa as reservas de estoque entre processos com o SQLite"
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        self.addCleanup(db_carrinho_define_backend, carrinhos._CARRINHOS)
+        caminho = os.path.join(diretorio.name, "carrinhos.db")
+        # Um backend e um livro de reservas por "processo", compartilhando o arquivo.
+        db_carrinho_define_backend(CarrinhosSQLite(caminho))
+        primeiro = self.cliente.post("/novo").json["dados"]["carrinho_codigo"]
+        dados = {"carrinho": primeiro, "produto": "EF3567942"}
+        self.assertTrue(
+            self.cliente.post("/produto-adiciona", data=dados).json["sucesso"]
+        )
+        db_carrinho_define_backend(CarrinhosSQLite(caminho))
+        livro = mock.patch("api_carrinho.persist.estoque._RESERVAS", ReservasEstoque())
+        livro.start()
+        self.addCleanup(livro.stop)
+        self.assertEqual(db_estoque_disponivel("EF3567942"), 0)
+        segundo = self.cliente.post("/novo").json["dados"]["carrinho_codigo"]
+        res = self.cliente.post(
+            "/produto-adiciona", data={"carrinho": segundo, "produto": "EF3567942"}
+        ).json
+        self.assertEqual(res["erro"]["tipo"], "ProdutoSemEstoqueError")
+        res = self.cliente.get("/carrinho/{}".format(segundo)).json
+        self.assertEqual(res["dados"]["produtos"], [])
+        self.cliente.post("/produto-remove", data=dados)
+        self.assertEqual(db_estoque_disponivel("EF3567942"), 1)
+        self.cliente.post(
+            "/produto-adiciona", data={"carrinho": segundo, "produto": "EF3567942"}
+        )
+        db_carrinho_delete(segundo)
+        self.assertEqual(db_estoque_disponivel("EF3567942"), 1)
+
+
+class TestAsgi(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        _PRODUTOS["ZZ0000000"] = ProdutoPersisted(
+            codigo="ZZ0000000",
+            descricao="Produto Teste",
+            preco_de=17000,
+            preco_por=17000,
+            estoque=1000,
+        )
+        self.addCleanup(_PRODUTOS.pop, "ZZ0000000")
+        _, res = await self._requisita("POST", "/novo")
+        self.carrinho = res["dados"]["carrinho_codigo"]
+        self.addCleanup(db_carrinho_delete, self.carrinho)
+
+    async def _requisita(
+        self, metodo, caminho, dados=None, json_=None, cabecalhos=None, multipart=None
+    ):
+        """
+        Chama a aplicação ASGI, retornando o status e o corpo decodificado (JSON).
+        """
+        cabecalhos = dict(cabecalhos or {})
+        corpo = b""
+        if dados is not None:
+            corpo = urlencode(dados).encode()
+            cabecalhos["content-type"] = "application/x-www-form-urlencoded"
+        elif multipart is not None:
+            limite, corpo = encode_multipart(multipart)
+            cabecalhos["content-type"] = "multipart/form-data; boundary=" + limite
+        elif json_ is not None:
+            corpo = json.dumps(json_).encode()
+            cabecalhos["content-type"] = "application/json"
+        cabecalhos["content-length"] = str(len(corpo))
+        caminho, _, consulta = caminho.partition("?")
+        escopo = {
+            "type": "http",
+            "http_version": "1.1",
+            "method": metodo,
+            "path": caminho,
+            "query_string": consulta.encode(),
+            "headers": [(k.encode(), v.encode()) for k, v in cabecalhos.items()],
+        }
+        recebidas = [{"type": "http.request", "body": corpo, "more_body": False}]
+        enviadas = []
+
+        async def receive():
+            return recebidas.pop(0)
+
+        async def send(mensagem):
+            enviadas.append(mensagem)
+
+        await asgi.app(escopo, receive, send)
+        self.ultimos_cabecalhos = {
+            k.decode().lower(): v.decode() for k, v in enviadas[0]["headers"]
+        }
+        corpo = b"".join(mensagem["body"] for mensagem in enviadas[1:])
+        tipo = self.ultimos_cabecalhos.get("content-type", "").split(";")[0]
+        if tipo == "application/x-ndjson":
+            return enviadas[0]["status"], [
+                json.loads(linha) for linha in corpo.splitlines()
+            ]
+        if tipo == "application/json":
+            return enviadas[0]["status"], json.loads(corpo)
+        return enviadas[0]["status"], corpo
+
+    async def test_corpo_json_e_multipart(self):
+        "Testa os parâmetros enviados em JSON e em multipart/form-data"
+        _, res = await self._requisita(
+            "POST",
+            "/produto-adiciona",
+            json_={"carrinho": self.carrinho, "produto": "AB1234567"},
+        )
+        self.assertTrue(res["sucesso"])
+        _, res = await self._requisita(
+            "POST",
+            "/produto-adiciona",
+            multipart={"carrinho": self.carrinho, "produto": "ZZ0000000"},
+        )
+        self.assertEqual(res, {"sucesso": True, "dados": {}})
+        _, res = await self._requisita(
+            "POST", "/limpa", cabecalhos={"content-type": "application/json"}
+        )
+        self.assertEqual(res["erro"]["tipo"], "BadRequest")
+        _, res = await self._requisita("GET", "/carrinho/{}".format(self.carrinho))
+        self.assertEqual(len(res["dados"]["produtos"]), 2)
+        self.assertEqual(db_estoque_disponivel("ZZ0000000"), 999)
+
+    async def test_mesma_representacao(self):
+        "Testa que as APIs síncrona e assíncrona alteram e retornam o mesmo carrinho"
+        for caminho, dados in (
+            ("/cliente-define", {"cliente": "123456"}),
+            ("/produto-adiciona", {"produto": "ZZ0000000"}),
+            ("/produto-adiciona", {"produto": "AB1234567"}),
+            ("/produto-define-quantidade", {"produto": "ZZ0000000", "quantidade": "3"}),
+            ("/produto-remove", {"produto": "AB1234567"}),
+            ("/cupom-define", {"cupom": "VALE10"}),
+        ):
+            dados["carrinho"] = self.carrinho
+            _, res = await self._requisita("POST", caminho, dados=dados)
+            self.assertEqual(res, {"sucesso": True, "dados": {}})
+        status, res = await self._requisita("GET", "/carrinho/{}".format(self.carrinho))
+        self.assertEqual(status, 200)
+        self.assertEqual(res["dados"]["totais"], {"subtotal": 510.0, "total": 500.0})
+        sincrona = app.test_client().get("/carrinho/{}".format(self.carrinho)).json
+        self.assertEqual(res, sincrona)
+        self.assertEqual(db_estoque_disponivel("ZZ0000000"), 997)
+
+    async def test_exporta(self):
+        "Testa a exportação de carrinhos em partes (corpo em várias mensagens) na ASGI"
+        codigos = _carrinhos_exportacao(self)
+        cabecalhos = _token_admin(self)
+        status, linhas = await self._requisita(
+            "POST",
+            "/carrinhos/exporta",
+            json_={"com_cliente": True},
+            cabecalhos={"authorization": cabecalhos["Authorization"]},
+        )
+        self.assertEqual(status, 200)
+        sincrona = app.test_client().post(
+            "/carrinhos/exporta", json={"com_cliente": True}, headers=cabecalhos
+        )
+        self.assertEqual(
+            linhas, [json.loads(linha) for linha in sincrona.data.splitlines()]
+        )
+        self.assertEqual(sorted(linha["codigo"] for linha in linhas), sorted(codigos[1:]))
+        _, res = await self._requisita(
+            "POST",
+            "/carrinhos/exporta",
+            json_=[],
+            cabecalhos={"authorization": cabecalhos["Authorization"]},
+        )
+        self.assertEqual(res["erro"]["tipo"], "FiltroInvalidoError")
+
+    async def test_etag_versao(self):
+        "Testa ETag, If-None-Match e If-Match na API assíncrona"
+        url = "/carrinho/{}".format(self.carrinho)
+        await self._requisita("GET", url)
+        etag = self.ultimos_cabecalhos["etag"]
+        status, _ = await self._requisita("GET", url, cabecalhos={"if-none-match": etag})
+        self.assertEqual(status, 304)
+        carrinho = carrinhos.db_carrinho_fetch(self.carrinho)
+        carrinho.define_cupom_desconto(
+            Cupom(codigo="PRAZO", valor=1000, validade=time.time() - 1)
+        )
+        await self._requisita("GET", url)
+        self.assertNotEqual(self.ultimos_cabecalhos["etag"], etag)
+        status, _ = await self._requisita(
+            "GET", url, cabecalhos={"if-none-match": self.ultimos_cabecalhos["etag"]}
+        )
+        self.assertEqual(status, 304)
+        _, res = await self._requisita(
+            "POST",
+            "/limpa",
+            dados={"carrinho": self.carrinho},
+            cabecalhos={"if-match": '"v99"'},
+        )
+        self.assertEqual(res["erro"]["tipo"], "CarrinhoVersaoConflitoError")
+        status, res = await self._requisita(
+            "POST", "/limpa", dados={"carrinho": self.carrinho, "versao": "v1"}
+        )
+        self.assertEqual(status, 400)
+        self.assertEqual(res["erro"]["tipo"], "VersaoInvalidaError")
+        status, _ = await self._requisita(
+            "POST",
+            "/limpa",
+            dados={"carrinho": self.carrinho},
+            cabecalhos={"if-match": "1"},
+        )
+        self.assertEqual(status, 400)
+
+    async def test_operacoes_e_erros(self):
+        "Testa operações em lote e o formato dos erros na API assíncrona"
+        url = "/carrinho/{}/operacoes".format(self.carrinho)
+        _, res = await self._requisita(
+            "POST",
+            url,
+            json_=[
+                {"operacao": "produto-adiciona", "produto": "CD7654321"},
+                {"operacao": "cupom-define", "cupom": "VALE10"},
+            ],
+        )
+        self.assertEqual(res["dados"]["totais"], {"subtotal": 250.0, "total": 240.0})
+        _, res = await self._requisita("POST", url, json_=[{"operacao": "explode"}])
+        self.assertEqual(res["erro"]["tipo"], "OperacaoInvalidaError")
+        _, res = await self._requisita("POST", "/limpa", dados={})
+        self.assertEqual(res["erro"]["tipo"], "BadRequestKeyError")
+        status, _ = await self._requisita("GET", "/inexistente")
+        self.assertEqual(status, 404)
+        status, _ = await self._requisita("GET", "/novo")
+        self.assertEqual(status, 405)
+
+    async def test_concorrencia(self):
+        "Testa alterações concorrentes em um mesmo carrinho com persistência bloqueante"
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        self.addCleanup(db_carrinho_define_backend, carrinhos._CARRINHOS)
+        db_carrinho_define_backend(
+            CarrinhosSQLite(os.path.join(diretorio.name, "carrinhos.db"))
+        )
+        _, res = await self._requisita("POST", "/novo")
+        codigo = res["dados"]["carrinho_codigo"]
+        self.addCleanup(db_carrinho_delete, codigo)
+        adicoes = 50
+        respostas = await asyncio.gather(
+            *(
+                self._requisita(
+                    "POST",
+                    "/produto-adiciona",
+                    dados={"carrinho": codigo, "produto": "ZZ0000000"},
+                )
+                for _ in range(adicoes)
+            )
+        )
+        self.assertTrue(all(res["sucesso"] for _, res in respostas))
+        _, res = await self._requisita("GET", "/carrinho/{}".format(codigo))
+        self.assertEqual(res["dados"]["produtos"][0]["quantidade"], adicoes)
+
+    async def test_ciclo_de_vida(self):
+        "Testa os eventos de início e fim do servidor (lifespan)"
+        recebidas = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+        enviadas = []
+
+        async def receive():
+            return recebidas.pop(0)
+
+        async def send(mensagem):
+            enviadas.append(mensagem["type"])
+
+        await asgi.app({"type": "lifespan"}, receive, send)
+        self.assertEqual(
+            enviadas, ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+        )
+
+
+class TestMetricas(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(metricas.define_metricas, metricas._METRICAS)
+        metricas.define_metricas(metricas.Metricas(ativas=True))
+
+    def test_requisicoes_e_erros(self):
+        "Testa o registro de latência e erros por rota e a exportação em /metrics"
+        cliente = app.test_client()
+        codigo = cliente.post("/novo").json["dados"]["carrinho_codigo"]
+        self.addCleanup(db_carrinho_delete, codigo)
+        cliente.post("/produto-adiciona", data={"carrinho": codigo, "produto": "XX"})
+        cliente.get("/carrinho/{}".format(codigo))
+        res = cliente.get("/metrics")
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.content_type.startswith("text/plain; version=0.0.4"))
+        texto = res.get_data(as_text=True)
+        self.assertIn('api_carrinho_requisicao_segundos_count{rota="/novo"} 1', texto)
+        self.assertIn(
+            "api_carrinho_requisicao_segundos_bucket"
+            '{rota="/carrinho/<codigo>",le="+Inf"} 1',
+            texto,
+        )
+        self.assertIn(
+            'api_carrinho_erros_total{rota="/produto-adiciona",'
+            'tipo="ProdutoNaoExisteError"} 1',
+            texto,
+        )
+        self.assertRegex(texto, r"\napi_carrinho_carrinhos [1-9]")
+
+    def test_totais_e_desativadas(self):
+        "Testa o tempo de atualização dos totais e /metrics com as métricas desativadas"
+        carrinho = Carrinho(cliente=None)
+        carrinho.adiciona_produto(_produto_teste("A"))
+        carrinho.define_produto_quantidade("A", 2)
+        Carrinho.desserializa(carrinho.serializa())
+        texto = metricas.exporta()
+        self.assertIn('api_carrinho_totais_segundos_count{tipo="incremental"} 2', texto)
+        self.assertIn('api_carrinho_totais_segundos_count{tipo="completo"} 1', texto)
+        metricas.define_metricas(metricas.Metricas(ativas=False))
+        self.assertIsNone(Carrinho.ao_atualizar_totais)
+        self.assertEqual(app.test_client().get("/metrics").status_code, 404)
+
+
+class TestGunicornConf(unittest.TestCase):
+    def test_workers(self):
+        "Testa que mais de um worker só é aceito com carrinhos compartilhados"
+        servidor = mock.Mock()
+        self.assertGreaterEqual(gunicorn_conf.threads, 2)
+        with mock.patch.object(gunicorn_conf, "workers", 4):
+            for backend in ("memoria", "diario"):
+                with mock.patch.dict(os.environ, {"CARRINHOS_BACKEND": backend}):
+                    with self.assertRaises(SystemExit):
+                        gunicorn_conf.on_starting(servidor)
+            with mock.patch.dict(os.environ, {"CARRINHOS_BACKEND": "sqlite"}):
+                gunicorn_conf.on_starting(servidor)
+        with mock.patch.dict(os.environ, {"CARRINHOS_BACKEND": "memoria"}):
+            gunicorn_conf.on_starting(servidor)
+
+
+class TestSerializacao(unittest.TestCase):
+    def test_mesmo_formato(self):
+        "Testa que o orjson e a biblioteca padrão serializam no mesmo formato"
+        dados = {"b": [1, 2.5, None, True], "a": {"descricao": "Camiseta Pólo"}}
+        corpo = serializacao.codifica(dados)
+        self.assertEqual(corpo, serializacao._codifica_json(dados))
+        self.assertEqual(
+            corpo, '{"a":{"descricao":"Camiseta Pólo"},"b":[1,2.5,null,true]}\n'.encode()
+        )
+        self.assertEqual(serializacao.decodifica(corpo), dados)
+        with self.assertRaises(ValueError):
+            serializacao.decodifica(b"{")
+
+
+class TestPerfil(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(perfil.define_perfilador, perfil._PERFILADOR)
+        self.cliente = app.test_client()
+        self.codigo = self.cliente.post("/novo").json["dados"]["carrinho_codigo"]
+        self.addCleanup(db_carrinho_delete, self.codigo)
+
+    def test_log(self):
+        "Testa o perfil das funções mais custosas de uma requisição no log"
+        perfil.define_perfilador(perfil.Perfilador(amostragem=1.0, top=5))
+        with self.assertLogs("__main__", "INFO") as logs:
+            self.cliente.post(
+                "/produto-adiciona",
+                data={"carrinho": self.codigo, "produto": "AB1234567"},
+            )
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn(
+            "perfil de /produto-adiciona (carrinho {}".format(self.codigo), logs.output[0]
+        )
+        self.assertIn("cumulative", logs.output[0])
+
+    def test_arquivo_e_amostragem(self):
+        "Testa a gravação do perfil em arquivo e a amostragem desativada"
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        perfil.define_perfilador(
+            perfil.Perfilador(amostragem=1.0, diretorio=diretorio.name)
+        )
+        self.cliente.get("/carrinho/{}".format(self.codigo))
+        arquivos = os.listdir(diretorio.name)
+        self.assertEqual(len(arquivos), 1)
+        self.assertIn("carrinho_codigo-{}-".format(self.codigo), arquivos[0])
+        self.assertTrue(arquivos[0].endswith(".prof"))
+        pstats.Stats(os.path.join(diretorio.name, arquivos[0]))
+        perfil.define_perfilador(
+            perfil.Perfilador(amostragem=0.0, diretorio=diretorio.name)
+        )
+        self.cliente.get("/carrinho/{}".format(self.codigo))
+        self.assertEqual(len(os.listdir(diretorio.name)), 1)
+
+
+class TestLog(unittest.TestCase):
+    def test_erros_esperados(self):
+        "Testa o registro dos erros de negócio esperados sem o traceback"
+        with self.assertLogs("__main__", "INFO") as logs:
+            res = app.test_client().get(
+                "/carrinho/{}".format(Carrinho(cliente=None).codigo)
+            )
+        self.assertEqual(res.json["erro"]["tipo"], "CarrinhoNaoExisteError")
+        self.assertEqual(logs.records[0].levelname, "INFO")
+        self.assertIsNone(logs.records[0].exc_info)
+        self.assertIn("CarrinhoNaoExisteError", logs.output[0])
+
+    def test_fila_json(self):
+        "Testa a escrita dos registros pela fila no formato JSON"
+        saida = io.StringIO()
+        handler, ouvinte = cria_fila("json", saida)
+        logger = logging.getLogger("tests.fila")
+        logger.propagate = False
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        ouvinte.start()
+        logger.warning("carrinho %s", "abc", extra={"rota": "/novo"})
+        try:
+            raise ValueError("teste")
+        except ValueError:
+            logger.exception("falhou")
+        ouvinte.stop()
+        linhas = [json.loads(linha) for linha in saida.getvalue().splitlines()]
+        self.assertEqual(len(linhas), 2)
+        self.assertEqual(linhas[0]["mensagem"], "carrinho abc")
+        self.assertEqual(linhas[0]["nivel"], "WARNING")
+        self.assertEqual(linhas[0]["rota"], "/novo")
+        self.assertTrue(linhas[0]["instante"].endswith("Z"))
+        self.assertNotIn("excecao", linhas[0])
+        self.assertIn("ValueError: teste", linhas[1]["excecao"])
+
+
+class TestPersistEstoque(unittest.TestCase):
+    def test_reserva(self):
+        "Testa reserva e liberação de estoque"
+        reservas = ReservasEstoque()
+        reservas.reserva("CD7654321", 3, 5)
+        self.assertEqual(reservas.disponivel("CD7654321", 5), 2)
+        with self.assertRaises(ProdutoSemEstoqueError):
+            reservas.reserva("CD7654321", 3, 5)
+        self.assertEqual(reservas.reservado("CD7654321"), 3)
+        reservas.reserva("CD7654321", 3, None)
+        self.assertEqual(reservas.reservado("CD7654321"), 6)
+        reservas.libera("CD7654321", 6)
+        self.assertEqual(reservas.disponivel("CD7654321", 5), 5)
+
+    def test_transacao_desfaz(self):
+        "Testa que uma transação desfaz suas reservas e liberações"
+        reservas = ReservasEstoque()
+        reservas.reserva("CD7654321", 2, 5)
+        transacao = TransacaoReservas(reservas)
+        transacao.reserva("CD7654321", 3, 5)
+        transacao.libera("CD7654321", 1)
+        transacao.reserva("AB1234567", 1, 10)
+        self.assertEqual(reservas.reservado("CD7654321"), 4)
+        transacao.desfaz()
+        self.assertEqual(reservas.reservado("CD7654321"), 2)
+        self.assertEqual(reservas.reservado("AB1234567"), 0)
+
+
+class TestPersistCupons(unittest.TestCase):
+    def test_regra(self):
+        "Testa a leitura e a validação das regras dos cupons"
+        jsonl = io.StringIO(
+            '{"codigo": "A", "valor": 5}\n'
+            "\n"
+            '{"codigo": "B", "percentual": 10, "produtos": ["X1"],'
+            ' "validade": "2030-01-31T12:00:00"}\n'
+        )
+        regras = list(cupons.le_jsonl(jsonl))
+        self.assertEqual([regra.codigo for regra in regras], ["A", "B"])
+        cupom = regras[1].compila()
+        self.assertEqual(cupom.produtos, frozenset({"X1"}))
+        self.assertEqual(cupom.validade, datetime(2030, 1, 31, 12).timestamp())
+        for invalida in (
+            [],
+            {"valor": 5},
+            {"codigo": "C", "valor": -1},
+            {"codigo": "C", "percentual": 101},
+            {"codigo": "C", "valor": 1, "percentual": 1},
+            {"codigo": "C", "produtos": "X1"},
+            {"codigo": "C", "validade": "ontem"},
+        ):
+            with self.assertRaises(ValueError):
+                cupons.regra(invalida)
+        with self.assertRaisesRegex(ValueError, "linha 2"):
+            list(cupons.le_jsonl(io.StringIO('{"codigo": "A"}\n{}\n')))
+
+    def test_aplicaveis(self):
+        "Testa os índices do cadastro de cupons e a busca dos aplicáveis ao carrinho"
+        ontem = datetime.now() - timedelta(days=1)
+        cadastro = cupons.CadastroCupons(
+            [
+                cupons.CupomPersisted(codigo="FIXO", valor=1000),
+                cupons.CupomPersisted(
+                    codigo="MINIMO", valor=5000, subtotal_minimo=100000
+                ),
+                cupons.CupomPersisted(codigo="A20", percentual=20.0, produtos=["A"]),
+                cupons.CupomPersisted(codigo="AB5", percentual=5.0, produtos=["A", "B"]),
+                cupons.CupomPersisted(codigo="C", valor=9900, produtos=["C"]),
+                cupons.CupomPersisted(codigo="VENCIDO", valor=9900, validade=ontem),
+            ]
+        )
+        self.assertEqual(len(cadastro), 6)
+        with self.assertRaises(cupons.CupomNaoExisteError):
+            cadastro.fetch("NENHUM")
+        with self.assertRaises(cupons.CupomExpiradoError):
+            cadastro.fetch("VENCIDO")
+        with self.assertRaises(ValueError):
+            cupons.CadastroCupons(
+                [cupons.CupomPersisted("X"), cupons.CupomPersisted("X")]
+            )
+        carrinho = Carrinho(cliente=None)
+        for codigo, preco in (("A", 10000), ("B", 4000), ("D", 100)):
+            carrinho.adiciona_produto(
+                Produto(
+                    codigo=codigo,
+                    descricao=None,
+                    preco_de=preco,
+                    preco_por=preco,
+                    quantidade=1,
+                )
+            )
+        self.assertEqual(
+            [
+                (cupom.codigo, desconto)
+                for cupom, desconto in cadastro.aplicaveis(carrinho)
+            ],
+            [("A20", 2000), ("FIXO", 1000), ("AB5", 700)],
+        )
+        # O desconto calculado pelo cadastro é o mesmo dos totalizadores do carrinho.
+        carrinho.define_cupom_desconto(cadastro.fetch("AB5"))
+        self.assertEqual(carrinho.desconto_centavos(), 700)
+
+
+class TestPersistProdutos(unittest.TestCase):
+    def test_fetch_many_memoria(self):
+        "Testa a consulta de vários produtos de uma vez no cadastro em memória"
+        cadastro = ProdutosMemoria(_PRODUTOS)
+        produtos = cadastro.fetch_many(["AB1234567", "XX0000000", "CD7654321"])
+        self.assertEqual(set(produtos), {"AB1234567", "CD7654321"})
+        self.assertIs(produtos["AB1234567"], _PRODUTOS["AB1234567"])
+
+    def test_importa_sqlite(self):
+        "Testa a importação do cadastro em CSV e JSONL e as consultas no SQLite"
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        caminho = os.path.join(diretorio.name, "produtos.db")
+        csv = io.StringIO(
+            "codigo,descricao,preco_de,preco_por,estoque\n"
+            "AB1234567,Camiseta Pólo,170.0,170.0,10\n"
+            "CD7654321,Calça Jeans,280.0,250.0,5\n"
+        )
+        self.assertEqual(importa(caminho, le_csv(csv)), 2)
+        cadastro = ProdutosSQLite(caminho)
+        self.assertEqual(cadastro.fetch("CD7654321"), _PRODUTOS["CD7654321"])
+        with self.assertRaises(ProdutoNaoExisteError):
+            cadastro.fetch("EF3567942")
+        codigos = ["C{:06d}".format(i) for i in range(1200)]
+        jsonl = io.StringIO(
+            "".join(
+                json.dumps(
+                    {
+                        "codigo": codigo,
+                        "descricao": codigo,
+                        "preco_de": 1.0,
+                        "preco_por": 1.0,
+                        "estoque": 1,
+                    }
+                )
+                + "\n"
+                for codigo in codigos
+            )
+        )
+        self.assertEqual(importa(caminho, le_jsonl(jsonl)), 1200)
+        cadastro = ProdutosSQLite(caminho)
+        produtos = cadastro.fetch_many(codigos + ["AB1234567"])
+        self.assertEqual(len(produtos), 1200)
+        self.assertEqual(produtos["C000999"].descricao, "C000999")
+
+    def test_atualiza_precos_sqlite(self):
+        "Testa a atualização de preços no cadastro SQLite, vista pelos outros processos"
+        diretorio = tempfile.TemporaryDirectory()
+        self.addCleanup(diretorio.cleanup)
+        caminho = os.path.join(diretorio.name, "produtos.db")
+        csv = io.StringIO(
+            "codigo,descricao,preco_de,preco_por,estoque\n"
+            "AB1234567,Camiseta Pólo,170.0,170.0,10\n"
+        )
+        importa(caminho, le_csv(csv))
+        cache = ProdutosCache(ProdutosSQLite(caminho))
+        outro = ProdutosSQLite(caminho)
+        self.assertEqual(cache.fetch("AB1234567").preco_por, 17000)
+        self.assertEqual(outro.fetch("AB1234567").preco_por, 17000)
+        cache.atualiza_precos({"AB1234567": (17000, 14990), "XX0000000": (1, 1)})
+        self.assertEqual(cache.fetch("AB1234567").preco_por, 14990)
+        self.assertEqual(outro.fetch("AB1234567").preco_por, 14990)
+        with self.assertRaises(ProdutoNaoExisteError):
+            outro.fetch("XX0000000")
+
+
+class _ProdutosContados(ProdutosMemoria):
+    """
+    Cadastro em memória que conta as consultas e pode demorar a responder.
+    """
+
+    def __init__(self, espera: float = 0.0) -> None:
+        super().__init__(_PRODUTOS)
+        self.espera = espera
+        self.consultas = 0
+
+    def fetch(self, codigo: str) -> ProdutoPersisted:
+        self.consultas += 1
+        time.sleep(self.espera)
+        return super().fetch(codigo)
+
+    def fetch_many(self, codigos):
+        self.consultas += 1
+        return super().fetch_many(codigos)
+
+
+class TestPersistProdutosCache(unittest.TestCase):
+    def test_acertos_e_negativo(self):
+        "Testa o cache de produtos existentes e inexistentes"
+        origem = _ProdutosContados()
+        cache = ProdutosCache(origem)
+        for _ in range(3):
+            self.assertIs(cache.fetch("AB1234567"), _PRODUTOS["AB1234567"])
+            with self.assertRaises(ProdutoNaoExisteError):
+                cache.fetch("XX0000000")
+        self.assertEqual(origem.consultas, 2)
+        self.assertEqual(
+            cache.estatisticas(),
+            {"produtos": 2, "acertos": 4, "falhas": 2, "descartados": 0},
+        )
+        produtos = cache.fetch_many(["AB1234567", "CD7654321", "XX0000000"])
+        self.assertEqual(set(produtos), {"AB1234567", "CD7654321"})
+        self.assertEqual(origem.consultas, 3)
+
+    def test_ttl_maximo_invalida(self):
+        "Testa expiração, tamanho máximo e invalidação do cache de produtos"
+        origem = _ProdutosContados()
+        cache = ProdutosCache(origem, maximo=2, ttl=0.0)
+        cache.fetch("AB1234567")
+        cache.fetch("AB1234567")
+        self.assertEqual(origem.consultas, 2)
+        cache = ProdutosCache(origem, maximo=2)
+        for codigo in ("AB1234567", "CD7654321", "EF3567942"):
+            cache.fetch(codigo)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.estatisticas()["descartados"], 1)
+        origem.consultas = 0
+        cache.fetch("EF3567942")
+        cache.invalida("EF3567942")
+        cache.fetch("EF3567942")
+        self.assertEqual(origem.consultas, 1)
+        cache.invalida()
+        self.assertEqual(len(cache), 0)
+
+    def test_consulta_unica(self):
+        "Testa que consultas simultâneas ao mesmo produto fazem uma só consulta"
+        origem = _ProdutosContados(espera=0.05)
+        cache = ProdutosCache(origem)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            produtos = list(executor.map(lambda _: cache.fetch("AB1234567"), range(8)))
+        self.assertEqual(origem.consultas, 1)
+        self.assertTrue(all(produto is _PRODUTOS["AB1234567"] for produto in produtos))
+
+
+class TestCacheRespostas(unittest.TestCase):
+    def test_versao(self):
+        "Testa que uma resposta só é usada na mesma versão em que foi gravada"
+        cache = CacheRespostas(maximo=10)
+        cache.grava("a", 1, b"um")
+        self.assertEqual(cache.obtem("a", 1), b"um")
+        self.assertIsNone(cache.obtem("a", 2))
+        cache.invalida("a")
+        self.assertIsNone(cache.obtem("a", 1))
+
+    def test_maximo(self):
+        "Testa descarte das respostas usadas há mais tempo"
+        cache = CacheRespostas(maximo=2)
+        cache.grava("a", 1, b"a")
+        cache.grava("b", 1, b"b")
+        cache.obtem("a", 1)
+        cache.grava("c", 1, b"c")
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.obtem("b", 1))
+        self.assertEqual(cache.obtem("a", 1), b"a")
 
 
 if __name__ == "__main__":
@@ -74,6 +74,25 @@ def main():
     api_post("/cupom-define", dados={"carrinho": carrinho, "cupom": "BLACKFRIDAY15"})
     log.info("obtendo o carrinho completo da api")
     api_get("/carrinho/{}".format(carrinho))
+    log.info("aplica operações em lote no carrinho")
+    res = requests.post(
+        url="{}/carrinho/{}/operacoes".format(WEBSERVICE, carrinho),
+        timeout=5,
+        json=[
+            {"operacao": "limpa"},
+            {"operacao": "produto-adiciona", "produto": "CD7654321"},
+            {
+                "operacao": "produto-define-quantidade",
+                "produto": "CD7654321",
+                "quantidade": 2,
+            },
+            {"operacao": "cupom-define", "cupom": "VALE10"},
+        ],
+    )
+    log.debug("retorno do api:\n%s", pformat(res.json()))
+    assert res.json()["dados"]["totais"] == {"subtotal": 500.0, "total": 490.0}
+    log.info("limpa o carrinho, liberando o estoque reservado")
+    api_post("/limpa", dados={"carrinho": carrinho})
 
 
 if __name__ == "__main__":